@@ -1,160 +1,693 @@
-from flask import Flask, render_template, request, send_from_directory, redirect, url_for, jsonify
-import os, io
+from flask import Flask, render_template, request, send_file, redirect, url_for, jsonify, Response
+import os
+import json
+import logging
+import zipfile
 import uuid
-import time # Import time for cleanup
+import hashlib
+import importlib.metadata
+import time
+import threading
 from rembg import remove
 from PIL import Image
 import subprocess
+import signal # To kill superseded tracer processes
 import sys # To get the current python executable
-import shutil # To find executable path
+import multiprocessing # Available job pool start methods
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_for_futures # Parallel vtracer tiles, batch jobs
+from collections import deque
+from rembg_cache import RembgCache
+from rembg_session import RembgSessionManager
+from svg_cache import SvgCache
+from storage import ContentStore, make_backend, STORAGE_BACKENDS
+from janitor import Janitor
+import batch
+import metrics
+from log_config import configure_logging
+from prometheus_client import REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from jobs import JobQueue, QueueFullError, QueueClosedError, JobCancelledError
+import preprocessing
+import uploads
+import scaling
+import tracing
+import svg_optimize
+import matting
+import http_cache
+
+# Leveled logging for the web process and the job workers (which import this module too)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO') # DEBUG also logs tool command lines and cache lookups
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text') # 'text' or 'json' (one object per line)
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 UPLOAD_FOLDER = "processing/input"
 OUTPUT_FOLDER = "processing/output"
 TEMP_FOLDER = "processing/temp" # Keep temp folder for intermediate files during processing
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+CACHE_FOLDER = "processing/cache" # Content-addressed caches (rembg mattes)
+SVG_CACHE_VERSION = 2 # Bump when a change to the tracing pipeline should invalidate cached SVGs
 CLEANUP_AGE_SECONDS = 3600 # 1 hour
-
-for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER]:
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', 2 * 1024 * 1024 * 1024)) # 2 GB for output/temp, 0 = no quota
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local') # Upload store: 'local' (UPLOAD_FOLDER) or 's3' (uploads only, SVGs and the rembg cache stay local)
+STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET', '')
+STORAGE_S3_PREFIX = os.environ.get('STORAGE_S3_PREFIX', 'uploads/')
+STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL', '') # e.g. http://minio:9000 for an S3-compatible server
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('JANITOR_INTERVAL_SECONDS', 30)) # Expiry/quota check interval
+JANITOR_SWEEP_SECONDS = int(os.environ.get('JANITOR_SWEEP_SECONDS', 600)) # Full directory rescan interval
+REMBG_CACHE_MAX_BYTES = int(os.environ.get('REMBG_CACHE_MAX_BYTES', 512 * 1024 * 1024)) # 512 MB
+SVG_CACHE_MAX_BYTES = int(os.environ.get('SVG_CACHE_MAX_BYTES', 512 * 1024 * 1024)) # 512 MB of SVGs in OUTPUT_FOLDER
+# rembg / onnxruntime session settings
+REMBG_MODEL = os.environ.get('REMBG_MODEL', 'u2net')
+REMBG_PRELOAD = os.environ.get('REMBG_PRELOAD', '1') == '1' # Load the model at startup instead of on first request
+REMBG_WARMUP = os.environ.get('REMBG_WARMUP', '1') == '1' # Run one warm-up inference after loading
+REMBG_INTRA_OP_THREADS = int(os.environ.get('REMBG_INTRA_OP_THREADS', 0)) # 0 = onnxruntime default
+REMBG_INTER_OP_THREADS = int(os.environ.get('REMBG_INTER_OP_THREADS', 0)) # 0 = onnxruntime default
+REMBG_PROVIDERS = [p.strip() for p in os.environ.get('REMBG_PROVIDERS', '').split(',') if p.strip()] # e.g. "CPUExecutionProvider"
+# Job pool settings: uploads and reprocess requests are queued and run on a bounded worker pool
+JOB_EXECUTOR = os.environ.get('JOB_EXECUTOR', 'process') # 'process' or 'thread'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', min(4, os.cpu_count() or 1))) # Concurrent jobs
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 16)) # Jobs waiting for a worker before answering 429
+# Fresh worker processes, onnxruntime is not fork-safe. The fork server imports this module once before
+# forking the workers, so they start in well under a second and share the imported libraries' memory.
+JOB_START_METHOD = os.environ.get('JOB_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+JOB_MAX_TASKS_PER_WORKER = int(os.environ.get('JOB_MAX_TASKS_PER_WORKER', 500)) # Recycle a job worker after this many jobs to bound memory growth, 0 = never
+JOB_DRAIN_SECONDS = int(os.environ.get('JOB_DRAIN_SECONDS', 25)) # On shutdown, time running jobs get to finish before they are cancelled
+# Upload limits, enforced while the upload is streamed to disk and from the image header, before any decoding
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 50 * 1024 * 1024)) # Per image, 0 = no limit
+MAX_UPLOAD_PIXELS = int(os.environ.get('MAX_UPLOAD_PIXELS', 100_000_000)) # width * height per image, 0 = no limit
+# Batch conversion (/batch)
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 100)) # Files per batch request (including ZIP members)
+BATCH_MAX_FILE_BYTES = int(os.environ.get('BATCH_MAX_FILE_BYTES', MAX_UPLOAD_BYTES)) # Per image, also caps ZIP members
+BATCH_MAX_REQUEST_BYTES = int(os.environ.get('BATCH_MAX_REQUEST_BYTES', 512 * 1024 * 1024)) # Whole /batch request body, 0 = no limit
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', JOB_WORKERS)) # Jobs a single batch keeps in flight
+CANCEL_POLL_SECONDS = 0.1 # How often a running potrace/vtracer checks whether its job was superseded
+# Working-resolution policy for large uploads (pixel counts, 0 = no limit)
+MAX_WORKING_PIXELS = int(os.environ.get('MAX_WORKING_PIXELS', 16_000_000)) # Larger uploads are downscaled before processing
+REMBG_MASK_MAX_PIXELS = int(os.environ.get('REMBG_MASK_MAX_PIXELS', 2_000_000)) # rembg/matting runs at this size, the mask is upscaled
+MATTING_ENGINE = os.environ.get('MATTING_ENGINE', 'closed_form') # 'closed_form' (rembg), or 'guided': NumPy color model and guided filter on the uncertain band
+VTRACER_TILE_SIZE = int(os.environ.get('VTRACER_TILE_SIZE', 0)) # Tile edge in pixels for tiled color tracing, 0 = off
+VTRACER_TILE_OVERLAP = int(os.environ.get('VTRACER_TILE_OVERLAP', 2)) # Pixels tiles overlap to hide seams
+VTRACER_TILE_WORKERS = int(os.environ.get('VTRACER_TILE_WORKERS', max(1, (os.cpu_count() or 1) // JOB_WORKERS))) # vtracer processes per job
+# Tracing backend: in-process Python bindings or the potrace/vtracer CLIs
+COLOR_ENGINE = os.environ.get('COLOR_ENGINE', 'vtracer') # 'vtracer', or 'layers': NumPy palette, one potrace per color layer in parallel
+COLOR_LAYER_WORKERS = int(os.environ.get('COLOR_LAYER_WORKERS', max(1, (os.cpu_count() or 1) // JOB_WORKERS))) # potrace processes per job with the 'layers' engine
+TRACER_BACKEND = os.environ.get('TRACER_BACKEND', 'auto') # 'auto' (bindings when installed), 'python' or 'cli'
+INPROCESS_TRACE_MAX_PIXELS = int(os.environ.get('INPROCESS_TRACE_MAX_PIXELS', 4_000_000)) # Larger images use the CLI, which can be killed when superseded, 0 = no limit
+# Post-processing of the generated SVGs
+SVG_OPTIMIZE = os.environ.get('SVG_OPTIMIZE', '1') == '1' # Round coordinates, merge paths and minify (see svg_optimize.py)
+SVG_PRECOMPRESS = os.environ.get('SVG_PRECOMPRESS', '1') == '1' # Write .svg.gz (and .svg.br with brotli installed) next to each SVG
+# Progressive preview: a quick low-resolution trace is queued ahead of the full one
+PREVIEW_ENABLED = os.environ.get('PREVIEW_ENABLED', '1') == '1'
+PREVIEW_MAX_PIXELS = int(os.environ.get('PREVIEW_MAX_PIXELS', 250_000)) # Working resolution of the preview, smaller uploads get none
+# Serving uploads and SVGs: their content never changes under a given name
+HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 31_536_000)) # Cache-Control max-age (with immutable), 0 = revalidate on every use
+SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER', 'none') # 'x-sendfile' or 'x-accel-redirect': the front proxy sends the file bytes
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected/') # nginx internal location aliased to the processing folder
+
+for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER, CACHE_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
+# Bodies above this are refused while the request is parsed (413), before they are spooled to disk;
+# the extra megabyte covers the form fields. /batch raises the limit for its own requests.
+app.config['MAX_CONTENT_LENGTH'] = (MAX_UPLOAD_BYTES + 1024 * 1024) if MAX_UPLOAD_BYTES else None
+if MAX_UPLOAD_PIXELS:
+    Image.MAX_IMAGE_PIXELS = MAX_UPLOAD_PIXELS # Pillow's decompression bomb guard, also applies in the job workers
+if SENDFILE_HEADER not in http_cache.SENDFILE_HEADERS:
+    logger.warning(f"Unknown SENDFILE_HEADER '{SENDFILE_HEADER}', sending files from the app.")
+    SENDFILE_HEADER = 'none'
+app.config['USE_X_SENDFILE'] = SENDFILE_HEADER != 'none' # send_file() then neither opens nor streams the file
+
+# Cache of RGBA mattes keyed on (input file hash, rembg params), so vectorizer-only changes skip rembg
+rembg_cache = RembgCache(os.path.join(CACHE_FOLDER, "rembg"), CLEANUP_AGE_SECONDS, REMBG_CACHE_MAX_BYTES)
+
+# Uploads are stored once per content (sharded by SHA-256), each upload holds a reference to its blob
+if STORAGE_BACKEND not in STORAGE_BACKENDS:
+    logger.warning(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', using 'local'.")
+    STORAGE_BACKEND = 'local'
+upload_store = ContentStore(
+    make_backend(STORAGE_BACKEND, UPLOAD_FOLDER, STORAGE_S3_BUCKET, STORAGE_S3_PREFIX, STORAGE_S3_ENDPOINT_URL),
+    UPLOAD_FOLDER, CLEANUP_AGE_SECONDS)
+
+# Generated SVGs are named after (input file hash, normalized params), identical requests reuse them
+svg_cache = SvgCache(OUTPUT_FOLDER, CLEANUP_AGE_SECONDS, SVG_CACHE_MAX_BYTES,
+                     variant_suffixes=svg_optimize.CONTENT_CODINGS.values())
+try:
+    REMBG_VERSION = importlib.metadata.version('rembg') # Part of the SVG cache key
+except importlib.metadata.PackageNotFoundError:
+    REMBG_VERSION = None
+# Strong ETags of the served SVGs and their precompressed variants (hash of the bytes)
+file_etags = http_cache.FileEtags()
+
+# Removes old SVGs and temp files in the background instead of on every request, and expires
+# upload references (removing the blobs nobody references anymore) and evicts the rembg and SVG
+# caches after every sweep, or earlier when a job result pushes a cache over its limit
+janitor = Janitor(
+    [OUTPUT_FOLDER, TEMP_FOLDER],
+    max_age_seconds=CLEANUP_AGE_SECONDS,
+    quota_bytes=STORAGE_QUOTA_BYTES,
+    interval_seconds=JANITOR_INTERVAL_SECONDS,
+    sweep_seconds=JANITOR_SWEEP_SECONDS,
+    collectors=[upload_store.collect, rembg_cache.evict, svg_cache.evict],
+)
+
+# One onnxruntime session shared by all requests, loaded once instead of lazily per call
+rembg_sessions = RembgSessionManager(
+    model_name=REMBG_MODEL,
+    intra_op_threads=REMBG_INTRA_OP_THREADS,
+    inter_op_threads=REMBG_INTER_OP_THREADS,
+    providers=REMBG_PROVIDERS or None,
+    warmup=REMBG_WARMUP,
+) # Preloaded by start_background_services (thread mode) or init_job_worker (process mode)
+
+# Chosen once per process (web process and each job worker) instead of looking up the tools per request
+if TRACER_BACKEND not in tracing.BACKENDS:
+    logger.warning(f"Unknown TRACER_BACKEND '{TRACER_BACKEND}', using 'auto'.")
+    TRACER_BACKEND = 'auto'
+tracers = {tool: tracing.select_tracer(tool, TRACER_BACKEND) for tool in ('potrace', 'vtracer')}
+if COLOR_ENGINE not in ('vtracer', 'layers'):
+    logger.warning(f"Unknown COLOR_ENGINE '{COLOR_ENGINE}', using 'vtracer'.")
+    COLOR_ENGINE = 'vtracer'
+if MATTING_ENGINE not in matting.MATTING_ENGINES:
+    logger.warning(f"Unknown MATTING_ENGINE '{MATTING_ENGINE}', using 'closed_form'.")
+    MATTING_ENGINE = 'closed_form'
+logger.debug(f"Tracing backends: {', '.join(f'{tool}={tracer.backend}' for tool, tracer in tracers.items())}")
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# --- New Cleanup Function ---
-def cleanup_old_files(directory, max_age_seconds):
-    """Removes files in the specified directory older than max_age_seconds."""
-    now = time.time()
-    cleaned_count = 0
-    print(f"Running cleanup for directory: {directory}")
+# --- Background Removal (rembg) ---
+def build_rembg_params(mode, color_threshold):
+    """
+    Builds the rembg.remove() keyword arguments for the given mode.
+    Args:
+        mode (str): 'bw' or 'color'.
+        color_threshold (int): Color mode threshold slider value (0-100), ignored for 'bw'.
+    Returns:
+        dict: rembg parameters.
+    """
+    rembg_params = { # Default params
+        "alpha_matting": MATTING_ENGINE == 'closed_form', # Otherwise matting.guided_cutout() runs on the mask
+        "alpha_matting_foreground_threshold": 235,
+        "alpha_matting_background_threshold": 15,
+        "alpha_matting_erode_size": 1
+    }
+    if mode == 'color':
+        # Map slider 0-100 to rembg thresholds for color mode (non-linear scaling)
+        # Slider 0 (vorsichtig): fg=250, bg=10
+        # Slider 100 (aggressiv): fg=225, bg=35
+        # Use cubic scaling for finer control at low values, even more aggressive at high values
+        normalized_slider = color_threshold / 100.0
+        scaled_slider = normalized_slider ** 3 # Cubic scaling
+        rembg_params["alpha_matting_foreground_threshold"] = round(250 - scaled_slider * 25) # Range 250 -> 225
+        rembg_params["alpha_matting_background_threshold"] = round(10 + scaled_slider * 25) # Range 10 -> 35
+    return rembg_params
+
+class TimedSession:
+    """
+    Wraps a rembg session so model inference is timed apart from the alpha matting around it.
+    The raw segmentation masks of the last prediction are kept in masks, so they can be stored.
+    """
+
+    def __init__(self, session, timer):
+        self._session = session
+        self._timer = timer
+        self.masks = None
+
+    def predict(self, *args, **kwargs):
+        with self._timer.stage('rembg'):
+            self.masks = self._session.predict(*args, **kwargs)
+        return self.masks
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+class StoredMaskSession:
+    """Stands in for the rembg session with a stored segmentation mask, remove() then only runs the matting."""
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def predict(self, *args, **kwargs):
+        return [self.mask]
+
+def segmentation_mask_path(input_path, mask_size):
+    """
+    Path of the stored raw segmentation mask of an upload: next to the upload's blob, so identical
+    uploads share it and it is removed with the blob. The mask only depends on the model and the size it was predicted at,
+    not on the matting thresholds, so every mode and threshold of the upload can share it.
+    """
+    return f"{os.path.splitext(input_path)[0]}.mask-{REMBG_MODEL}-{mask_size[0]}x{mask_size[1]}.png"
+
+def load_segmentation_mask(mask_path):
+    """Returns the stored mask as an 'L' image, or None if there is none (yet)."""
     try:
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            try:
-                if os.path.isfile(file_path):
-                    file_mtime = os.path.getmtime(file_path)
-                    if (now - file_mtime) > max_age_seconds:
-                        os.remove(file_path)
-                        print(f"Deleted old file: {file_path}")
-                        cleaned_count += 1
-            except FileNotFoundError:
-                print(f"Warning: File not found during cleanup check: {file_path}")
-                continue # File might have been deleted by another process
-            except OSError as e:
-                print(f"Error deleting file {file_path}: {e}")
-            except Exception as e:
-                 print(f"Unexpected error processing file {file_path} during cleanup: {e}")
-    except Exception as e:
-        print(f"Error listing directory {directory} for cleanup: {e}")
-
-    if cleaned_count == 0:
-        print(f"No old files found to clean in {directory}.")
+        with Image.open(mask_path) as stored:
+            stored.load()
+            return stored if stored.mode == 'L' else stored.convert('L')
+    except (FileNotFoundError, OSError):
+        return None
+
+def store_segmentation_mask(mask_path, mask):
+    tmp_path = f"{mask_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        mask.save(tmp_path, 'PNG', compress_level=1)
+        os.replace(tmp_path, mask_path) # Atomic, a concurrent job for the same upload writes the same mask
+    except OSError as e:
+        logger.warning(f"Could not store segmentation mask {mask_path}: {e}")
+        if os.path.exists(tmp_path):
+            try: os.remove(tmp_path)
+            except OSError: pass
+
+def remove_background_cached(image, input_path, file_hash, rembg_params, log_prefix, timer=None):
+    """
+    Runs rembg on image, reusing a cached matte for the same input content and parameters.
+    The model's raw segmentation mask is stored next to the upload, so a change of the matting
+    thresholds (or between bw and color mode) only reruns the alpha matting, not the model.
+    With MATTING_ENGINE='guided', rembg only predicts the mask and matting.guided_cutout()
+    replaces its closed-form alpha matting, with the same thresholds.
+    Images above REMBG_MASK_MAX_PIXELS are segmented and matted on a downscaled copy,
+    the resulting alpha mask is upscaled and applied to the full image.
+    Args:
+        image (PIL.Image.Image): The decoded original upload.
+        input_path (str): Path of the original upload (the segmentation mask is stored next to it).
+        file_hash (str): SHA-256 of the upload, from upload_store.digest().
+        rembg_params (dict): Parameters from build_rembg_params().
+        log_prefix (str): Prefix for log lines ('Initial Upload' / 'Reprocessing').
+        timer (metrics.StageTimer): Receives the 'rembg' (inference) and 'matting' durations.
+    Returns:
+        tuple: (RGBA PIL.Image.Image with the background removed, True if served from the cache,
+            bytes added to the rembg cache)
+    """
+    timer = timer or metrics.StageTimer()
+    # The result depends on the working size and the mask resolution, not only on the rembg params
+    mask_size = scaling.fit_pixels(image.size, REMBG_MASK_MAX_PIXELS)
+    cache_key = rembg_cache.make_key(file_hash, dict(rembg_params, working_size=list(image.size), mask_size=list(mask_size)))
+    cached_image = rembg_cache.get(cache_key)
+    if cached_image is not None:
+        logger.debug(f"{log_prefix}: rembg cache hit ({cache_key[:12]}), skipping background removal model.")
+        return cached_image, True, 0
+
+    logger.debug(f"{log_prefix}: rembg cache miss ({cache_key[:12]}), running rembg at {mask_size[0]}x{mask_size[1]} with fg={rembg_params['alpha_matting_foreground_threshold']}, bg={rembg_params['alpha_matting_background_threshold']}")
+    rembg_input = scaling.downscale(image, REMBG_MASK_MAX_PIXELS)
+    if rembg_input.getexif().get(0x0112, 1) != 1: # EXIF Orientation
+        # remove() would rotate a PIL image by its EXIF orientation, the rest of the pipeline works on
+        # the stored pixel order (as it did when remove() got a PNG without EXIF)
+        rembg_input = rembg_input.copy()
+        rembg_input.info.pop('exif', None)
+        rembg_input.info.pop('XML:com.adobe.xmp', None)
+    mask_path = segmentation_mask_path(input_path, rembg_input.size)
+    mask = load_segmentation_mask(mask_path)
+    if mask is not None:
+        logger.debug(f"{log_prefix}: Reusing stored segmentation mask, only running the matting.")
+        session = StoredMaskSession(mask)
     else:
-        print(f"Cleaned up {cleaned_count} old files from {directory}.")
+        session = TimedSession(rembg_sessions.get(), timer)
+    inference_before = timer.stages.get('rembg', 0.0)
+    start = time.perf_counter()
+    # Given a PIL image, remove() returns one: no PNG encode/decode around the model
+    image_after_rembg = remove(rembg_input, session=session, only_mask=not rembg_params["alpha_matting"], **rembg_params)
+    if not rembg_params["alpha_matting"]:
+        image_after_rembg = matting.guided_cutout(
+            rembg_input, image_after_rembg,
+            rembg_params["alpha_matting_foreground_threshold"],
+            rembg_params["alpha_matting_background_threshold"],
+            rembg_params["alpha_matting_erode_size"])
+    # Everything besides the model inference is alpha matting and cutout
+    timer.add('matting', time.perf_counter() - start - (timer.stages.get('rembg', 0.0) - inference_before))
+    if mask is None and session.masks:
+        store_segmentation_mask(mask_path, session.masks[0])
+    if rembg_input is not image:
+        # Matted at mask resolution: keep the full-resolution pixels, take only the alpha
+        image_after_rembg = scaling.apply_scaled_alpha(image, image_after_rembg)
+    del rembg_input
+    # Ensure RGBA after rembg
+    if image_after_rembg.mode != 'RGBA':
+        image_after_rembg = image_after_rembg.convert('RGBA')
+    stored_bytes = rembg_cache.put(cache_key, image_after_rembg)
+    return image_after_rembg, False, stored_bytes
+
+# --- External Tools ---
+class ToolError(Exception):
+    """potrace/vtracer failed or is missing; tool names which one, for the failure metrics."""
+
+    def __init__(self, tool, message):
+        super().__init__(message)
+        self.tool = tool
+
+    def __reduce__(self):
+        # Keeps the tool name when the exception travels back from a job worker process
+        return (ToolError, (self.tool, str(self)))
+
+def run_tool(cmd, cancel_token=None, input_data=None):
+    """
+    Runs potrace/vtracer and waits for it, killing the child process if the job gets cancelled.
+    Args:
+        cmd (list): Command line.
+        cancel_token (CancelToken): Token of the running job, or None.
+        input_data (bytes): Written to the tool's stdin (e.g. a PBM bitmap for potrace), or None.
+    Returns:
+        subprocess.CompletedProcess: With stdout/stderr captured as text.
+    """
+    # Own process group, so killing it also takes down anything the tool spawned itself
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if input_data is not None else None,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    while True:
+        try:
+            stdout, stderr = proc.communicate(input=input_data, timeout=CANCEL_POLL_SECONDS if cancel_token is not None else None)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel_token.cancelled:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                logger.info(f"Killed superseded {os.path.basename(cmd[0])} process (pid {proc.pid}).")
+                raise JobCancelledError("Job was cancelled.")
+            input_data = None # Already handed over, communicate() must not be given it again
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace'))
 
 # --- Refactored Vectorization Logic ---
-def vectorize_image(image_path_for_vectorization, base_unique_id, mode, colors, detail, bw_threshold=50):
+def vtracer_precision(colors, detail):
+    """
+    Maps the frontend sliders to vtracer settings.
+    Args:
+        colors (int): Colors slider (2-32).
+        detail (int): Detail slider (1-10).
+    Returns:
+        tuple: (color_precision, path_precision), both 1-8.
+    """
+    # Map frontend color slider (2-32) to vtracer's color precision (1-8)
+    # Clamp input colors first just in case
+    colors_clamped = max(2, min(32, colors))
+    # Linear mapping: 2->1, 32->8
+    color_precision_val = max(1, min(8, round(1 + (colors_clamped - 2) * (7 / 30))))
+
+    # Map frontend detail slider (1-10) to vtracer's path precision (e.g., 1-8)
+    # Higher detail means higher precision (higher value)
+    # Clamp input detail first
+    detail_clamped = max(1, min(10, detail))
+    path_precision_val = max(1, min(8, round(1 + (detail_clamped - 1) * (7 / 9))))
+    return color_precision_val, path_precision_val
+
+def svg_precision(mode, detail, preview=False):
+    """
+    Decimals the SVG optimizer keeps for path coordinates (pixels of the working resolution).
+    Args:
+        mode (str): 'color' or 'bw'.
+        detail (int): Detail slider (1-10).
+        preview (bool): Previews keep 1 decimal.
+    Returns:
+        int: 1 for low detail, 2 otherwise, never more than vtracer writes; 2 for bw (the
+            precision of the potrace bindings' output, the CLI writes tenths of a pixel).
+    """
+    if preview:
+        return 1
+    if mode == 'bw':
+        return 2
+    _, path_precision_val = vtracer_precision(2, detail)
+    return min(path_precision_val, 1 if detail <= 3 else 2)
+
+def trace_in_process(tracer, size):
+    """True if the image should be traced with the tool's bindings instead of its CLI."""
+    return tracer.binding is not None and (not INPROCESS_TRACE_MAX_PIXELS or size[0] * size[1] <= INPROCESS_TRACE_MAX_PIXELS)
+
+def run_vtracer(image, tracer, vtracer_params, png_path, svg_path, cancel_token=None, timer=None, in_process=None):
+    """
+    Traces an RGBA image with vtracer, in process through the bindings or with the CLI.
+    Args:
+        image (PIL.Image.Image): RGBA image (or tile) to trace.
+        tracer (tracing.Tracer): The selected vtracer backend.
+        vtracer_params (dict): Tracing options (colormode, precisions, ...).
+        png_path (str): Temp file the image is written to, the CLI only reads files.
+        svg_path (str): Where the SVG is written.
+        cancel_token (CancelToken): Kills vtracer and raises JobCancelledError once set.
+        timer (metrics.StageTimer): Receives the 'prep' (PNG write) and 'trace' durations.
+        in_process (bool): Force (True) or avoid (False) the bindings, None decides by image size.
+    Raises:
+        ToolError: If vtracer exits with an error.
+    """
+    timer = timer or metrics.StageTimer()
+    if in_process is None:
+        in_process = trace_in_process(tracer, image.size)
+    if in_process:
+        # Cannot be killed midway, so cancellation is only checked around the call
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        try:
+            with timer.stage('trace'):
+                svg_text = tracing.vtracer_svg(tracer.binding, image, vtracer_params)
+        except Exception as e:
+            if tracer.executable is None:
+                raise ToolError('vtracer', f"vtracer bindings failed: {e}") from e
+            logger.warning(f"vtracer bindings failed ({e}), retrying with the CLI.")
+            timer.note('tracer_fallback') # The CLI's output is not what the SVG cache key describes
+        else:
+            with open(svg_path, 'w', encoding='utf-8') as f:
+                f.write(svg_text)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            return
+    try:
+        # Uncompressed RGBA PNG: the cheapest alpha-preserving format to write and for vtracer to decode
+        with timer.stage('prep'):
+            image.save(png_path, 'PNG', compress_level=0)
+        vtracer_cmd = [tracer.executable, '--input', png_path, '--output', svg_path] + tracing.vtracer_cli_args(vtracer_params)
+        logger.debug(f"Running VTracer CLI: {' '.join(vtracer_cmd)}")
+        with timer.stage('trace'):
+            result = run_tool(vtracer_cmd, cancel_token)
+
+        if result.returncode != 0:
+            error_message = f"vtracer failed with exit code {result.returncode}."
+            if result.stdout: error_message += f"\nStdout:\n{result.stdout}"
+            if result.stderr: error_message += f"\nStderr:\n{result.stderr}"
+            raise ToolError('vtracer', error_message)
+    finally:
+        if os.path.exists(png_path):
+            try: os.remove(png_path)
+            except OSError as e: logger.warning(f"Could not remove temp prepped file {png_path}: {e}")
+
+def vectorize_color_tiled(image, tracer, vtracer_params, svg_output_path, temp_prefix, cancel_token=None):
+    """
+    Traces a large RGBA image as a grid of VTRACER_TILE_SIZE tiles on up to VTRACER_TILE_WORKERS
+    parallel vtracer processes, then merges the tile SVGs into svg_output_path.
+    Colors are quantized per tile, so neighbouring tiles may pick slightly different palettes.
+    Tiles use the CLI when it is installed: separate processes run in parallel and can be killed.
+    Args:
+        image (PIL.Image.Image): RGBA image to trace.
+        tracer (tracing.Tracer): The selected vtracer backend.
+        vtracer_params (dict): Tracing options shared by all tiles.
+        svg_output_path (str): Path of the merged SVG.
+        temp_prefix (str): Name prefix for the per-tile temp files.
+        cancel_token (CancelToken): Kills the running tile tracers once set.
+    """
+    boxes = scaling.tile_boxes(image.size, VTRACER_TILE_SIZE, VTRACER_TILE_OVERLAP)
+    logger.info(f"Tracing {image.size[0]}x{image.size[1]} image as {len(boxes)} tiles with {VTRACER_TILE_WORKERS} workers")
+
+    def trace_tile(index, box):
+        tile_base = os.path.join(TEMP_FOLDER, f"{temp_prefix}_tile{index}")
+        try:
+            run_vtracer(image.crop(box), tracer, vtracer_params, f"{tile_base}.png", f"{tile_base}.svg", cancel_token,
+                        in_process=tracer.executable is None)
+            with open(f"{tile_base}.svg", 'r', encoding='utf-8') as f:
+                return box, f.read()
+        finally:
+            if os.path.exists(f"{tile_base}.svg"):
+                try: os.remove(f"{tile_base}.svg")
+                except OSError as e: logger.warning(f"Could not remove temp tile {tile_base}.svg: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, VTRACER_TILE_WORKERS), thread_name_prefix="vtracer-tile") as executor:
+        tiles = list(executor.map(trace_tile, range(len(boxes)), boxes))
+    with open(svg_output_path, 'w', encoding='utf-8') as f:
+        f.write(scaling.merge_svg_tiles(tiles, image.size))
+
+def potrace_turdsize(detail):
+    """Maps the detail slider (1-10) to potrace's speckle filter: areas up to this many pixels are dropped."""
+    return max(2, 12 - max(1, min(10, detail))) # 10 -> 2 (potrace default), 1 -> 11
+
+def vectorize_color_layers(image, colors, detail, svg_output_path, cancel_token=None, timer=None):
+    """
+    Alternative color engine (COLOR_ENGINE='layers'): quantizes the image to a palette with NumPy,
+    traces one stacked bitmap per color with potrace on up to COLOR_LAYER_WORKERS parallel
+    processes and writes the stacked layers to svg_output_path. vtracer traces all colors on
+    one core, this spreads large, many-colored images over several. Only the potrace CLI runs
+    in parallel; with nothing but the bindings installed, the layers go through the same pool
+    but are serialized by the GIL.
+    Args:
+        image (PIL.Image.Image): RGBA image to trace.
+        colors (int): Palette size.
+        detail (int): Detail slider (1-10), sets potrace's speckle filter.
+        svg_output_path (str): Path of the SVG.
+        cancel_token (CancelToken): Kills the running potrace processes once set.
+        timer (metrics.StageTimer): Receives the 'prep' (quantization) and 'trace' durations.
+    Raises:
+        ToolError: If potrace fails or is not installed.
+    """
+    timer = timer or metrics.StageTimer()
+    potrace = tracers['potrace']
+    if not potrace.available:
+        raise ToolError('potrace', "potrace is not installed, the 'layers' color engine needs it.")
+    with timer.stage('prep'):
+        palette, ranks = preprocessing.color_layers(image, max(2, min(32, colors)))
+    turdsize = potrace_turdsize(detail)
+    logger.debug(f"Tracing {image.size[0]}x{image.size[1]} image as {len(palette)} color layers with {COLOR_LAYER_WORKERS} workers")
+
+    def trace_layer(index):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        foreground = ranks >= index # This color and every color stacked above it
+        if potrace.executable is None:
+            # Same pool, but the bindings hold the GIL: without the CLI the layers are effectively
+            # traced one after the other
+            return tracing.potrace_svg(potrace.binding, foreground, turdsize)
+        # Separate processes run in parallel and can be killed; PBM in through stdin, SVG out through stdout
+        potrace_cmd = [potrace.executable, '-', '-s', '-t', str(turdsize), '-o', '-']
+        result = run_tool(potrace_cmd, cancel_token, input_data=preprocessing.to_pbm(foreground))
+        if result.returncode != 0:
+            raise ToolError('potrace', f"potrace failed with exit code {result.returncode} on color layer {index}.\nStderr:\n{result.stderr}")
+        return result.stdout
+
+    with timer.stage('trace'):
+        with ThreadPoolExecutor(max_workers=max(1, COLOR_LAYER_WORKERS), thread_name_prefix="potrace-layer") as executor:
+            layer_svgs = list(executor.map(trace_layer, range(len(palette))))
+    colors_hex = [f"#{red:02x}{green:02x}{blue:02x}" for red, green, blue in palette.tolist()]
+    with open(svg_output_path, 'w', encoding='utf-8') as f:
+        f.write(scaling.merge_svg_layers(list(zip(colors_hex, layer_svgs)), image.size))
+
+def vectorize_image(image, base_unique_id, mode, colors, detail, bw_threshold=50, cancel_token=None, threshold_method='fixed', timer=None, preview=False):
     """
     Vectorizes the image using potrace or vtracer based on mode.
     Args:
-        image_path_for_vectorization (str): Path to the preprocessed image (RGBA PNG for color, RGB PNG for bw).
+        image (PIL.Image.Image): The preprocessed RGBA image, kept in memory.
         base_unique_id (str): The UUID base name for output files.
         mode (str): 'bw' or 'color'.
         colors (int): Number of colors for vtracer (1-32).
         detail (int): Detail level for vtracer (1-10).
         bw_threshold (int): Threshold percentage (0-100) specifically for black & white conversion (potrace).
+        cancel_token (CancelToken): Kills the tracer and raises JobCancelledError once set.
+        threshold_method (str): 'fixed' (bw_threshold), 'otsu' or 'adaptive' for black & white conversion.
+        timer (metrics.StageTimer): Receives the 'prep' and 'trace' durations.
+        preview (bool): Use cheaper vtracer settings for a quick preview.
     Returns:
         str: The filename of the generated SVG, or raises an Exception on error.
+    Raises:
+        ToolError: If potrace/vtracer fails or is not installed.
     """
+    timer = timer or metrics.StageTimer()
     # Generate a new unique ID for this specific vectorization output
     output_unique_id = str(uuid.uuid4())
     svg_filename = f"{base_unique_id}_{output_unique_id}.svg"
-    svg_output_path = os.path.join(OUTPUT_FOLDER, svg_filename)
-    bw_temp_bmp_path = None # Initialize path for temporary BMP file
-    temp_prepped_png_path = None # Initialize path for temp PNG used by vtracer/potrace
+    svg_output_path = svg_cache.path(svg_filename)
+    os.makedirs(os.path.dirname(svg_output_path), exist_ok=True)
 
     try:
         if mode == 'bw':
             # --- Black & White Vectorization (Potrace) ---
-            # 1. Convert the input PNG (already RGB with white bg) to a binary BMP using PIL/Pillow
-            bw_temp_bmp_filename = f"{base_unique_id}_{output_unique_id}_bw.bmp"
-            bw_temp_bmp_path = os.path.join(TEMP_FOLDER, bw_temp_bmp_filename)
-            temp_prepped_png_path = image_path_for_vectorization # Keep track for cleanup
+            # 1. Composite over white, convert to grayscale and threshold in one NumPy pass,
+            #    producing a binary PBM in memory
             # Use the specific bw_threshold parameter here
             threshold_percent = max(0, min(100, bw_threshold)) # Clamp threshold 0-100
             threshold_value = int(255 * threshold_percent / 100) # Convert to 0-255 range
 
-            print(f"Preparing BW BMP using PIL: Input={image_path_for_vectorization}, BW Threshold={threshold_percent}% ({threshold_value})")
             try:
-                img_rgb = Image.open(image_path_for_vectorization)
-                # Convert to grayscale ('L'), then apply threshold to get binary ('1')
-                # Pixels > threshold_value become white (255), others black (0)
+                # Pixels > threshold_value become white, others black
                 # Potrace treats black as foreground, so this mapping is correct.
-                img_binary = img_rgb.convert('L').point(lambda x: 255 if x > threshold_value else 0, mode='1')
-                img_binary.save(bw_temp_bmp_path, 'BMP')
-                del img_rgb, img_binary # Clean up memory
-            except Exception as pil_error:
-                 print(f"Error during PIL BW conversion: {pil_error}")
-                 raise Exception(f"Failed to convert image to BW BMP using PIL: {pil_error}") from pil_error
-
-            # 2. Use Potrace on the generated BMP
-            potrace_cmd = ['potrace', bw_temp_bmp_path, '-s', '-o', svg_output_path] # -s for SVG output
-            print(f"Running Potrace: {' '.join(potrace_cmd)}")
-            subprocess.run(potrace_cmd, check=True)
+                with timer.stage('prep'):
+                    foreground, used_threshold = preprocessing.bw_bitmap(image, threshold_value, threshold_method)
+                logger.debug(f"Prepared BW bitmap: Size={image.size}, Method={threshold_method}, BW Threshold={threshold_percent}% -> {used_threshold}")
+            except Exception as prep_error:
+                 logger.error(f"Error during BW conversion: {prep_error}")
+                 raise Exception(f"Failed to convert image to BW bitmap: {prep_error}") from prep_error
+
+            # 2. Trace the bitmap in process through the bindings, or with the potrace CLI
+            potrace = tracers['potrace']
+            svg_text = None
+            if trace_in_process(potrace, image.size):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                try:
+                    with timer.stage('trace'):
+                        svg_text = tracing.potrace_svg(potrace.binding, foreground)
+                except Exception as e:
+                    if potrace.executable is None:
+                        raise ToolError('potrace', f"potrace bindings failed: {e}") from e
+                    logger.warning(f"potrace bindings failed ({e}), retrying with the CLI.")
+                    timer.note('tracer_fallback')
+            if svg_text is not None:
+                with open(svg_output_path, 'w', encoding='utf-8') as f:
+                    f.write(svg_text)
+                del foreground
+            else:
+                with timer.stage('prep'):
+                    pbm_data = preprocessing.to_pbm(foreground)
+                del foreground # Clean up memory
+                # Fed through stdin instead of a temp file
+                potrace_cmd = [potrace.executable or 'potrace', '-', '-s', '-o', svg_output_path] # '-' reads stdin, -s for SVG output
+                logger.debug(f"Running Potrace: {' '.join(potrace_cmd)}")
+                with timer.stage('trace'):
+                    result = run_tool(potrace_cmd, cancel_token, input_data=pbm_data)
+                del pbm_data
+                if result.returncode != 0:
+                    raise subprocess.CalledProcessError(result.returncode, potrace_cmd, result.stdout, result.stderr)
+
+        elif COLOR_ENGINE == 'layers' and not preview: # Previews keep vtracer's cheap polygon mode
+            # --- Color Vectorization (NumPy palette, one potrace per color layer) ---
+            vectorize_color_layers(image, colors, detail, svg_output_path, cancel_token, timer)
 
         else: # mode == 'color'
             # --- Color Vectorization (VTracer) ---
-            # Input image (image_path_for_vectorization) is expected to be RGBA PNG
-            temp_prepped_png_path = image_path_for_vectorization # Keep track for cleanup
-
-            # Map frontend color slider (2-32) to vtracer's color precision (1-8)
-            # Clamp input colors first just in case
-            colors_clamped = max(2, min(32, colors))
-            # Linear mapping: 2->1, 32->8
-            color_precision_val = max(1, min(8, round(1 + (colors_clamped - 2) * (7 / 30))))
-
-            # Map frontend detail slider (1-10) to vtracer's path precision (e.g., 1-8)
-            # Higher detail means higher precision (higher value)
-            # Clamp input detail first
-            detail_clamped = max(1, min(10, detail))
-            path_precision_val = max(1, min(8, round(1 + (detail_clamped - 1) * (7 / 9))))
+            color_precision_val, path_precision_val = vtracer_precision(colors, detail)
 
             # Use a fixed value for filter_speckle. Lower value allows smaller details. vtracer default is 4.
             filter_speckle_val = 2 # Reduced from 4 to potentially keep more detail
-            # Find the vtracer executable
-            vtracer_executable = shutil.which('vtracer')
-            if not vtracer_executable:
+            vtracer = tracers['vtracer'] # Resolved at startup
+            if not vtracer.available:
                 raise FileNotFoundError("vtracer command not found in PATH.")
 
-            vtracer_cmd = [
-                vtracer_executable,
-                '--input', image_path_for_vectorization, # Should be RGBA PNG
-                '--output', svg_output_path,
-                '--colormode', 'color',
-                '--color_precision', str(color_precision_val),
-                '--filter_speckle', str(filter_speckle_val), # Use fixed speckle filter
-                '--path_precision', str(path_precision_val), # Use detail mapping for path precision
-                '--mode', 'spline', # Use splines for smoother curves
-            ]
-            print(f"Running VTracer CLI: {' '.join(vtracer_cmd)}")
-            result = subprocess.run(vtracer_cmd, check=False, capture_output=True, text=True)
-
-            if result.returncode != 0:
-                error_message = f"vtracer failed with exit code {result.returncode}."
-                if result.stdout: error_message += f"\nStdout:\n{result.stdout}"
-                if result.stderr: error_message += f"\nStderr:\n{result.stderr}"
-                raise Exception(error_message)
+            # The binding's keyword arguments, tracing.vtracer_cli_args() maps them to the CLI's option names
+            vtracer_params = {
+                "colormode": 'color',
+                "color_precision": color_precision_val,
+                "filter_speckle": filter_speckle_val, # Use fixed speckle filter
+                "path_precision": path_precision_val, # Use detail mapping for path precision
+                "mode": 'spline', # Use splines for smoother curves
+            }
+            if preview:
+                # Straight polygons instead of fitted splines, more speckles and similar color layers merged
+                vtracer_params.update({
+                    "mode": 'polygon',
+                    "filter_speckle": 4,
+                    "color_precision": min(color_precision_val, 6),
+                    "layer_difference": 24,
+                    "path_precision": 1,
+                })
+
+            if VTRACER_TILE_SIZE and max(image.size) > VTRACER_TILE_SIZE:
+                # Large image: trace tiles in parallel and merge their paths
+                with timer.stage('trace'):
+                    vectorize_color_tiled(image, vtracer, vtracer_params, svg_output_path,
+                                          f"{base_unique_id}_{output_unique_id}", cancel_token)
+            else:
+                temp_prepped_png_path = os.path.join(TEMP_FOLDER, f"{base_unique_id}_{output_unique_id}_prepped.png")
+                run_vtracer(image, vtracer, vtracer_params, temp_prepped_png_path, svg_output_path, cancel_token, timer)
 
 
         return svg_filename # Return the name of the generated SVG
 
+    except JobCancelledError:
+         # Superseded by a newer request: drop the partial output, no error to report
+         if os.path.exists(svg_output_path):
+             try: os.remove(svg_output_path)
+             except OSError as e: logger.warning(f"Could not remove partial output {svg_output_path}: {e}")
+         raise
+    except ToolError as e:
+         logger.error(f"Error during vectorization ({e.tool}): {e}")
+         raise
     except subprocess.CalledProcessError as e:
          tool_name = 'potrace' if mode == 'bw' else 'vtracer'
          # Include stderr if available
-         stderr_output = e.stderr.decode() if e.stderr else 'No stderr output.'
-         print(f"Error during vectorization subprocess ({tool_name}): {e}\nStderr: {stderr_output}")
-         raise Exception(f"Error during vectorization subprocess ({tool_name}): {e}\nStderr: {stderr_output}") from e
+         stderr_output = e.stderr if e.stderr else 'No stderr output.'
+         logger.error(f"Error during vectorization subprocess ({tool_name}): {e}\nStderr: {stderr_output}")
+         raise ToolError(tool_name, f"Error during vectorization subprocess ({tool_name}): {e}\nStderr: {stderr_output}") from e
     except FileNotFoundError as e:
          # Determine which tool was actually missing
          if mode == 'color' and 'vtracer' in str(e):
@@ -165,34 +698,396 @@ def vectorize_image(image_path_for_vectorization, base_unique_id, mode, colors,
              if 'potrace' in str(e): tool_name = 'potrace'
              error_msg = f"{tool_name} command not found. Is it installed and in PATH?"
          else:
-             error_msg = f"An unexpected FileNotFoundError occurred: {e}"
-         print(f"Error: {error_msg}")
-         raise Exception(error_msg) from e
+             logger.error(f"An unexpected FileNotFoundError occurred: {e}")
+             raise Exception(f"An unexpected FileNotFoundError occurred: {e}") from e
+         logger.error(error_msg)
+         raise ToolError(tool_name, error_msg) from e
     except Exception as e: # Catch other potential errors
-         print(f"Error during vectorization: {e}")
+         logger.error(f"Error during vectorization: {e}")
          raise Exception(f"Error during vectorization: {e}") from e
-    finally:
-        # Clean up temporary files used by vectorizers
-        if bw_temp_bmp_path and os.path.exists(bw_temp_bmp_path):
-            try: os.remove(bw_temp_bmp_path)
-            except OSError as e: print(f"Warning: Could not remove temp file {bw_temp_bmp_path}: {e}")
-        # Also remove the prepped PNG that was input to the vectorizer
-        if temp_prepped_png_path and os.path.exists(temp_prepped_png_path):
-             try: os.remove(temp_prepped_png_path)
-             except OSError as e: print(f"Warning: Could not remove temp prepped file {temp_prepped_png_path}: {e}")
+
+# --- Job Processing ---
+def parse_vectorize_params(values, remove_bg_default):
+    """
+    Parses and clamps the vectorization parameters sent by the frontend.
+    Args:
+        values (dict-like): request.form for uploads, the JSON body for reprocess requests.
+        remove_bg_default (bool): Value used when 'remove_bg' is missing.
+    Returns:
+        dict: mode, colors, detail, bw_threshold, threshold_method, color_threshold, remove_bg.
+    """
+    mode = 'bw' if values.get('mode', 'color') == 'bw' else 'color' # Default to color
+
+    try:
+        # Colors (2-32 from frontend)
+        colors = int(values.get('colors', 8)) # Default from frontend is 8
+    except (ValueError, TypeError):
+        colors = 8
+
+    try:
+        # Detail (1-10 from frontend)
+        detail = int(values.get('detail', 5)) # Default from frontend is 5
+    except (ValueError, TypeError):
+        detail = 5
+
+    # The frontend sends the threshold of the current mode as 'bg_threshold',
+    # older clients used mode-specific field names
+    bw_threshold = 50 # Default BW threshold
+    color_threshold = 20 # Default Color threshold
+    try:
+        if mode == 'bw':
+            bw_threshold = int(values.get('bg_threshold_bw', values.get('bg_threshold', 50)))
+        else: # color mode
+            color_threshold = int(values.get('bg_threshold_col', values.get('bg_threshold', 20)))
+    except (ValueError, TypeError):
+        pass # Keep defaults if conversion fails
+
+    # BW thresholding: the slider value ('fixed') or automatic Otsu / adaptive thresholds
+    threshold_method = values.get('threshold_method', 'fixed')
+    if threshold_method not in preprocessing.THRESHOLD_METHODS:
+        threshold_method = 'fixed'
+
+    # Remove Background flag: boolean from JSON, 'on'/'true' from form data
+    remove_bg = values.get('remove_bg', remove_bg_default)
+    if isinstance(remove_bg, str):
+        remove_bg = remove_bg.lower() in ('on', 'true', '1')
+
+    return {
+        "mode": mode,
+        "colors": max(2, min(32, colors)), # Clamp to frontend range
+        "detail": max(1, min(10, detail)), # Clamp to frontend range
+        "bw_threshold": max(0, min(100, bw_threshold)), # Clamp BW threshold
+        "threshold_method": threshold_method,
+        "color_threshold": max(0, min(100, color_threshold)), # Clamp Color threshold
+        "remove_bg": bool(remove_bg),
+    }
+
+def svg_cache_key(input_filename, params, preview=False):
+    """
+    Builds the SVG cache key for an upload and a set of parameters from parse_vectorize_params().
+    Only what influences the output for the given mode goes into the key, mapped to the values
+    the tracer actually receives, so e.g. two colors slider positions with the same vtracer
+    precision share one SVG. Previews are cached under their own keys. The key has to determine
+    the SVG completely, because SVGs served under it are marked immutable for HTTP caches:
+    tracer backend and versions are part of it, and results that deviate at runtime (rembg or
+    the bindings failed) are never stored under it.
+    """
+    mode = params["mode"]
+    normalized = {
+        "version": SVG_CACHE_VERSION,
+        "mode": mode,
+        "remove_bg": params["remove_bg"],
+        "max_working_pixels": PREVIEW_MAX_PIXELS if preview else MAX_WORKING_PIXELS,
+    }
+    if preview:
+        normalized["preview"] = True
+    if params["remove_bg"]:
+        normalized["rembg"] = build_rembg_params(mode, params["color_threshold"])
+        normalized["rembg_model"] = REMBG_MODEL
+        normalized["rembg_mask_max_pixels"] = REMBG_MASK_MAX_PIXELS
+        normalized["rembg_version"] = REMBG_VERSION
+    # The tracer backend (bindings or CLI, and their versions) changes the output too
+    tool = 'vtracer' if mode == 'color' and (COLOR_ENGINE != 'layers' or preview) else 'potrace'
+    normalized["tracer"] = tracers[tool].fingerprint()
+    normalized["inprocess_trace_max_pixels"] = INPROCESS_TRACE_MAX_PIXELS
+    if mode == 'bw':
+        normalized["threshold_method"] = params["threshold_method"]
+        if params["threshold_method"] == 'fixed':
+            normalized["bw_threshold"] = params["bw_threshold"]
+    elif COLOR_ENGINE == 'layers' and not preview:
+        normalized["color_layers"] = (max(2, min(32, params["colors"])), potrace_turdsize(params["detail"]))
+    else:
+        normalized["vtracer_precision"] = vtracer_precision(params["colors"], params["detail"])
+        normalized["vtracer_tiles"] = (VTRACER_TILE_SIZE, VTRACER_TILE_OVERLAP) if VTRACER_TILE_SIZE else None
+    normalized["svg_precision"] = svg_precision(mode, params["detail"], preview) if SVG_OPTIMIZE else None
+    file_hash = upload_store.digest(input_filename) # Content-addressed, no need to read the file
+    return svg_cache.make_key(file_hash, normalized)
+
+def preview_matte_key(file_hash, rembg_params, size):
+    """rembg cache key of the background-removed copy of an input at preview size."""
+    return rembg_cache.make_key(file_hash, dict(rembg_params, preview_size=list(size)))
+
+def run_vectorize_job(input_filename, params, log_prefix, cancel_token=None, cache_key=None, preview=False):
+    """
+    Runs the full pipeline (rembg, preparation, vectorization) for an uploaded file.
+    Executed on the job pool, so it only takes and returns plain picklable data.
+    Args:
+        input_filename (str): Name of the original upload, issued by upload_store.
+        params (dict): Parameters from parse_vectorize_params().
+        log_prefix (str): Prefix for log lines ('Initial Upload' / 'Reprocessing').
+        cancel_token (CancelToken): Set when a newer request for the same input supersedes this job.
+        cache_key (str): SVG cache key from svg_cache_key(), the result is stored under it.
+        preview (bool): Quick pass at PREVIEW_MAX_PIXELS with cheaper tracer settings. The
+            background is only removed with a matte or segmentation mask an earlier full job stored.
+    Returns:
+        dict: svg_filename, the rembg cache outcome ('hit', 'miss' or None), whether rembg
+            failed or (for a preview) was skipped, the worker start time and the per-stage durations.
+    Raises:
+        JobCancelledError: If the job was cancelled before it finished.
+    """
+    started_at = time.time() # Wall clock, compared with the job's creation time in the web process
+    timer = metrics.StageTimer()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled() # Superseded while waiting in the queue
+    mode = params["mode"]
+    result = {"svg_filename": None, "rembg_cache": None, "rembg_fallback": False, "rembg_skipped": False,
+              "rembg_cache_bytes": 0, "mode": mode, "remove_bg": params["remove_bg"], "started_at": started_at,
+              "stages": timer.stages}
+    if cache_key is not None:
+        # An identical job may have finished while this one was queued
+        cached_filename = svg_cache.get(cache_key, record=False)
+        if cached_filename is not None:
+            logger.info(f"{log_prefix}: SVG cache hit ({cache_key[:12]}) after queueing, skipping processing.")
+            result["svg_filename"] = cached_filename
+            return result
+    input_path = upload_store.path(input_filename) # Fetched to local disk with a remote backend
+    base_unique_id = input_filename.split('.')[0] # Content hash and upload ID
+    file_hash = upload_store.digest(input_filename) # Keys the rembg cache without reading the file
+
+    # --- Prepare Image for Vectorization (Mode-Dependent) ---
+    # From here on the pixel data stays in memory until it is handed to the tracer
+    logger.debug(f"{log_prefix}: Processing for mode='{mode}', remove_bg={params['remove_bg']}")
+    working_pixels = PREVIEW_MAX_PIXELS if preview else MAX_WORKING_PIXELS
+    with timer.stage('decode'):
+        image_to_process = Image.open(input_path)
+        original_size = image_to_process.size
+        working_size = scaling.fit_pixels(original_size, working_pixels)
+        if image_to_process.format == 'JPEG' and working_size != original_size:
+            # Downscaled below anyway: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the working resolution
+            image_to_process.draft(image_to_process.mode, working_size)
+        image_to_process.load() # Decode once, this also closes the file
+    if working_size != original_size:
+        # Very large upload (or a preview): rembg, matting and tracing all run at the reduced working resolution
+        with timer.stage('downscale'):
+            image_to_process = scaling.resize(image_to_process, working_size)
+        (logger.debug if preview else logger.info)(f"{log_prefix}: Downscaled {original_size[0]}x{original_size[1]} to working resolution {image_to_process.size[0]}x{image_to_process.size[1]}")
+
+    if params["remove_bg"] and preview:
+        # Running the model would take longer than the whole preview: use the matte a full job
+        # stored for this input and these parameters, or the segmentation mask a full job with
+        # other parameters stored (as plain alpha, without matting), otherwise the preview keeps the background
+        matte = rembg_cache.get(preview_matte_key(file_hash, build_rembg_params(mode, params["color_threshold"]), image_to_process.size))
+        result["rembg_cache"] = 'hit' if matte is not None else 'miss'
+        if matte is None:
+            full_working_size = scaling.fit_pixels(original_size, MAX_WORKING_PIXELS)
+            mask = load_segmentation_mask(segmentation_mask_path(input_path, scaling.fit_pixels(full_working_size, REMBG_MASK_MAX_PIXELS)))
+            if mask is not None:
+                with timer.stage('matting'):
+                    matte = image_to_process.convert('RGBA')
+                    matte.putalpha(scaling.resize(mask, image_to_process.size))
+        if matte is not None:
+            image_to_process = matte
+        else:
+            result["rembg_skipped"] = True
+    elif params["remove_bg"]:
+        logger.debug(f"{log_prefix}: Removing background...")
+        try:
+            rembg_params = build_rembg_params(mode, params["color_threshold"])
+            image_to_process, cache_hit, stored_bytes = remove_background_cached(image_to_process, input_path, file_hash,
+                                                                                 rembg_params, log_prefix, timer)
+            result["rembg_cache_bytes"] += stored_bytes
+            result["rembg_cache"] = 'hit' if cache_hit else 'miss'
+            preview_size = scaling.fit_pixels(original_size, PREVIEW_MAX_PIXELS)
+            if PREVIEW_ENABLED and not cache_hit and preview_size != original_size:
+                # Downscaled copy for the previews of later requests with the same rembg parameters
+                with timer.stage('matting'):
+                    result["rembg_cache_bytes"] += rembg_cache.put(preview_matte_key(file_hash, rembg_params, preview_size),
+                                                                   scaling.resize(image_to_process, preview_size))
+        except Exception as rembg_error:
+             logger.warning(f"rembg failed during {log_prefix.lower()}: {rembg_error}. Proceeding without background removal.")
+             result["rembg_fallback"] = True
+
+    # --- Mode-specific preparation ---
+    # Color mode traces the RGBA image as is. bw mode composites it onto white, converts it
+    # to grayscale and thresholds it in vectorize_image (one NumPy pass, see preprocessing.py),
+    # which handles RGB and L input directly, so only other modes need converting there.
+    if mode == 'color' or image_to_process.mode not in ('RGBA', 'RGB', 'L'):
+        if image_to_process.mode != 'RGBA':
+            with timer.stage('prep'):
+                image_to_process = image_to_process.convert('RGBA')
+
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    # --- Vectorization ---
+    logger.debug(f"{log_prefix}: Calling vectorize_image with {image_to_process.mode} image {image_to_process.size}")
+    svg_filename = vectorize_image(
+        image=image_to_process,
+        base_unique_id=base_unique_id,
+        mode=mode,
+        colors=params["colors"],
+        detail=params["detail"],
+        bw_threshold=params["bw_threshold"], # Pass only the BW threshold
+        cancel_token=cancel_token,
+        threshold_method=params["threshold_method"],
+        timer=timer,
+        preview=preview
+    )
+    if image_to_process.size != original_size:
+        # Traced at working resolution: display the SVG at the size of the original upload
+        scaling.rescale_svg(svg_cache.path(svg_filename), original_size)
+    if SVG_OPTIMIZE:
+        with timer.stage('optimize'):
+            size_before, size_after = svg_optimize.optimize_file(svg_cache.path(svg_filename),
+                                                                 svg_precision(mode, params["detail"], preview))
+        logger.debug(f"{log_prefix}: Optimized SVG from {size_before} to {size_after} bytes")
+    # Traced with the background still in it (a preview without matte, or rembg failed) or by the
+    # CLI after the bindings failed: not what the key describes, so it is served under its unique
+    # name (with revalidating HTTP caching, see send_svg()) and never cached
+    result["tracer_fallback"] = 'tracer_fallback' in timer.notes
+    background_kept = result["rembg_skipped"] or result["rembg_fallback"]
+    stored = cache_key is not None and not background_kept and not result["tracer_fallback"]
+    if stored:
+        svg_filename = svg_cache.put(cache_key, svg_filename)
+    if SVG_PRECOMPRESS and not preview and not background_kept: # Previews are replaced within seconds
+        # After the cache put, the variants are named after the final filename
+        with timer.stage('compress'):
+            svg_optimize.precompress(svg_cache.path(svg_filename))
+    if stored:
+        result["svg_cache_bytes"] = svg_cache.size(svg_filename) # Added to the cache's total in the web process
+    result["svg_filename"] = svg_filename
+    logger.info(f"{log_prefix}: Vectorized {input_filename} in {time.time() - started_at:.2f}s",
+                extra={"input_filename": input_filename, "mode": mode, "remove_bg": params["remove_bg"],
+                       "stages": {stage: round(seconds, 4) for stage, seconds in timer.stages.items()}})
+    return result
+
+def init_job_worker():
+    """Job pool initializer: loads the rembg model once per worker process."""
+    if JOB_EXECUTOR == 'process' and REMBG_PRELOAD:
+        try:
+            rembg_sessions.load()
+        except Exception as e:
+            logger.warning(f"rembg model could not be preloaded in job worker: {e}")
+
+def warm_job_worker():
+    """Warm-up task run once per worker at startup, reports whether the model is loaded."""
+    time.sleep(0.5) # Keep this worker busy so the other warm-up calls spread over the pool
+    return rembg_sessions.ready or not REMBG_PRELOAD
+
+def record_job_result(job):
+    """
+    Runs in the web process when a job finished: registers the new SVG with the janitor,
+    records the worker's stage timings and counters in the metrics and folds worker-side
+    rembg cache counters and sizes back into this process (eviction runs here, in the janitor).
+    """
+    result = job.result
+    svg_path = svg_cache.path(result["svg_filename"])
+    for path in [svg_path, *svg_optimize.variant_paths(svg_path).values()]:
+        janitor.register(path) # Skips variants that were not written
+    metrics.JOBS.labels(job.kind, 'done').inc()
+    stages = dict(result["stages"])
+    stages['queue_wait'] = max(0.0, result["started_at"] - job.created_at)
+    metrics.observe_stages(stages, result["mode"], result["remove_bg"])
+    if result["rembg_fallback"]:
+        metrics.REMBG_FALLBACKS.inc()
+    if JOB_EXECUTOR == 'process' and result.get("rembg_cache"):
+        rembg_cache.record_lookup(result["rembg_cache"] == 'hit')
+    over_limit = rembg_cache.record_put(result.get("rembg_cache_bytes", 0))
+    over_limit |= svg_cache.record_put(result.get("svg_cache_bytes", 0))
+    if over_limit:
+        janitor.request_collect()
+
+def record_job_error(job, error):
+    """Counts failed jobs, and potrace/vtracer failures separately."""
+    metrics.JOBS.labels(job.kind, 'failed').inc()
+    if isinstance(error, ToolError):
+        metrics.TOOL_FAILURES.labels(error.tool).inc()
+
+job_queue = JobQueue(
+    max_workers=JOB_WORKERS,
+    max_queue=JOB_QUEUE_DEPTH,
+    executor=JOB_EXECUTOR,
+    start_method=JOB_START_METHOD,
+    initializer=init_job_worker,
+    result_ttl=CLEANUP_AGE_SECONDS,
+    on_complete=record_job_result,
+    on_error=record_job_error,
+    cancel_dir=TEMP_FOLDER, # Cancel tokens are tiny files, swept by the janitor with the rest of TEMP_FOLDER
+    preload=[__name__], # This module ('app', or '__main__' when run as a script) with rembg, onnxruntime, NumPy, ...
+    max_tasks_per_worker=JOB_MAX_TASKS_PER_WORKER,
+)
+REGISTRY.register(metrics.StatsCollector({"rembg": rembg_cache, "svg": svg_cache}, job_queue, janitor))
+
+def submit_preview_job(input_filename, params, meta, image_size):
+    """
+    Queues the quick low-resolution pass for a request, ahead of its full job.
+    Args:
+        image_size (tuple): (width, height) of the upload, small images get no preview.
+    Returns:
+        Job: The preview job (already finished on an SVG cache hit), or None if previews are off,
+            the image is small enough to be traced in full right away or the queue is full.
+    """
+    if not PREVIEW_ENABLED or image_size[0] * image_size[1] <= PREVIEW_MAX_PIXELS:
+        return None
+    # Only the newest preview per input matters, like reprocess jobs
+    supersede_key = f"preview:{input_filename}"
+    cache_key = svg_cache_key(input_filename, params, preview=True)
+    cached_filename = svg_cache.get(cache_key)
+    if cached_filename is not None:
+        metrics.JOBS.labels('preview', 'cached').inc()
+        return job_queue.complete('preview', {"svg_filename": cached_filename, "rembg_cache": None},
+                                  meta=meta, supersede_key=supersede_key)
+    try:
+        return job_queue.submit('preview', run_vectorize_job, input_filename, params, 'Preview',
+                                meta=meta, supersede_key=supersede_key, cache_key=cache_key, preview=True)
+    except QueueFullError:
+        logger.debug(f"Queue full, no preview for {input_filename}.")
+        return None
+
+def submit_vectorize_job(kind, input_filename, params, meta, image_size=None):
+    """
+    Submits a vectorization job and builds the 202 response, or a 429 when the queue is full.
+    On an SVG cache hit the job is finished immediately and the response is a 200.
+    With image_size, a preview job is queued first and returned under "preview".
+    """
+    log_prefix = 'Initial Upload' if kind == 'upload' else 'Reprocessing'
+    # Only the newest reprocess per input matters (slider drags), it cancels older queued/running ones
+    supersede_key = f"reprocess:{input_filename}" if kind == 'reprocess' else None
+    cache_key = svg_cache_key(input_filename, params)
+    cached_filename = svg_cache.get(cache_key)
+    if cached_filename is not None:
+        # Same input and parameters as an earlier request: answer with a finished job right away
+        logger.info(f"{log_prefix}: SVG cache hit ({cache_key[:12]}) for {input_filename}, skipping processing.")
+        job = job_queue.complete(kind, {"svg_filename": cached_filename, "rembg_cache": None},
+                                 meta=meta, supersede_key=supersede_key)
+        metrics.JOBS.labels(kind, 'cached').inc()
+        return jsonify(job_status_payload(job))
+    # Submitted first, so the pool picks it up before the full job
+    preview_job = submit_preview_job(input_filename, params, meta, image_size) if image_size else None
+    try:
+        job = job_queue.submit(kind, run_vectorize_job, input_filename, params, log_prefix,
+                               meta=meta, supersede_key=supersede_key, cache_key=cache_key)
+    except QueueFullError as e:
+        if preview_job is not None:
+            preview_job.cancel() # Nothing to preview without the full job
+        response = jsonify({"error": "Server busy, please retry later."})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    payload = job_status_payload(job)
+    if preview_job is not None:
+        payload["preview"] = job_status_payload(preview_job)
+    response = jsonify(payload)
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job.id)
+    return response
+
+def job_status_payload(job):
+    payload = job.to_dict()
+    payload["status_url"] = url_for('job_status', job_id=job.id)
+    payload["result_url"] = url_for('job_result', job_id=job.id)
+    if job.status == 'done':
+        svg_filename = job.result["svg_filename"]
+        payload["svg_file_url"] = url_for('serve_svg', filename=svg_filename) # URL of the generated SVG
+        payload["download_url"] = url_for('download_file', filename=svg_filename) # Download URL for this SVG
+        if job.result.get("rembg_skipped"):
+            payload["rembg_skipped"] = True # Preview traced before a matte was available, background still visible
+    return payload
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        # --- Run Cleanup ---
-        try:
-            cleanup_old_files(UPLOAD_FOLDER, CLEANUP_AGE_SECONDS)
-            cleanup_old_files(OUTPUT_FOLDER, CLEANUP_AGE_SECONDS)
-            # Optionally clean TEMP_FOLDER too, though vectorizer should clean its own temps
-            cleanup_old_files(TEMP_FOLDER, CLEANUP_AGE_SECONDS)
-        except Exception as cleanup_error:
-            print(f"Warning: Initial cleanup failed: {cleanup_error}")
-
+        # Old files are removed by the background janitor, not on the request path
         # Check if the post request has the file part
         if 'file' not in request.files:
             return jsonify({"error": "No file part"}), 400
@@ -203,160 +1098,25 @@ def index():
             return jsonify({"error": "No selected file"}), 400
 
         # Get parameters from the form data
-        mode = request.form.get('mode', 'color') # Default to color now
-        try:
-            # Colors (2-32 from frontend)
-            colors = int(request.form.get('colors', 8)) # Default from frontend is 8
-        except (ValueError, TypeError):
-            colors = 8
-        colors = max(2, min(32, colors)) # Clamp to frontend range
-
-        try:
-            # Detail (1-10 from frontend)
-            detail = int(request.form.get('detail', 5)) # Default from frontend is 5
-        except (ValueError, TypeError):
-            detail = 5
-        detail = max(1, min(10, detail)) # Clamp to frontend range
-
-        # Read the correct threshold based on mode (although only BW uses it currently)
-        # We still read it here to pass it correctly if mode is BW
-        current_mode = request.form.get('mode', 'bw') # Get mode again to decide which threshold to read
-        bw_threshold_value_str = '50' # Default BW threshold
-        color_threshold_value_str = '20' # Default Color threshold
-
-        if current_mode == 'bw':
-            bw_threshold_value_str = request.form.get('bg_threshold_bw', '50')
-        else: # color mode
-            color_threshold_value_str = request.form.get('bg_threshold_col', '20')
-
-        try:
-            bw_threshold_for_vectorize = int(bw_threshold_value_str)
-        except (ValueError, TypeError):
-             bw_threshold_for_vectorize = 50
-        bw_threshold_for_vectorize = max(0, min(100, bw_threshold_for_vectorize)) # Clamp BW threshold
-
-        try:
-            color_threshold_for_rembg = int(color_threshold_value_str)
-        except (ValueError, TypeError):
-            color_threshold_for_rembg = 20
-        color_threshold_for_rembg = max(0, min(100, color_threshold_for_rembg)) # Clamp Color threshold
-
-        # Remove Background flag (boolean from frontend)
-        # The value from checkbox is 'on' if checked, otherwise missing. Convert to boolean.
-        remove_background = request.form.get('remove_bg') == 'on' # True if checked, False otherwise
+        # The value from the checkbox is 'on' if checked, otherwise missing
+        params = parse_vectorize_params(request.form, remove_bg_default=False)
 
         if file and allowed_file(file.filename):
-            # --- Initial Upload Processing ---
+            # --- Initial Upload: store the original, vectorize on the job pool ---
             original_extension = file.filename.rsplit('.', 1)[1].lower()
-            unique_id = str(uuid.uuid4())
-            input_filename = f"{unique_id}.{original_extension}" # Store this original filename
-            input_path = os.path.join(UPLOAD_FOLDER, input_filename)
-            file.save(input_path)
-            temp_image_for_vectorization_path = None # Path for the image passed to vectorize_image
-
+            upload_start = time.perf_counter()
             try:
-                # --- Prepare Image for Vectorization (Mode-Dependent) ---
-                print(f"Initial Upload: Processing for mode='{mode}', remove_bg={remove_background}")
-                img_original = Image.open(input_path)
-                image_to_process = img_original.copy() # Work on a copy
-
-                if remove_background:
-                    print("Initial Upload: Removing background...")
-                    img_byte_arr = io.BytesIO()
-                    img_format = image_to_process.format if image_to_process.format else 'PNG'
-                    if img_format.upper() == 'JPEG': img_format = 'PNG'
-                    image_to_process.save(img_byte_arr, format=img_format)
-                    img_byte_arr.seek(0)
-                    try:
-                        rembg_params = { # Default params
-                            "alpha_matting": True,
-                            "alpha_matting_foreground_threshold": 235,
-                            "alpha_matting_background_threshold": 15,
-                            "alpha_matting_erode_size": 1
-                        }
-                        if mode == 'color':
-                            # Map slider 0-100 to rembg thresholds for color mode (non-linear scaling)
-                            # Slider 0 (vorsichtig): fg=250, bg=10
-                            # Slider 100 (aggressiv): fg=225, bg=35
-                            # Use cubic scaling for finer control at low values, even more aggressive at high values
-                            normalized_slider = color_threshold_for_rembg / 100.0
-                            scaled_slider = normalized_slider ** 3 # Cubic scaling
-                            fg_thresh = round(250 - scaled_slider * 25) # Range 250 -> 225
-                            bg_thresh = round(10 + scaled_slider * 25) # Range 10 -> 35
-                            rembg_params["alpha_matting_foreground_threshold"] = fg_thresh
-                            rembg_params["alpha_matting_background_threshold"] = bg_thresh
-                            print(f"Initial Upload: Using color threshold {color_threshold_for_rembg} (scaled: {scaled_slider:.2f}) -> rembg fg={fg_thresh}, bg={bg_thresh}")
-                        else:
-                             print(f"Initial Upload: Using default rembg params for mode '{mode}'")
-
-
-                        output_data_bytes = remove(img_byte_arr.read(), **rembg_params)
-                        image_after_rembg = Image.open(io.BytesIO(output_data_bytes))
-                        # Ensure RGBA after rembg
-                        if image_after_rembg.mode != 'RGBA':
-                            image_after_rembg = image_after_rembg.convert('RGBA')
-                        image_to_process = image_after_rembg
-                    except Exception as rembg_error:
-                         print(f"rembg failed during initial upload: {rembg_error}. Proceeding without background removal.")
-                         # Fallback: ensure the original image is RGBA if we intended to remove bg
-                         if image_to_process.mode != 'RGBA':
-                              image_to_process = image_to_process.convert('RGBA')
-                    finally:
-                         del img_byte_arr
-
-                # --- Mode-specific preparation ---
-                temp_filename_base = f"{unique_id}_prepped"
-                if mode == 'color':
-                    # For color mode, ensure RGBA and save as PNG
-                    print("Initial Upload: Preparing for color mode (RGBA PNG)...")
-                    if image_to_process.mode != 'RGBA':
-                        image_to_process = image_to_process.convert('RGBA')
-                    temp_image_filename = f"{temp_filename_base}.png"
-                    temp_image_for_vectorization_path = os.path.join(TEMP_FOLDER, temp_image_filename)
-                    image_to_process.save(temp_image_for_vectorization_path, 'PNG')
-                else: # mode == 'bw'
-                    # For bw mode, place on white background, convert to RGB, save as PNG
-                    # (vectorize_image will handle the conversion to BMP + threshold)
-                    print("Initial Upload: Preparing for bw mode (RGB PNG on white bg)...")
-                    white_bg = Image.new("RGBA", image_to_process.size, "WHITE")
-                    # Ensure image_to_process is RGBA before pasting if it has alpha
-                    if image_to_process.mode != 'RGBA':
-                         image_to_process = image_to_process.convert('RGBA')
-                    white_bg.paste(image_to_process, (0, 0), image_to_process) # Use alpha mask
-                    final_rgb = white_bg.convert("RGB")
-                    temp_image_filename = f"{temp_filename_base}.png"
-                    temp_image_for_vectorization_path = os.path.join(TEMP_FOLDER, temp_image_filename)
-                    final_rgb.save(temp_image_for_vectorization_path, 'PNG')
-                    del final_rgb # Clean up memory
-
-                del image_to_process # Clean up memory
-
-                # --- Vectorization ---
-                print(f"Initial Upload: Calling vectorize_image with path: {temp_image_for_vectorization_path}")
-                # Note: vectorize_image now handles cleanup of its temp input file (temp_image_for_vectorization_path)
-                svg_filename = vectorize_image(
-                    image_path_for_vectorization=temp_image_for_vectorization_path,
-                    base_unique_id=unique_id,
-                    mode=mode,
-                    colors=colors,
-                    detail=detail,
-                    bw_threshold=bw_threshold_for_vectorize # Pass only the BW threshold
-                )
-
-            except Exception as e:
-                 print(f"Error during initial processing: {e}")
-                 # No need to clean temp_image_for_vectorization_path here, vectorize_image's finally block handles it
-                 return jsonify({"error": f"Processing failed: {e}"}), 500
-            # No finally block needed here for temp_image_for_vectorization_path cleanup
-
-
-            # Return JSON for AJAX requests (Initial Upload)
-            return jsonify({
+                # Streamed with a byte cap; magic bytes and dimensions are checked before anything is decoded
+                input_filename, image_size = store_upload(file.stream, original_extension, MAX_UPLOAD_BYTES)
+            except uploads.UploadRejected as e:
+                return jsonify({"error": str(e)}), e.status
+            metrics.STAGE_SECONDS.labels('upload', params["mode"], 'true' if params["remove_bg"] else 'false').observe(time.perf_counter() - upload_start)
+
+            # Returns 202 with the job id; the frontend polls the status URL for the SVG
+            return submit_vectorize_job('upload', input_filename, params, meta={
                 "uploaded_file_url": url_for('uploaded_file_serve', filename=input_filename), # URL of original upload
                 "input_filename": input_filename, # Pass back the original filename for reprocess
-                "svg_file_url": url_for('serve_svg', filename=svg_filename), # URL of the generated SVG
-                "download_url": url_for('download_file', filename=svg_filename) # Download URL for this SVG
-            })
+            }, image_size=image_size)
         elif file:
              return jsonify({"error": "File type not allowed"}), 400
         else: # Should not happen if file checks are done correctly, but as a fallback
@@ -369,177 +1129,218 @@ def index():
 # --- New Route for Reprocessing ---
 @app.route('/reprocess', methods=['POST'])
 def reprocess():
-    # --- Run Cleanup ---
-    try:
-        cleanup_old_files(UPLOAD_FOLDER, CLEANUP_AGE_SECONDS)
-        cleanup_old_files(OUTPUT_FOLDER, CLEANUP_AGE_SECONDS)
-        cleanup_old_files(TEMP_FOLDER, CLEANUP_AGE_SECONDS)
-    except Exception as cleanup_error:
-        print(f"Warning: Reprocess cleanup failed: {cleanup_error}")
-
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid request data"}), 400
 
     input_filename = data.get('input_filename')
-    mode = data.get('mode', 'color') # Default to color
-    try:
-        # Colors (2-32 from frontend)
-        colors = int(data.get('colors', 8))
-    except (ValueError, TypeError):
-        colors = 8
-    colors = max(2, min(32, colors))
-
-    try:
-        # Detail (1-10 from frontend)
-        detail = int(data.get('detail', 5))
-    except (ValueError, TypeError):
-        detail = 5
-    detail = max(1, min(10, detail))
+    # Remove background is sent as boolean from frontend JS
+    params = parse_vectorize_params(data, remove_bg_default=True)
 
-    # Read the correct threshold based on mode from JSON data
-    current_mode_reprocess = data.get('mode', 'bw')
-    # Frontend sends the correct threshold value under 'bg_threshold' key
-    threshold_value_reprocess = data.get('bg_threshold', 50 if current_mode_reprocess == 'bw' else 20) # Default based on mode
-
-    bw_threshold_for_vectorize_reprocess = 50
-    color_threshold_for_rembg_reprocess = 20
+    if not input_filename:
+        return jsonify({"error": "Missing input filename"}), 400
 
+    # Security check: only names issued by the upload store resolve to a file
     try:
-        if current_mode_reprocess == 'bw':
-            bw_threshold_for_vectorize_reprocess = int(threshold_value_reprocess)
-        else: # color mode
-            color_threshold_for_rembg_reprocess = int(threshold_value_reprocess)
-    except (ValueError, TypeError):
-        # Keep defaults if conversion fails
-        pass
+        original_input_path = upload_store.path(input_filename)
+    except ValueError:
+         return jsonify({"error": "Invalid input filename"}), 400
+    except FileNotFoundError:
+         return jsonify({"error": "Original input file not found"}), 404
 
-    # Clamp values
-    bw_threshold_for_vectorize_reprocess = max(0, min(100, bw_threshold_for_vectorize_reprocess))
-    color_threshold_for_rembg_reprocess = max(0, min(100, color_threshold_for_rembg_reprocess))
+    try:
+        with Image.open(original_input_path) as image: # Header only, for the preview decision
+            image_size = image.size
+    except OSError: # Also UnidentifiedImageError: the janitor may have collected the upload since
+         return jsonify({"error": "Original input file not found"}), 404
+    return submit_vectorize_job('reprocess', input_filename, params, meta={"input_filename": input_filename},
+                                image_size=image_size)
 
-    # Get remove background flag (boolean from frontend)
-    remove_background = data.get('remove_bg', True) # Sent as boolean from frontend JS
 
-    if not input_filename:
-        return jsonify({"error": "Missing input filename"}), 400
+def store_upload(stream, extension, max_bytes):
+    """
+    Streams an upload to TEMP_FOLDER while hashing it, validates it and adds it to the upload
+    store. Content that is stored already is not stored again: the new upload references the
+    existing blob and so also finds its stored mask and cached SVGs.
+    Args:
+        stream: File-like object with the upload.
+        extension (str): Lowercase file extension.
+        max_bytes (int): Size limit of the file, 0 for none.
+    Returns:
+        tuple: (upload name for input_filename, (width, height) of the image)
+    Raises:
+        uploads.UploadRejected: See uploads.store_upload().
+    """
+    temp_path = os.path.join(TEMP_FOLDER, f"upload-{uuid.uuid4().hex}.{extension}")
+    content_hash = hashlib.sha256()
+    image_size = uploads.store_upload(stream, temp_path, max_bytes, MAX_UPLOAD_PIXELS, hasher=content_hash)
+    try:
+        return upload_store.add(temp_path, content_hash.hexdigest(), extension), image_size
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
-    # Security check: ensure filename is safe
-    if '..' in input_filename or input_filename.startswith('/'):
-         return jsonify({"error": "Invalid input filename"}), 400
-    original_input_path = os.path.join(UPLOAD_FOLDER, input_filename)
 
-    if not os.path.exists(original_input_path):
-         return jsonify({"error": "Original input file not found"}), 404
+# --- Batch Conversion ---
+def store_batch_input(name, stream):
+    """
+    Stores one image of a batch in the upload store.
+    Returns:
+        dict: Batch item with the original name and either input_filename or an error.
+    """
+    if not allowed_file(name):
+        return {"name": name, "error": "File type not allowed"}
+    try:
+        input_filename, _ = store_upload(stream, name.rsplit('.', 1)[1].lower(), BATCH_MAX_FILE_BYTES)
+    except uploads.UploadRejected as e:
+        return {"name": name, "error": str(e)}
+    return {"name": name, "input_filename": input_filename}
 
-    base_unique_id = input_filename.split('.')[0] # Get the original UUID part
-    temp_image_for_vectorization_path = None # Path for the image passed to vectorize_image
-    reprocess_unique_id = str(uuid.uuid4()) # Unique ID for temp files in this reprocess request
+def stream_batch_zip(items, params):
+    """
+    Vectorizes the batch items on the job pool and yields a ZIP archive of the SVGs as they finish.
+    At most BATCH_CONCURRENCY jobs of the batch are in flight, cached SVGs are added without a job.
+    The archive ends with manifest.json listing the outcome of every file.
+    If the client disconnects, the batch's outstanding jobs are cancelled.
+    """
+    archive = batch.ZipStream()
+    used_names = {"manifest.json"}
+    manifest = []
+    pending = deque()
+    running = {} # future -> (item, job, submitted_at)
+
+    def add_svg(item, svg_filename, cached, seconds):
+        arcname = batch.unique_name(f"{os.path.splitext(item['name'])[0]}.svg", used_names)
+        with open(svg_cache.path(svg_filename), 'rb') as f:
+            archive.add(arcname, f.read())
+        manifest.append({"file": item["name"], "status": "done", "svg": arcname, "cached": cached, "seconds": round(seconds, 3)})
+
+    for item in items:
+        if "error" in item:
+            manifest.append({"file": item["name"], "status": "skipped", "error": item["error"]})
+        else:
+            pending.append(item)
 
     try:
-        # --- Prepare Image for Vectorization (Mode-Dependent) ---
-        print(f"Reprocessing: Processing for mode='{mode}', remove_bg={remove_background}")
-        img_original = Image.open(original_input_path)
-        image_to_process = img_original.copy() # Work on a copy
-
-        if remove_background:
-            print("Reprocessing: Removing background...")
-            img_byte_arr = io.BytesIO()
-            img_format = image_to_process.format if image_to_process.format else 'PNG'
-            if img_format.upper() == 'JPEG': img_format = 'PNG'
-            image_to_process.save(img_byte_arr, format=img_format)
-            img_byte_arr.seek(0)
+        while pending or running:
+            # Keep the batch's share of the pool busy
+            while pending and len(running) < max(1, BATCH_CONCURRENCY):
+                item = pending[0]
+                cache_key = svg_cache_key(item["input_filename"], params)
+                cached_filename = svg_cache.get(cache_key)
+                if cached_filename is not None:
+                    pending.popleft()
+                    add_svg(item, cached_filename, True, 0.0)
+                    continue
+                try:
+                    job = job_queue.submit('batch', run_vectorize_job, item["input_filename"], params, 'Batch',
+                                           meta={"input_filename": item["input_filename"]}, cache_key=cache_key)
+                except QueueClosedError as e:
+                    pending.popleft()
+                    manifest.append({"file": item["name"], "status": "failed", "error": str(e)})
+                    continue
+                except QueueFullError as e:
+                    if running:
+                        break # Wait for one of our own jobs instead
+                    time.sleep(min(e.retry_after, 5))
+                    continue
+                pending.popleft()
+                running[job.future] = (item, job, time.time())
+
+            chunk = archive.drain()
+            if chunk:
+                yield chunk
+            if not running:
+                continue
+
+            done, _ = wait_for_futures(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                item, job, submitted_at = running.pop(future)
+                seconds = time.time() - submitted_at
+                try:
+                    result = future.result()
+                except Exception as e: # Failed or cancelled, reported per file
+                    logger.warning(f"Batch: {item['name']} failed: {e}")
+                    manifest.append({"file": item["name"], "status": "failed", "error": str(e) or type(e).__name__})
+                    continue
+                try:
+                    add_svg(item, result["svg_filename"], False, seconds)
+                except OSError as e:
+                    manifest.append({"file": item["name"], "status": "failed", "error": f"SVG not readable: {e}"})
+            chunk = archive.drain()
+            if chunk:
+                yield chunk
+
+        archive.add("manifest.json", json.dumps({"params": params, "files": manifest}, indent=2))
+        archive.close()
+        yield archive.drain()
+    finally:
+        # Client went away (or an unexpected error): don't leave the batch's jobs running
+        for item, job, _ in running.values():
+            job.cancel()
+
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    """
+    Converts many images with one shared parameter set. Accepts several 'files' (or 'file')
+    parts, each an image or a ZIP archive of images, and streams back a ZIP of the SVGs.
+    """
+    request.max_content_length = BATCH_MAX_REQUEST_BYTES or None # Set before the form is parsed
+    files = request.files.getlist('files') + request.files.getlist('file')
+    files = [upload for upload in files if upload.filename]
+    if not files:
+        return jsonify({"error": "No files"}), 400
+    params = parse_vectorize_params(request.form, remove_bg_default=False)
+
+    items = []
+    for upload in files:
+        if len(items) >= BATCH_MAX_FILES:
+            break
+        if upload.filename.lower().endswith('.zip'):
             try:
-                rembg_params_reprocess = { # Default params
-                    "alpha_matting": True,
-                    "alpha_matting_foreground_threshold": 235,
-                    "alpha_matting_background_threshold": 15,
-                    "alpha_matting_erode_size": 1
-                }
-                if mode == 'color':
-                    # Map slider 0-100 to rembg thresholds for color mode (non-linear scaling)
-                   # Slider 0 (vorsichtig): fg=250, bg=10
-                   # Slider 100 (aggressiv): fg=225, bg=35
-                   # Use cubic scaling for finer control at low values, even more aggressive at high values
-                   normalized_slider_reprocess = color_threshold_for_rembg_reprocess / 100.0
-                   scaled_slider_reprocess = normalized_slider_reprocess ** 3 # Cubic scaling
-                   fg_thresh_reprocess = round(250 - scaled_slider_reprocess * 25) # Range 250 -> 225
-                   bg_thresh_reprocess = round(10 + scaled_slider_reprocess * 25) # Range 10 -> 35
-                   rembg_params_reprocess["alpha_matting_foreground_threshold"] = fg_thresh_reprocess
-                   rembg_params_reprocess["alpha_matting_background_threshold"] = bg_thresh_reprocess # Corrected indentation
-                   print(f"Reprocessing: Using color threshold {color_threshold_for_rembg_reprocess} (cubic scaled: {scaled_slider_reprocess:.2f}) -> rembg fg={fg_thresh_reprocess}, bg={bg_thresh_reprocess}") # Updated print
-                else:
-                    print(f"Reprocessing: Using default rembg params for mode '{mode}'")
-
-                output_data_bytes = remove(img_byte_arr.read(), **rembg_params_reprocess)
-                image_after_rembg = Image.open(io.BytesIO(output_data_bytes))
-                 # Ensure RGBA after rembg
-                if image_after_rembg.mode != 'RGBA':
-                    image_after_rembg = image_after_rembg.convert('RGBA')
-                image_to_process = image_after_rembg
-            except Exception as rembg_error:
-                 print(f"rembg failed during reprocess: {rembg_error}. Proceeding without background removal.")
-                 # Fallback: ensure the original image is RGBA if we intended to remove bg
-                 if image_to_process.mode != 'RGBA':
-                      image_to_process = image_to_process.convert('RGBA')
-            finally:
-                 del img_byte_arr
+                for name, member in batch.iter_zip_members(upload.stream, BATCH_MAX_FILES - len(items)):
+                    items.append(store_batch_input(name, member))
+            except zipfile.BadZipFile:
+                items.append({"name": upload.filename, "error": "Invalid ZIP archive"})
         else:
-             # If not removing background, ensure it's RGBA for color mode consistency
-             if mode == 'color' and image_to_process.mode != 'RGBA':
-                  print("Reprocessing: Converting original to RGBA for color mode (no bg removal)...")
-                  image_to_process = image_to_process.convert('RGBA')
-             # For BW mode without removal, it will be handled below
-
-        # --- Mode-specific preparation ---
-        temp_filename_base = f"{base_unique_id}_{reprocess_unique_id}_prepped"
-        if mode == 'color':
-            # For color mode, ensure RGBA and save as PNG
-            print("Reprocessing: Preparing for color mode (RGBA PNG)...")
-            if image_to_process.mode != 'RGBA': # Double check, might have been converted already
-                image_to_process = image_to_process.convert('RGBA')
-            temp_image_filename = f"{temp_filename_base}.png"
-            temp_image_for_vectorization_path = os.path.join(TEMP_FOLDER, temp_image_filename)
-            image_to_process.save(temp_image_for_vectorization_path, 'PNG')
-        else: # mode == 'bw'
-            # For bw mode, place on white background, convert to RGB, save as PNG
-            print("Reprocessing: Preparing for bw mode (RGB PNG on white bg)...")
-            white_bg = Image.new("RGBA", image_to_process.size, "WHITE")
-            # Ensure image_to_process is RGBA before pasting if it has alpha
-            if image_to_process.mode != 'RGBA':
-                 image_to_process = image_to_process.convert('RGBA')
-            white_bg.paste(image_to_process, (0, 0), image_to_process) # Use alpha mask
-            final_rgb = white_bg.convert("RGB")
-            temp_image_filename = f"{temp_filename_base}.png"
-            temp_image_for_vectorization_path = os.path.join(TEMP_FOLDER, temp_image_filename)
-            final_rgb.save(temp_image_for_vectorization_path, 'PNG')
-            del final_rgb
-
-        del image_to_process # Clean up memory
-
-        # --- Vectorization ---
-        print(f"Reprocessing: Calling vectorize_image with path: {temp_image_for_vectorization_path}")
-        # Note: vectorize_image now handles cleanup of its temp input file (temp_image_for_vectorization_path)
-        svg_filename = vectorize_image(
-            image_path_for_vectorization=temp_image_for_vectorization_path,
-            base_unique_id=base_unique_id,
-            mode=mode,
-            colors=colors,
-            detail=detail,
-            bw_threshold=bw_threshold_for_vectorize_reprocess # Pass only the BW threshold
-        )
-
-        # --- Return new SVG details ---
-        return jsonify({
-            "svg_file_url": url_for('serve_svg', filename=svg_filename),
-            "download_url": url_for('download_file', filename=svg_filename)
-        })
-
-    except Exception as e:
-        print(f"Error during reprocessing: {e}")
-        # No need to clean temp_image_for_vectorization_path here, vectorize_image's finally block handles it
-        return jsonify({"error": f"Reprocessing failed: {e}"}), 500
-    # No finally block needed here for temp_image_for_vectorization_path cleanup
+            items.append(store_batch_input(upload.filename, upload.stream))
+    logger.info(f"Batch: {len(items)} files, mode={params['mode']}")
+
+    response = Response(stream_batch_zip(items, params), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="vectorized.zip"'
+    return response
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    # Raised while parsing a body above the content length limit; JSON like the other upload errors
+    return jsonify({"error": f"Request exceeds the limit of {request.max_content_length} bytes."}), 413
+
+# --- Job Status / Result Polling ---
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job_status_payload(job))
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    status = job.status
+    if status in ('queued', 'running'):
+        response = jsonify(job_status_payload(job))
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+        return response
+    if status == 'cancelled':
+        return jsonify({"error": "Job was cancelled", "status": status}), 410
+    if status == 'failed':
+        return jsonify({"error": f"Processing failed: {job.error}", "status": status}), 500
+    return jsonify(job_status_payload(job))
 
 
 @app.route('/download/<filename>')
@@ -547,17 +1348,46 @@ def download_file(filename):
     # Basic security check: prevent directory traversal
     if '..' in filename or filename.startswith('/'):
         return "Invalid filename", 400
-    return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
+    return send_svg(filename, as_attachment=True)
 
 # Removed the old /clean route as cleanup is now automatic
 
 # Route to serve uploaded files (original images)
 @app.route('/uploads/<filename>')
 def uploaded_file_serve(filename):
-    # Basic security check: prevent directory traversal
-    if '..' in filename or filename.startswith('/'):
+    # Only names issued by the upload store resolve, which also rules out directory traversal
+    try:
+        input_path = upload_store.path(filename)
+    except ValueError:
         return "Invalid filename", 400
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    except FileNotFoundError:
+        return "Not found", 404
+    return send_cacheable(input_path, upload_store.digest(filename), download_name=filename) # The name carries the content hash
+
+# Readiness probe: healthy only once the rembg model is loaded
+@app.route('/ready')
+def ready():
+    status = rembg_sessions.status()
+    if JOB_EXECUTOR == 'process':
+        # The model lives in the job workers, ready once they all finished warming up
+        status["ready"] = job_queue.ready
+    elif not REMBG_PRELOAD:
+        status["ready"] = True # Lazy loading was requested explicitly
+    status["jobs"] = job_queue.stats()
+    # Selected in every process the same way, so the web process reports what the workers use
+    status["tracers"] = {tool: tracer.to_dict() for tool, tracer in tracers.items()}
+    return jsonify(status), (200 if status["ready"] else 503)
+
+# Route exposing the rembg and SVG cache counters and the janitor's storage metrics
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({"rembg": rembg_cache.stats(), "svg": svg_cache.stats(), "storage": janitor.stats(),
+                    "uploads": upload_store.stats()})
+
+# Prometheus scrape endpoint: stage latency histograms, job/tool counters, cache and storage gauges
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
 
 # Route to serve generated SVG files
 @app.route('/output/<filename>')
@@ -565,8 +1395,112 @@ def serve_svg(filename):
      # Basic security check: prevent directory traversal
     if '..' in filename or filename.startswith('/'):
         return "Invalid filename", 400
-    return send_from_directory(OUTPUT_FOLDER, filename)
+    return send_svg(filename)
+
+def send_svg(filename, as_attachment=False):
+    """
+    Sends a file from OUTPUT_FOLDER (sharded, see SvgCache.path()). For an SVG with a
+    precompressed variant in an encoding the client accepts (brotli preferred over gzip), the
+    variant is sent with Content-Encoding set, so nothing is compressed per request. Each
+    variant has its own ETag, the hash of its bytes. Only SVGs named after their cache key are
+    marked immutable; one-off outputs (e.g. traced after rembg failed) are revalidated.
+    """
+    svg_path = svg_cache.path(filename)
+    path, coding = svg_path, None
+    if filename.endswith('.svg'):
+        for variant_coding, variant_path in svg_optimize.variant_paths(svg_path).items():
+            if request.accept_encodings[variant_coding] and os.path.isfile(variant_path):
+                path, coding = variant_path, variant_coding
+                break
+    try:
+        etag = file_etags.get(path)
+    except OSError:
+        return "Not found", 404
+    response = send_cacheable(path, etag, immutable=svg_cache.is_cached(filename),
+                              mimetype='image/svg+xml' if coding else None,
+                              as_attachment=as_attachment, download_name=filename)
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept-Encoding') # Caches must not hand the compressed body to other clients
+    return response
+
+def send_cacheable(path, etag, immutable=True, mimetype=None, as_attachment=False, download_name=None):
+    """
+    Sends a file with a strong ETag. A file whose content is fully determined by its name
+    (uploads are named after their content, cached SVGs after everything that shapes them) gets,
+    unless HTTP_CACHE_MAX_AGE is 0, Cache-Control "public, max-age, immutable", so browsers and
+    CDNs reuse it without asking again; other files "no-cache", so they are revalidated by ETag.
+    Conditional requests are answered with 304, Range requests with 206. With SENDFILE_HEADER
+    set, the response only carries the headers and the front proxy sends the file (and answers
+    Range requests itself).
+    Args:
+        path (str): File to send.
+        etag (str): Strong ETag (a content hash) of the file.
+        immutable (bool): The content under this name can never differ.
+        mimetype (str): Content type, guessed from path if None.
+        as_attachment (bool): Send Content-Disposition: attachment.
+        download_name (str): Filename offered for the download, the basename of path if None.
+    Returns:
+        flask.Response: 200, 206 or 304 response.
+    """
+    offload = SENDFILE_HEADER != 'none'
+    # Relative paths would be resolved against the app's root_path, not the working directory
+    response = send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name, etag=etag, max_age=HTTP_CACHE_MAX_AGE if immutable else 0,
+                         conditional=not offload)
+    if immutable and HTTP_CACHE_MAX_AGE > 0:
+        response.cache_control.immutable = True
+    if offload:
+        # 304s are still answered here; werkzeug would answer ranges with an empty body
+        response = response.make_conditional(request.environ)
+        response.headers.pop('X-Sendfile', None)
+        if response.status_code == 200:
+            header, value = http_cache.offload_header(path, SENDFILE_HEADER, os.path.dirname(OUTPUT_FOLDER),
+                                                      X_ACCEL_REDIRECT_PREFIX)
+            response.headers[header] = value
+            response.content_length = 0 # The proxy sends the file with its own length
+    return response
+
+
+def start_background_services():
+    """
+    Starts the job pool and the janitor of this web process. Called before the development
+    server starts and by gunicorn once its worker has loaded the app (see gunicorn.conf.py).
+    """
+    # Don't accept requests before the model is loaded, so nobody hits a cold session.
+    # With a process pool the model is loaded in the workers instead (see init_job_worker).
+    if REMBG_PRELOAD and JOB_EXECUTOR == 'thread':
+        try:
+            rembg_sessions.load()
+        except Exception as e:
+            logger.warning(f"rembg model could not be preloaded, background removal will retry on demand: {e}")
+    job_queue.start(warmup_fn=warm_job_worker)
+    janitor.start()
+
+def stop_background_services():
+    """
+    Graceful shutdown: lets running jobs finish (up to JOB_DRAIN_SECONDS), cancels the rest and
+    removes the temp files of jobs that could not be stopped, then stops the janitor.
+    """
+    unfinished = job_queue.drain(JOB_DRAIN_SECONDS)
+    for job in unfinished:
+        input_filename = job.meta.get("input_filename")
+        if not input_filename:
+            continue
+        # Temp files of a job are named after its input's name (see vectorize_image)
+        prefix = f"{input_filename.split('.')[0]}_"
+        for entry in os.scandir(TEMP_FOLDER):
+            if entry.name.startswith(prefix):
+                try: os.remove(entry.path)
+                except OSError as e: logger.warning(f"Could not remove temp file {entry.path}: {e}")
+    janitor.stop()
+    logger.info(f"Background services stopped ({len(unfinished)} jobs did not finish in time).")
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    # Development server. In production gunicorn serves the app, see gunicorn.conf.py
+    start_background_services()
+    try:
+        app.run(host='0.0.0.0', port=5000, threaded=True)
+    finally:
+        stop_background_services()
@@ -0,0 +1,76 @@
+import zipfile
+import posixpath
+
+
+class ZipStream:
+    """
+    Writes a ZIP archive incrementally, for streaming it out as a response.
+
+    zipfile accepts any object with write() and switches to data descriptors when the
+    target can't seek, so entries can be added one by one and the bytes produced so far
+    handed to the client with drain() instead of buffering the whole archive.
+    """
+
+    def __init__(self, compresslevel=6):
+        self._chunks = []
+        self._zip = zipfile.ZipFile(self, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+    def write(self, data):
+        # Called by zipfile
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def add(self, arcname, data):
+        """Adds one entry (bytes or str) to the archive."""
+        self._zip.writestr(arcname, data)
+
+    def close(self):
+        """Writes the central directory, drain() afterwards to get the final bytes."""
+        self._zip.close()
+
+    def drain(self):
+        """Returns and forgets the archive bytes written since the last call."""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_name(name, used_names):
+    """Returns name, or name with a numeric suffix if it is already in used_names, and records it."""
+    stem, extension = posixpath.splitext(name)
+    candidate = name
+    counter = 1
+    while candidate in used_names:
+        candidate = f"{stem}_{counter}{extension}"
+        counter += 1
+    used_names.add(candidate)
+    return candidate
+
+
+def iter_zip_members(file_obj, max_files):
+    """
+    Lists the files of an uploaded ZIP archive.
+    Args:
+        file_obj: Seekable file-like object with the archive.
+        max_files (int): Maximum number of members that are returned.
+    Yields:
+        tuple: (base name of the member, opened member stream), directories are skipped.
+    Raises:
+        zipfile.BadZipFile: If the upload is not a valid ZIP archive.
+    """
+    with zipfile.ZipFile(file_obj) as archive:
+        count = 0
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = posixpath.basename(info.filename.replace('\\', '/'))
+            if not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue # Resource forks and hidden files added by archivers
+            if count >= max_files:
+                return
+            count += 1
+            with archive.open(info) as member:
+                yield name, member
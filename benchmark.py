@@ -0,0 +1,670 @@
+"""
+End-to-end benchmark for the vectorization pipeline.
+
+Drives the same code path as the web frontend (POST / and POST /reprocess, then polling the
+job status) through the Flask test client, on a corpus of synthetic images, and writes the
+results as JSON so runs can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+    python benchmark.py --stub rembg,tracer --sizes 512,2048   # Python-side overhead only
+    python benchmark.py --matting --sizes 800,1600              # Matting engines only, see compare_matting()
+
+The app is configured through its usual environment variables (JOB_EXECUTOR, JOB_WORKERS,
+MAX_WORKING_PIXELS, ...). It runs in a fresh working directory, so processing/ starts empty.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+IMAGE_KINDS = ('logo', 'logo_alpha', 'photo', 'photo_alpha', 'lineart', 'lineart_alpha')
+MATTING_EDGES = {'sharp': 1, 'soft': 4} # Blur (in model mask pixels) of the simulated segmentation mask
+STUB_ENV = 'BENCHMARK_STUBS' # Also read by the spawned job workers, see the bottom of this file
+STUB_TOOLS = ('potrace', 'vtracer')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Synthetic corpus ---
+def make_image(kind, long_edge, seed=0):
+    """
+    Renders a synthetic test image.
+    Args:
+        kind (str): One of IMAGE_KINDS; the '_alpha' variants have a transparent background.
+        long_edge (int): Width in pixels, the height is 3/4 of it.
+        seed (int): Seed for the random shapes and noise.
+    Returns:
+        tuple: (encoded file bytes, file extension)
+    """
+    width, height = long_edge, max(1, long_edge * 3 // 4)
+    rng = np.random.default_rng(seed)
+    alpha = kind.endswith('_alpha')
+    base = kind[:-len('_alpha')] if alpha else kind
+
+    if base == 'photo':
+        # Smooth color fields plus sensor-like noise: many distinct colors, no hard edges
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        channels = []
+        for _ in range(3):
+            fx, fy, phase = rng.uniform(1, 6, size=2).tolist() + [rng.uniform(0, math.pi)]
+            field = np.sin(x / width * fx * math.pi + phase) * np.cos(y / height * fy * math.pi)
+            channels.append(127 + 100 * field + rng.normal(0, 12, size=field.shape))
+        image = Image.fromarray(np.clip(np.dstack(channels), 0, 255).astype(np.uint8), 'RGB')
+        if alpha:
+            # Soft vignette, the subject fades into transparency
+            distance = np.hypot((x - width / 2) / (width / 2), (y - height / 2) / (height / 2))
+            image.putalpha(Image.fromarray((np.clip(1.3 - distance, 0, 1) * 255).astype(np.uint8), 'L'))
+    else:
+        image = Image.new('RGBA', (width, height), (255, 255, 255, 0 if alpha else 255))
+        draw = ImageDraw.Draw(image)
+        stroke = max(1, long_edge // 200)
+        if base == 'logo':
+            # A few flat colored shapes
+            palette = [tuple(int(v) for v in rng.integers(0, 256, size=3)) + (255,) for _ in range(5)]
+            for i in range(8):
+                x0, y0 = rng.uniform(0, 0.8, size=2) * (width, height)
+                x1, y1 = (x0, y0) + rng.uniform(0.1, 0.4, size=2) * (width, height)
+                box = [float(x0), float(y0), float(x1), float(y1)]
+                (draw.ellipse if i % 2 else draw.rectangle)(box, fill=palette[i % len(palette)])
+        else: # lineart
+            for _ in range(40):
+                points = [tuple(float(v) for v in rng.uniform(0, 1, size=2) * (width, height)) for _ in range(3)]
+                draw.line(points, fill=(0, 0, 0, 255), width=stroke, joint='curve')
+        if not alpha:
+            image = image.convert('L' if base == 'lineart' else 'RGB')
+
+    buffer = io.BytesIO()
+    if base == 'photo' and not alpha:
+        image.save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue(), 'jpg'
+    image.save(buffer, format='PNG')
+    return buffer.getvalue(), 'png'
+
+
+def cache_busted(data, counter):
+    """
+    Appends a unique trailer after the image data. Decoders ignore it, but the content hash
+    changes, so every request misses the rembg and SVG caches like a new upload would.
+    """
+    return data + b'\0benchmark-' + str(counter).encode()
+
+
+def make_matting_scene(long_edge, mask_blur, seed=0):
+    """
+    Renders a foreground shape with a thin soft edge over a noisy gradient, with its exact alpha,
+    and a simulated segmentation mask: the alpha predicted at 320x240 (u2net's resolution),
+    blurred and upscaled, like the mask rembg hands to the matting.
+    Returns:
+        tuple: (RGB PIL.Image.Image, 'L' mask, float32 ground-truth alpha in 0..1)
+    """
+    width, height = long_edge, max(1, long_edge * 3 // 4)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = np.dstack([127 + 90 * np.sin(x / width * c * 3 + y / height * 2) for c in (1, 2, 3)])
+    foreground = np.dstack([np.full((height, width), v, dtype=np.float32) for v in (200, 60, 40)])
+    radius, angle = np.hypot(x - width / 2, y - height / 2), np.arctan2(y - height / 2, x - width / 2)
+    outline = height * 0.3 * (1 + 0.15 * np.sin(7 * angle))
+    alpha = np.clip((outline - radius) / (width / 400) + 0.5, 0, 1)
+    pixels = alpha[..., None] * foreground + (1 - alpha[..., None]) * background + rng.normal(0, 6, (height, width, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    mask = Image.fromarray((alpha * 255).astype(np.uint8), 'L').resize((320, 240), Image.BILINEAR)
+    mask = mask.filter(ImageFilter.GaussianBlur(mask_blur)).resize((width, height), Image.BILINEAR)
+    return image, mask, alpha
+
+
+def compare_matting(sizes, repeat, closed_form_max_edge):
+    """
+    Runs rembg's closed-form alpha matting and matting.refine_alpha() on the same masks and
+    reports the time and the alpha error against the known alpha, within the uncertain band of
+    the default thresholds (outside it both give exactly 0 or 255). No model is needed.
+    Args:
+        sizes (list): Image widths.
+        repeat (int): Runs per engine and scene, the fastest counts.
+        closed_form_max_edge (int): Larger images skip closed-form matting, it grows too slow.
+    Returns:
+        list: One result per (edge, size, engine).
+    """
+    import matting
+    from rembg.bg import alpha_matting_cutout
+    foreground_threshold, background_threshold, erode_size = 235, 15, 1 # build_rembg_params() defaults
+    engines = {
+        'mask': lambda image, mask: mask,
+        'guided': lambda image, mask: matting.refine_alpha(image, mask, foreground_threshold, background_threshold, erode_size),
+        'closed_form': lambda image, mask: alpha_matting_cutout(image, mask, foreground_threshold, background_threshold, erode_size).getchannel('A'),
+    }
+    results = []
+    for edge, mask_blur in MATTING_EDGES.items():
+        for size in sizes:
+            image, mask, truth = make_matting_scene(size, mask_blur)
+            mask_values = np.asarray(mask)
+            band = (mask_values >= background_threshold) & (mask_values <= foreground_threshold)
+            for engine, run in engines.items():
+                if engine == 'closed_form' and size > closed_form_max_edge:
+                    continue
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    alpha = run(image, mask)
+                    timings.append(time.perf_counter() - start)
+                error = (np.asarray(alpha, dtype=np.float32) / 255 - truth)[band] * 255
+                result = {
+                    "edge": edge,
+                    "size": size,
+                    "engine": engine,
+                    "seconds": min(timings),
+                    "band_pixels": int(band.sum()),
+                    "mae": float(np.abs(error).mean()),
+                    "rmse": float(np.sqrt((error ** 2).mean())),
+                }
+                results.append(result)
+                print(f"matting/{edge}/{size}/{engine:<12} {result['seconds'] * 1000:9.1f} ms"
+                      f"  MAE {result['mae']:6.2f}  RMSE {result['rmse']:6.2f} (of 255)")
+    return results
+
+
+# --- Stubs ---
+class StubSession:
+    """Stands in for the onnxruntime session; predict() is still called, so it is timed as 'rembg'."""
+
+    def predict(self, *args, **kwargs):
+        return []
+
+
+def stub_remove(data, session=None, **rembg_params):
+    """rembg.remove() replacement: keys out pixels close to the corner color instead of running the model."""
+    if session is not None:
+        session.predict(None)
+    image = Image.open(io.BytesIO(data)).convert('RGBA')
+    pixels = np.asarray(image)
+    distance = np.abs(pixels[..., :3].astype(np.int16) - pixels[0, 0, :3].astype(np.int16)).sum(axis=2)
+    alpha = np.where(distance > 30, pixels[..., 3], 0).astype(np.uint8)
+    image.putalpha(Image.fromarray(alpha, 'L'))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def stub_run_tool(cmd, cancel_token=None, input_data=None):
+    """
+    run_tool() replacement for potrace/vtracer: writes a one-path SVG of the right size
+    without starting a process.
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    if '--input' in cmd: # vtracer
+        with Image.open(cmd[cmd.index('--input') + 1]) as image:
+            width, height = image.size
+        svg_path = cmd[cmd.index('--output') + 1]
+    else: # potrace, PBM on stdin: "P4\n<width> <height>\n"
+        width, height = (int(v) for v in input_data.split(b'\n', 2)[1].split())
+        svg_path = cmd[cmd.index('-o') + 1]
+    with open(svg_path, 'w', encoding='utf-8') as f:
+        f.write(f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">'
+                f'<path d="M0 0h{width}v{height}h-{width}z" fill="#000"/></svg>\n')
+    return subprocess.CompletedProcess(cmd, 0, '', '')
+
+
+def install_stubs(stubs):
+    """
+    Replaces rembg and/or the tracers in the app module of this process.
+    Args:
+        stubs (list): Any of 'rembg' and 'tracer'.
+    """
+    import app as vectorizer
+    import tracing
+    if 'rembg' in stubs:
+        vectorizer.remove = stub_remove
+        vectorizer.rembg_sessions.get = StubSession
+    if 'tracer' in stubs:
+        # CLI backend everywhere, so every trace goes through run_tool, even without the real tools installed
+        vectorizer.run_tool = stub_run_tool
+        vectorizer.tracers = {tool: tracing.Tracer(tool, 'cli', tool) for tool in STUB_TOOLS}
+
+
+# --- Measurements ---
+def percentile(values, q):
+    """Linear-interpolated percentile (q in 0..100) of a non-empty list."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies):
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "mean": sum(latencies) / len(latencies),
+        "min": min(latencies),
+        "max": max(latencies),
+    }
+
+
+def directory_bytes(*directories):
+    total = 0
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass # Removed while walking
+    return total
+
+
+def process_tree_rss(root_pid):
+    """Resident set size in bytes of root_pid and all its descendants (job workers, tracers), None without /proc."""
+    if not os.path.isdir('/proc'):
+        return None
+    parents = {}
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry.name}/stat') as f:
+                parents[int(entry.name)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue # Exited while scanning
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        for child, parent in parents.items():
+            if parent == pid and child not in tree:
+                tree.add(child)
+                frontier.append(child)
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for pid in tree:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class Sampler:
+    """Background thread recording the peak RSS of the process tree and the peak size of the temp folder."""
+
+    def __init__(self, temp_folder, interval_seconds):
+        self.temp_folder = temp_folder
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._peak_rss = None
+        self._peak_temp = 0
+        self._thread = threading.Thread(target=self._run, name="benchmark-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            rss = process_tree_rss(pid)
+            temp = directory_bytes(self.temp_folder)
+            with self._lock:
+                if rss is not None:
+                    self._peak_rss = max(self._peak_rss or 0, rss)
+                self._peak_temp = max(self._peak_temp, temp)
+            self._stop.wait(self.interval_seconds)
+
+    def take_peaks(self):
+        """Returns (peak RSS bytes, peak temp bytes) since the last call and starts a new window."""
+        with self._lock:
+            peaks = (self._peak_rss, self._peak_temp)
+            self._peak_rss, self._peak_temp = None, 0
+        return peaks
+
+
+class Runner:
+    """Submits requests through a Flask test client and waits for the jobs like the frontend does."""
+
+    def __init__(self, vectorizer, poll_seconds):
+        self.vectorizer = vectorizer
+        self.poll_seconds = poll_seconds
+        self.counter = 0
+        self._lock = threading.Lock()
+
+    def next_counter(self):
+        with self._lock:
+            self.counter += 1
+            return self.counter
+
+    def wait(self, client, response, start):
+        """
+        Polls the job until it finished.
+        Returns:
+            dict: Outcome with the client-side latency, the job status and the worker's stage timings.
+        """
+        payload = response.get_json()
+        while payload["status"] in ('queued', 'running'):
+            time.sleep(self.poll_seconds)
+            payload = client.get(payload["status_url"]).get_json()
+        latency = time.perf_counter() - start
+        job = self.vectorizer.job_queue.get(payload["job_id"])
+        stages = {}
+        if job is not None and job.result and "stages" in job.result:
+            stages = dict(job.result["stages"], queue_wait=max(0.0, job.result["started_at"] - job.created_at))
+        return {"latency": latency, "status": payload["status"], "payload": payload, "stages": stages}
+
+    def submit(self, client, send):
+        """Sends a request, retrying after the Retry-After delay while the queue is full."""
+        rejected = 0
+        while True:
+            start = time.perf_counter()
+            response = send()
+            if response.status_code != 429:
+                break
+            rejected += 1
+            time.sleep(min(1.0, float(response.headers.get('Retry-After', 1))))
+        if response.status_code not in (200, 202):
+            raise RuntimeError(f"Request failed with HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        outcome = self.wait(client, response, start)
+        outcome["rejected"] = rejected
+        return outcome
+
+    def upload(self, client, data, extension, params):
+        body = cache_busted(data, self.next_counter())
+        form = {key: str(value) for key, value in params.items()}
+        return self.submit(client, lambda: client.post(
+            '/', data=dict(form, file=(io.BytesIO(body), f"benchmark.{extension}")),
+            content_type='multipart/form-data'))
+
+    def reprocess(self, client, input_filename, params):
+        return self.submit(client, lambda: client.post('/reprocess', json=dict(params, input_filename=input_filename)))
+
+
+def param_grid(modes, colors, details, remove_bg):
+    """Yields the request parameters to benchmark; colors/detail only vary in color mode."""
+    for bg in remove_bg:
+        for mode in modes:
+            if mode == 'bw':
+                yield {"mode": 'bw', "bg_threshold": 50, "remove_bg": bg}
+                continue
+            for color_count in colors:
+                for detail in details:
+                    yield {"mode": 'color', "colors": color_count, "detail": detail, "bg_threshold": 20, "remove_bg": bg}
+
+
+def scenario_name(op, kind, size, params):
+    variant = params["mode"] if params["mode"] == 'bw' else f"color-c{params['colors']}-d{params['detail']}"
+    return f"{op}/{kind}/{size}/{variant}/bg{int(params['remove_bg'])}"
+
+
+def mean_stages(outcomes):
+    totals = {}
+    for outcome in outcomes:
+        for stage, seconds in outcome["stages"].items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    return {stage: seconds / len(outcomes) for stage, seconds in totals.items()}
+
+
+def run_scenarios(runner, sampler, corpus, grid, repeat):
+    """
+    Sequential runs per (image, size, parameters): a cold upload, then a reprocess of the
+    same input with the same parameters after its SVG was removed, i.e. the slider path
+    with a warm rembg cache but a fresh trace.
+    """
+    vectorizer = runner.vectorizer
+    client = vectorizer.app.test_client()
+    processing_dirs = [vectorizer.UPLOAD_FOLDER, vectorizer.OUTPUT_FOLDER, vectorizer.TEMP_FOLDER, vectorizer.CACHE_FOLDER]
+    results = []
+    for (kind, size), (data, extension) in corpus.items():
+        for params in grid:
+            samples = {"upload": [], "reprocess": []}
+            disk = {"upload": [], "reprocess": []}
+            sampler.take_peaks()
+            for _ in range(repeat):
+                before = directory_bytes(*processing_dirs)
+                outcome = runner.upload(client, data, extension, params)
+                disk["upload"].append(directory_bytes(*processing_dirs) - before)
+                samples["upload"].append(outcome)
+                if outcome["status"] != 'done':
+                    continue
+                # Drop the SVG so the reprocess misses the SVG cache and traces again
+                os.remove(vectorizer.svg_cache.path(os.path.basename(outcome["payload"]["svg_file_url"])))
+                before = directory_bytes(*processing_dirs)
+                outcome = runner.reprocess(client, outcome["payload"]["input_filename"], params)
+                disk["reprocess"].append(directory_bytes(*processing_dirs) - before)
+                samples["reprocess"].append(outcome)
+            peak_rss, peak_temp = sampler.take_peaks()
+            for op, outcomes in samples.items():
+                done = [outcome for outcome in outcomes if outcome["status"] == 'done']
+                result = {
+                    "name": scenario_name(op, kind, size, params),
+                    "op": op,
+                    "image": kind,
+                    "size": size,
+                    "params": params,
+                    "latency": summarize([outcome["latency"] for outcome in done]),
+                    "failed": len(outcomes) - len(done),
+                    "stages": mean_stages(done) if done else {},
+                    "disk_bytes_per_request": (sum(disk[op]) / len(disk[op])) if disk[op] else None,
+                    "peak_temp_bytes": peak_temp,
+                    "peak_rss_bytes": peak_rss,
+                }
+                results.append(result)
+                print(f"{result['name']:<48} p50 {result['latency'].get('p50', float('nan')) * 1000:8.1f} ms"
+                      f"  p95 {result['latency'].get('p95', float('nan')) * 1000:8.1f} ms  failed {result['failed']}")
+    return results
+
+
+def run_concurrency(runner, sampler, corpus, size, clients, requests_per_client):
+    """N clients uploading concurrently, each with its own test client; reports throughput and latency under load."""
+    images = [(kind, data, extension) for (kind, image_size), (data, extension) in corpus.items() if image_size == size]
+    if not images:
+        raise ValueError(f"No corpus images at size {size}")
+    outcomes, errors = [], []
+    lock = threading.Lock()
+
+    def client_loop(index):
+        client = runner.vectorizer.app.test_client()
+        for i in range(requests_per_client):
+            kind, data, extension = images[(index + i) % len(images)]
+            params = ({"mode": 'bw', "bg_threshold": 50, "remove_bg": False} if (index + i) % 2 else
+                      {"mode": 'color', "colors": 8, "detail": 5, "bg_threshold": 20, "remove_bg": False})
+            try:
+                outcome = runner.upload(client, data, extension, params)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                outcomes.append(outcome)
+
+    sampler.take_peaks()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client_loop, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    peak_rss, peak_temp = sampler.take_peaks()
+    done = [outcome for outcome in outcomes if outcome["status"] == 'done']
+    result = {
+        "clients": clients,
+        "size": size,
+        "requests": clients * requests_per_client,
+        "completed": len(done),
+        "failed": clients * requests_per_client - len(done),
+        "rejected_429": sum(outcome["rejected"] for outcome in outcomes),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(done) / elapsed if elapsed else None,
+        "latency": summarize([outcome["latency"] for outcome in done]),
+        "peak_temp_bytes": peak_temp,
+        "peak_rss_bytes": peak_rss,
+        "errors": errors[:10],
+    }
+    print(f"concurrency {clients:>3}: {result['throughput_rps']:.2f} req/s, p50 {result['latency'].get('p50', float('nan')) * 1000:.1f} ms,"
+          f" p95 {result['latency'].get('p95', float('nan')) * 1000:.1f} ms, 429s {result['rejected_429']}")
+    return result
+
+
+def compare(results, baseline_path):
+    """Prints the p50/p95 change of every scenario that also exists in a previous result file."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {scenario["name"]: scenario for scenario in json.load(f)["scenarios"]}
+    print(f"\nCompared with {baseline_path}:")
+    for scenario in results["scenarios"]:
+        previous = baseline.get(scenario["name"])
+        if previous is None or not previous["latency"].get("count") or not scenario["latency"].get("count"):
+            continue
+        ratios = [scenario["latency"][key] / previous["latency"][key] if previous["latency"][key] else float('nan') for key in ('p50', 'p95')]
+        print(f"{scenario['name']:<48} p50 x{ratios[0]:.2f}  p95 x{ratios[1]:.2f}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def csv_list(convert=str):
+    return lambda value: [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the vectorization pipeline through the Flask test client.")
+    parser.add_argument('--output', default='benchmark-results.json', help="JSON result file")
+    parser.add_argument('--compare', help="Previous JSON result file to compare against")
+    parser.add_argument('--images', type=csv_list(), default=list(IMAGE_KINDS), help="Comma-separated image kinds")
+    parser.add_argument('--sizes', type=csv_list(int), default=[256, 1024, 2048], help="Comma-separated image widths")
+    parser.add_argument('--modes', type=csv_list(), default=['bw', 'color'])
+    parser.add_argument('--colors', type=csv_list(int), default=[4, 16], help="Color counts (color mode)")
+    parser.add_argument('--detail', type=csv_list(int), default=[3, 8], help="Detail levels (color mode)")
+    parser.add_argument('--remove-bg', choices=['off', 'on', 'both'], default='off')
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per scenario")
+    parser.add_argument('--concurrency', type=csv_list(int), default=[1, 4], help="Concurrent client counts")
+    parser.add_argument('--requests-per-client', type=int, default=4)
+    parser.add_argument('--concurrency-size', type=int, help="Image width for the concurrency runs (default: middle of --sizes)")
+    parser.add_argument('--stub', type=csv_list(), default=[], help="'rembg' and/or 'tracer': replace them to isolate Python-side overhead")
+    parser.add_argument('--poll-interval', type=float, default=0.01, help="Seconds between job status polls")
+    parser.add_argument('--sample-interval', type=float, default=0.05, help="Seconds between RSS/temp disk samples")
+    parser.add_argument('--workdir', help="Working directory for processing/ (default: a new temp directory)")
+    parser.add_argument('--keep-workdir', action='store_true')
+    parser.add_argument('--matting', action='store_true', help="Only compare the alpha matting engines (no app, no model)")
+    parser.add_argument('--closed-form-max-size', type=int, default=2048, help="Largest width closed-form matting is run at (--matting)")
+    args = parser.parse_args(argv)
+    unknown = set(args.stub) - {'rembg', 'tracer'} or set(args.images) - set(IMAGE_KINDS) or set(args.modes) - {'bw', 'color'}
+    if unknown:
+        parser.error(f"Unknown value(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_path = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    if args.matting:
+        results = {
+            "meta": {
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                "git_revision": git_revision(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "matting": compare_matting(args.sizes, args.repeat, args.closed_form_max_size),
+        }
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output_path}")
+        return
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vectorizer-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir) # processing/ is relative to the working directory
+
+    # Everything below is inherited by the spawned job workers
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if 'rembg' in args.stub:
+        os.environ['REMBG_PRELOAD'] = '0'
+    elif args.remove_bg == 'off':
+        os.environ.setdefault('REMBG_PRELOAD', '0') # The model is never used, don't wait for it
+    if args.stub:
+        os.environ[STUB_ENV] = ','.join(args.stub)
+        install_stubs(args.stub)
+    import app as vectorizer
+
+    print(f"Rendering corpus: {', '.join(args.images)} at {', '.join(map(str, args.sizes))} px")
+    corpus = {(kind, size): make_image(kind, size, seed=i) for i, kind in enumerate(args.images) for size in args.sizes}
+    remove_bg = {'off': [False], 'on': [True], 'both': [False, True]}[args.remove_bg]
+    grid = list(param_grid(args.modes, args.colors, args.detail, remove_bg))
+
+    vectorizer.job_queue.start(warmup_fn=vectorizer.warm_job_worker)
+    client = vectorizer.app.test_client()
+    start = time.time()
+    while client.get('/ready').status_code != 200:
+        if time.time() - start > 600:
+            raise SystemExit(f"Workers did not become ready within 10 minutes: {client.get('/ready').get_json()}")
+        time.sleep(0.5)
+    print(f"Workers ready after {time.time() - start:.1f}s ({vectorizer.JOB_EXECUTOR}, {vectorizer.JOB_WORKERS} workers)")
+
+    sampler = Sampler(vectorizer.TEMP_FOLDER, args.sample_interval)
+    sampler.start()
+    runner = Runner(vectorizer, args.poll_interval)
+    try:
+        scenarios = run_scenarios(runner, sampler, corpus, grid, args.repeat)
+        concurrency_size = args.concurrency_size or sorted(args.sizes)[len(args.sizes) // 2]
+        concurrency = [run_concurrency(runner, sampler, corpus, concurrency_size, clients, args.requests_per_client)
+                       for clients in args.concurrency]
+    finally:
+        sampler.stop()
+        vectorizer.job_queue.shutdown()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stubs": args.stub,
+            "config": {
+                "job_executor": vectorizer.JOB_EXECUTOR,
+                "job_workers": vectorizer.JOB_WORKERS,
+                "max_working_pixels": vectorizer.MAX_WORKING_PIXELS,
+                "rembg_mask_max_pixels": vectorizer.REMBG_MASK_MAX_PIXELS,
+                "vtracer_tile_size": vectorizer.VTRACER_TILE_SIZE,
+                "rembg_model": vectorizer.REMBG_MODEL,
+            },
+            "args": {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'workdir')},
+        },
+        "scenarios": scenarios,
+        "concurrency": concurrency,
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+    if compare_path:
+        compare(results, compare_path)
+    if not args.workdir and not args.keep_workdir:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Spawned job workers re-import this script as __mp_main__; install the same stubs there
+if __name__ == '__mp_main__' and os.environ.get(STUB_ENV):
+    install_stubs(os.environ[STUB_ENV].split(','))
+
+if __name__ == '__main__':
+    main()
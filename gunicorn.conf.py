@@ -0,0 +1,43 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app (the Dockerfile's entrypoint)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# A single web process: job state, the SVG/rembg cache counters and the metrics live in its memory,
+# so /jobs/<job_id> must be answered by the process that queued the job. The CPU-bound work (rembg,
+# potrace/vtracer) runs in its job pool, sized by JOB_WORKERS; the web process only parses uploads,
+# polls and streams files, which threads handle well.
+# This is the scaling limit: all HTTP traffic goes through this process. Raising it needs the job
+# state moved to a store the workers share first.
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16)) # Concurrent requests (uploads, job polls, downloads, /batch streams)
+
+# Not recycled after N requests: that would drop the queued jobs with the process. The job workers,
+# where the model and the image buffers live, are recycled instead (JOB_MAX_TASKS_PER_WORKER).
+max_requests = 0
+
+# The app is loaded in the worker, not in the master: onnxruntime sessions must not be forked,
+# so the rembg model is loaded by the job pool's fork server children instead (see app.py).
+preload_app = False
+
+# Time between SIGTERM and SIGKILL for the worker: open requests finish first, then the job
+# pool is drained (JOB_DRAIN_SECONDS). Give the container at least this long to stop.
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 45))
+timeout = 60 # Heartbeat timeout of the worker, gthread keeps beating while requests run
+keepalive = 5
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None # Heartbeat file off the overlay filesystem
+
+loglevel = os.environ.get('LOG_LEVEL', 'INFO').lower()
+accesslog = '-' if os.environ.get('ACCESS_LOG', '0') == '1' else None
+
+
+def post_worker_init(worker):
+    # Threads (janitor, job pool management) do not survive a fork, so they are started in the worker
+    from app import start_background_services
+    start_background_services()
+
+
+def worker_exit(server, worker):
+    from app import stop_background_services
+    stop_background_services()
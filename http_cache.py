@@ -0,0 +1,66 @@
+import os
+import hashlib
+import threading
+from urllib.parse import quote
+
+SENDFILE_HEADERS = ('none', 'x-sendfile', 'x-accel-redirect')
+
+
+class FileEtags:
+    """
+    Strong ETags for served files: the SHA-256 of the bytes on disk, so the same content gets
+    the same tag on every replica and after a restart (unlike the default mtime/size tag).
+    Files are hashed once and memoized on (path, inode, size, mtime), a rewritten file gets
+    a new tag.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memo = {} # (path, inode, size, mtime) -> sha256 hex digest
+
+    def get(self, path):
+        """
+        Returns the SHA-256 hex digest of the file at path.
+        Raises:
+            OSError: If the file cannot be read (e.g. removed by the cleanup in the meantime).
+        """
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        digest = self._memo.get(memo_key)
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            with self._lock:
+                if len(self._memo) > self.max_entries: # Outputs are short-lived, don't let the memo grow forever
+                    self._memo.clear()
+                self._memo[memo_key] = digest
+        return digest
+
+
+def offload_header(path, mode, accel_root, accel_prefix):
+    """
+    Header that hands sending the file at path over to the reverse proxy.
+    Args:
+        path (str): File to send.
+        mode (str): 'x-sendfile' (Apache mod_xsendfile, lighttpd: the absolute path) or
+            'x-accel-redirect' (nginx: an internal URI below accel_prefix).
+        accel_root (str): Folder that the proxy's internal location accel_prefix points to.
+        accel_prefix (str): URI prefix of that internal location, e.g. '/protected/'.
+    Returns:
+        tuple: (header name, header value).
+    Raises:
+        ValueError: If mode is unknown, or the file is outside accel_root.
+    """
+    path = os.path.abspath(path)
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', path
+    if mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, os.path.abspath(accel_root))
+        if relative.startswith(os.pardir):
+            raise ValueError(f"{path} is not below {accel_root}")
+        return 'X-Accel-Redirect', accel_prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    raise ValueError(f"Unknown sendfile mode '{mode}'")
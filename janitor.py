@@ -0,0 +1,214 @@
+import logging
+import os
+import time
+import heapq
+import threading
+from storage import walk_files
+
+logger = logging.getLogger(__name__)
+
+
+class Janitor:
+    """
+    Background thread that removes old processing artifacts and keeps disk usage under a quota.
+
+    Replaces the cleanup that used to run synchronously at the start of every upload and
+    reprocess request. The janitor keeps a time-ordered index (a heap keyed on mtime) of
+    the files in its directories: new artifacts are registered as they are created, and a
+    periodic os.scandir sweep picks up everything else (e.g. files written by job workers).
+    Expiry and quota enforcement then only look at the oldest entries of the index.
+    Directories are scanned recursively, for the sharded output layout. Stores with their own
+    lifecycle (the reference-counted upload store, the caches' size eviction) are passed as collectors
+    and run after each sweep, or on the next pass when request_collect() asks for it.
+    """
+
+    def __init__(self, directories, max_age_seconds, quota_bytes=0, interval_seconds=30,
+                 sweep_seconds=600, min_age_seconds=60, collectors=()):
+        """
+        Args:
+            directories (list): Folders whose files are managed.
+            max_age_seconds (int): Files older than this are removed.
+            quota_bytes (int): Upper bound for the total size of all files, 0 for no quota.
+            interval_seconds (int): How often expired entries and the quota are checked.
+            sweep_seconds (int): How often the directories are rescanned to rebuild the index.
+            min_age_seconds (int): Files younger than this are never removed for the quota,
+                so inputs and outputs of running jobs stay in place.
+            collectors (list): Callables run after every sweep, e.g. ContentStore.collect.
+        """
+        self.directories = list(directories)
+        self.max_age_seconds = max_age_seconds
+        self.quota_bytes = quota_bytes
+        self.interval_seconds = interval_seconds
+        self.sweep_seconds = sweep_seconds
+        self.min_age_seconds = min_age_seconds
+        self.collectors = list(collectors)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._collectors_due = False
+        self._thread = None
+        self._heap = [] # (mtime, path), may hold stale entries, _entries is authoritative
+        self._entries = {} # path -> (mtime, size)
+        self._total_bytes = 0
+        self._last_sweep = 0.0
+        self.metrics = {
+            "sweeps": 0,
+            "last_sweep_at": None,
+            "last_sweep_seconds": None,
+            "files_removed": 0,
+            "bytes_removed": 0,
+            "expired_removed": 0,
+            "quota_removed": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """Starts the janitor thread. Safe to call more than once."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+            self._thread.start()
+        logger.info(f"Janitor started for {', '.join(self.directories)} (max age {self.max_age_seconds}s, quota {self.quota_bytes or 'none'} bytes).")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def register(self, path):
+        """Adds a newly created artifact to the index; wakes the janitor if it pushes usage over the quota."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._track(path, stat.st_mtime, stat.st_size)
+            over_quota = self.quota_bytes and self._total_bytes > self.quota_bytes
+        if over_quota:
+            self._wakeup.set()
+
+    def request_collect(self):
+        """Runs the collectors on the next pass instead of after the next sweep (e.g. a cache went over its limit)."""
+        with self._lock:
+            self._collectors_due = True
+        self._wakeup.set()
+
+    def _track(self, path, mtime, size):
+        previous = self._entries.get(path)
+        if previous is not None:
+            self._total_bytes -= previous[1]
+        self._entries[path] = (mtime, size)
+        self._total_bytes += size
+        heapq.heappush(self._heap, (mtime, path))
+
+    def _untrack(self, path):
+        previous = self._entries.pop(path, None)
+        if previous is not None:
+            self._total_bytes -= previous[1]
+
+    def sweep(self):
+        """Rescans all directories with os.scandir, rebuilds the index, then collects."""
+        start = time.time()
+        entries = {}
+        for directory in self.directories:
+            try:
+                for entry in walk_files(directory):
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue # Removed while scanning
+                    entries[entry.path] = (stat.st_mtime, stat.st_size)
+            except OSError as e:
+                logger.warning(f"Janitor could not scan {directory}: {e}")
+                with self._lock:
+                    self.metrics["errors"] += 1
+        with self._lock:
+            self._entries = entries
+            self._heap = [(mtime, path) for path, (mtime, _) in entries.items()]
+            heapq.heapify(self._heap)
+            self._total_bytes = sum(size for _, size in entries.values())
+            self._last_sweep = time.time()
+        self.collect()
+        self.run_collectors()
+        with self._lock:
+            self.metrics["sweeps"] += 1
+            self.metrics["last_sweep_at"] = self._last_sweep
+            self.metrics["last_sweep_seconds"] = time.time() - start
+
+    def run_collectors(self):
+        """Runs every collector, a failing one is logged and counted."""
+        with self._lock:
+            self._collectors_due = False
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Janitor collector {getattr(collector, '__qualname__', collector)} failed: {e}")
+                with self._lock:
+                    self.metrics["errors"] += 1
+
+    def collect(self):
+        """Removes expired files, then the oldest ones while usage is over the quota."""
+        now = time.time()
+        removed_files = removed_bytes = 0
+        with self._lock:
+            while self._heap:
+                mtime, path = self._heap[0]
+                current = self._entries.get(path)
+                if current is None or current[0] != mtime:
+                    heapq.heappop(self._heap) # Stale: removed or re-registered with a newer mtime
+                    continue
+                expired = (now - mtime) > self.max_age_seconds
+                over_quota = (self.quota_bytes and self._total_bytes > self.quota_bytes
+                              and (now - mtime) > self.min_age_seconds)
+                if not (expired or over_quota):
+                    break # Heap order: every remaining entry is newer
+                heapq.heappop(self._heap)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > mtime:
+                        # Touched since it was indexed (e.g. an SVG cache hit), requeue as recently used
+                        self._track(path, stat.st_mtime, stat.st_size)
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    self._untrack(path) # Already gone
+                    continue
+                except OSError as e:
+                    logger.warning(f"Janitor could not remove {path}: {e}")
+                    self.metrics["errors"] += 1
+                    self._untrack(path) # Retried on the next sweep
+                    continue
+                removed_files += 1
+                removed_bytes += current[1]
+                self.metrics["expired_removed" if expired else "quota_removed"] += 1
+                self._untrack(path)
+            self.metrics["files_removed"] += removed_files
+            self.metrics["bytes_removed"] += removed_bytes
+        if removed_files:
+            logger.info(f"Janitor removed {removed_files} files ({removed_bytes} bytes).")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if (time.time() - self._last_sweep) >= self.sweep_seconds:
+                    self.sweep()
+                else:
+                    self.collect()
+                    if self._collectors_due:
+                        self.run_collectors()
+            except Exception as e:
+                logger.warning(f"Janitor pass failed: {e}")
+                with self._lock:
+                    self.metrics["errors"] += 1
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+
+    def stats(self):
+        """Returns the janitor metrics plus the current size of the index as a dict."""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["tracked_files"] = len(self._entries)
+            stats["tracked_bytes"] = self._total_bytes
+            stats["quota_bytes"] = self.quota_bytes
+            return stats
@@ -0,0 +1,367 @@
+import os
+import sys
+import math
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_for_futures
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit() when the queue is at capacity."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class QueueClosedError(QueueFullError):
+    """Raised by JobQueue.submit() once the queue is draining for shutdown."""
+
+    def __init__(self, retry_after):
+        Exception.__init__(self, f"Server is shutting down, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job that was cancelled, e.g. because a newer request superseded it."""
+
+
+class CancelToken:
+    """
+    File-based cancellation flag for a job.
+
+    A plain file works across the worker processes of the pool without a manager process:
+    the web process creates it to cancel, the worker polls it between stages and while
+    waiting for potrace/vtracer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def cancelled(self):
+        return os.path.exists(self.path)
+
+    def cancel(self):
+        with open(self.path, 'a'):
+            pass
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelledError("Job was cancelled.")
+
+
+class Job:
+    """State of a single submitted job."""
+
+    def __init__(self, kind, meta=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind # 'upload', 'reprocess', 'preview' or 'batch'
+        self.meta = meta or {} # Extra data returned with the status (e.g. input_filename)
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.cancel_token = None
+        self.supersede_key = None # Newer jobs with the same key cancel this one
+        self.superseded_by = None
+        self.cancelled = False
+
+    @property
+    def status(self):
+        if self.future is None:
+            return 'queued'
+        if self.future.cancelled() or (self.cancelled and self.finished_at is not None):
+            return 'cancelled'
+        if self.finished_at is not None:
+            return 'failed' if self.error is not None else 'done'
+        if self.future.running() or self.future.done(): # Done but completion callback still pending
+            return 'running'
+        return 'queued'
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        data.update(self.meta)
+        if self.superseded_by is not None:
+            data["superseded_by"] = self.superseded_by
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+    def cancel(self):
+        """Drops the job if it is still queued, otherwise signals the running worker to stop."""
+        self.cancelled = True
+        if self.future.cancel():
+            return
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
+
+
+class JobQueue:
+    """
+    Bounded job queue in front of a worker pool.
+
+    At most max_workers jobs run at a time and at most max_queue more wait for a slot;
+    beyond that submit() raises QueueFullError so the route can answer 429. Finished jobs
+    are kept for result_ttl seconds so clients can poll their result.
+
+    Jobs submitted with a supersede_key cancel all older outstanding jobs with the same key,
+    so only the newest request for e.g. an input file keeps running.
+
+    drain() shuts the queue down gracefully: no new jobs, running jobs get time to finish.
+    """
+
+    def __init__(self, max_workers, max_queue, executor='process', start_method='spawn',
+                 initializer=None, result_ttl=3600, on_complete=None, on_error=None, cancel_dir=None,
+                 preload=(), max_tasks_per_worker=0):
+        """
+        Args:
+            max_workers (int): Number of jobs processed concurrently.
+            max_queue (int): Number of jobs allowed to wait for a free worker.
+            executor (str): 'process' for a process pool, 'thread' for a thread pool in this process.
+            start_method (str): multiprocessing start method for the process pool.
+            initializer (callable): Run once in each worker process (e.g. to load the rembg model).
+            result_ttl (int): Seconds a finished job is kept for polling.
+            on_complete (callable): Called with the Job after it finished successfully.
+            on_error (callable): Called with the Job and the exception after it failed.
+            cancel_dir (str): Directory for cancel token files. When set, jobs receive a
+                cancel_token keyword argument (CancelToken) they are expected to check.
+            preload (list): Modules the 'forkserver' start method imports once in the fork server,
+                so workers start without importing them again and share those pages.
+            max_tasks_per_worker (int): Replace a worker process after this many jobs to bound
+                memory growth, 0 to keep workers for the lifetime of the pool (Python 3.11+).
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.executor_kind = executor
+        self.start_method = start_method
+        self.initializer = initializer
+        self.result_ttl = result_ttl
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.cancel_dir = cancel_dir
+        self.preload = list(preload)
+        self.max_tasks_per_worker = max(0, max_tasks_per_worker)
+        self.superseded = 0
+        self._closed = False
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._durations = [] # Recent job durations, used to estimate Retry-After
+        self._warmup_futures = []
+
+    def start(self, warmup_fn=None):
+        """Creates the worker pool. With warmup_fn, runs it once per worker so they load their models up front."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.executor_kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="vectorize-job",
+                                                    initializer=self.initializer)
+            else:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver' and self.preload:
+                    context.set_forkserver_preload(self.preload)
+                options = {}
+                if self.max_tasks_per_worker and sys.version_info >= (3, 11):
+                    options['max_tasks_per_child'] = self.max_tasks_per_worker
+                elif self.max_tasks_per_worker:
+                    logger.warning("Recycling job workers needs Python 3.11, workers are kept for the lifetime of the pool.")
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                     initializer=self.initializer, **options)
+            logger.info(f"Started {self.executor_kind} job pool with {self.max_workers} workers (queue depth {self.max_queue}).")
+            if warmup_fn is not None:
+                self._warmup_futures = [self._executor.submit(warmup_fn) for _ in range(self.max_workers)]
+
+    @property
+    def ready(self):
+        """True once the pool exists and every warm-up call succeeded."""
+        if self._executor is None:
+            return False
+        for future in self._warmup_futures:
+            if not future.done() or future.exception() is not None or future.result() is False:
+                return False
+        return True
+
+    def _outstanding(self):
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def _retry_after(self, outstanding):
+        average = (sum(self._durations) / len(self._durations)) if self._durations else 5.0
+        waiting = max(1, outstanding - self.max_workers + 1)
+        return max(1, math.ceil(average * waiting / self.max_workers))
+
+    def _purge(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and (now - job.finished_at) > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind, fn, *args, meta=None, supersede_key=None, **kwargs):
+        """
+        Submits fn(*args, **kwargs) to the pool.
+        Args:
+            kind (str): Job type, reported in the status.
+            fn (callable): Picklable top-level function run by the worker.
+            meta (dict): Extra data returned with the job status.
+            supersede_key (str): Cancels older outstanding jobs with the same key, once this job
+                is accepted (a refused submit leaves them running).
+        Returns:
+            Job: The queued job.
+        Raises:
+            QueueFullError: If max_workers + max_queue jobs are already outstanding.
+            QueueClosedError: If the queue is draining for shutdown.
+        """
+        if self._closed:
+            raise QueueClosedError(5) # Roughly the time a restarted instance needs to accept requests again
+        self.start()
+        job = Job(kind, meta)
+        job.supersede_key = supersede_key
+        if self.cancel_dir is not None:
+            job.cancel_token = CancelToken(os.path.join(self.cancel_dir, f"{job.id}.cancel"))
+            kwargs['cancel_token'] = job.cancel_token
+        with self._lock:
+            self._purge(time.time())
+            outstanding = self._outstanding()
+            if outstanding >= self.max_workers + self.max_queue:
+                # Refused before superseding: the client's previous job keeps running
+                raise QueueFullError(self._retry_after(outstanding))
+            job.future = self._executor.submit(fn, *args, **kwargs)
+            if supersede_key is not None:
+                self._supersede(supersede_key, job) # Only once the newer job is accepted
+            self._jobs[job.id] = job
+        job.future.add_done_callback(lambda future, job=job: self._finish(job, future))
+        return job
+
+    def complete(self, kind, result, meta=None, supersede_key=None):
+        """
+        Registers a job that is already finished (e.g. answered from a cache), so clients
+        poll it like any other job. Still supersedes older jobs with the same key.
+        Returns:
+            Job: The finished job.
+        """
+        job = Job(kind, meta)
+        job.supersede_key = supersede_key
+        job.future = Future()
+        job.future.set_result(result)
+        job.result = result
+        job.finished_at = time.time()
+        with self._lock:
+            self._purge(job.finished_at)
+            if supersede_key is not None:
+                self._supersede(supersede_key, job)
+            self._jobs[job.id] = job
+        return job
+
+    def _supersede(self, supersede_key, newer_job):
+        for job in self._jobs.values():
+            if job.supersede_key == supersede_key and not job.cancelled and not job.future.done():
+                job.superseded_by = newer_job.id
+                job.cancel()
+                self.superseded += 1
+                logger.info(f"Job {job.id} superseded by {newer_job.id} ({supersede_key}), cancelling.",
+                            extra={"job_id": job.id, "superseded_by": newer_job.id})
+
+    def _finish(self, job, future):
+        finished_at = time.time()
+        if job.cancel_token is not None:
+            job.cancel_token.clear()
+        if future.cancelled():
+            job.finished_at = finished_at
+            return
+        error = future.exception()
+        if isinstance(error, JobCancelledError):
+            job.cancelled = True
+            job.finished_at = finished_at
+            return
+        if error is not None:
+            job.error = str(error)
+            job.finished_at = finished_at # Set last, status() reads it to decide done/failed
+            logger.error(f"Job {job.id} ({job.kind}) failed: {error}", extra={"job_id": job.id, "kind": job.kind})
+            if self.on_error is not None:
+                try:
+                    self.on_error(job, error)
+                except Exception as e:
+                    logger.warning(f"Job error hook failed for {job.id}: {e}")
+            return
+        job.result = future.result()
+        job.finished_at = finished_at
+        with self._lock:
+            self._durations.append(finished_at - job.created_at)
+            del self._durations[:-50] # Keep only recent samples
+        if self.on_complete is not None:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                logger.warning(f"Job completion hook failed for {job.id}: {e}")
+
+    def get(self, job_id):
+        """Returns the Job with the given id, or None if unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            outstanding = self._outstanding()
+        return {
+            "executor": self.executor_kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "outstanding": outstanding,
+            "queued": max(0, outstanding - self.max_workers),
+            "superseded": self.superseded,
+        }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def drain(self, timeout, cancel_timeout=5):
+        """
+        Graceful shutdown. New submissions are refused and queued jobs dropped, running jobs get
+        up to timeout seconds to finish. Jobs still running after that are cancelled (which kills
+        their potrace/vtracer process, the job removes its own temp files) and get another
+        cancel_timeout seconds to stop before the pool is torn down.
+        Returns:
+            list: Jobs that did not stop in time, their temp files may be left behind.
+        """
+        with self._lock:
+            self._closed = True
+            outstanding = [job for job in self._jobs.values() if not job.future.done()]
+        running = [job for job in outstanding if not job.future.cancel()]
+        if running:
+            logger.info(f"Waiting up to {timeout}s for {len(running)} running jobs to finish.")
+            wait_for_futures([job.future for job in running], timeout=timeout)
+        cancelled = [job for job in running if not job.future.done()]
+        for job in cancelled:
+            logger.warning(f"Job {job.id} ({job.kind}) did not finish before shutdown, cancelling.",
+                           extra={"job_id": job.id, "kind": job.kind})
+            job.cancel()
+        if cancelled:
+            wait_for_futures([job.future for job in cancelled], timeout=cancel_timeout)
+        unfinished = [job for job in cancelled if not job.future.done()]
+        if unfinished and self.executor_kind == 'process' and self._executor is not None:
+            # A job stuck in in-process tracing cannot be interrupted; ProcessPoolExecutor has no
+            # public way to stop busy workers (before Python 3.14), so terminate them directly
+            for process in list((getattr(self._executor, '_processes', None) or {}).values()):
+                process.terminate()
+        self.shutdown(wait=not unfinished)
+        return unfinished
@@ -0,0 +1,217 @@
+import numpy as np
+from PIL import Image
+
+MATTING_ENGINES = ('closed_form', 'guided')
+MODEL_RESOLUTION = 320 # u2net predicts at 320x320, one mask pixel covers this fraction of the long edge
+MIN_RADIUS = 2 # Smallest guided filter window radius (pixels)
+EPSILON = 1e-4 # Guided filter regularization: higher values smooth more, lower values follow the image edges
+SUBSAMPLE = 4 # The color model and the guided filter are computed at 1/SUBSAMPLE of the resolution
+SAMPLE_REACH = 2 # Known colors are searched this many band widths around the uncertain band
+COLOR_CONTRAST = 0.01 # Squared fg/bg color distance (0..3) at which the color estimate gets half the weight
+
+
+def _erode(binary, size, border_value):
+    """
+    Binary erosion with a size x size square, like scipy.ndimage.binary_erosion(binary,
+    np.ones((size, size)), border_value=border_value) as rembg uses it for its trimap.
+    """
+    if size <= 1:
+        return binary
+    height, width = binary.shape
+    padded = np.full((height + size - 1, width + size - 1), bool(border_value))
+    before = size // 2 # scipy centers even structures one pixel after the middle
+    padded[before:before + height, before:before + width] = binary
+    eroded = binary.copy()
+    for dy in range(size):
+        for dx in range(size):
+            eroded &= padded[dy:dy + height, dx:dx + width]
+    return eroded
+
+
+def _box_mean(values, radius):
+    """
+    Mean over the (2 * radius + 1)^2 window around every pixel, clipped at the borders
+    (the mean is then taken over the pixels inside). Two cumulative sums, independent of radius.
+    Args:
+        values (np.ndarray): float32 array of shape (H, W) or (H, W, C).
+    """
+    result = values
+    for axis in (0, 1):
+        length = result.shape[axis]
+        summed = np.cumsum(result, axis=axis, dtype=np.float64) # float64 only while summing
+        upper = np.minimum(np.arange(length) + radius, length - 1)
+        lower = np.arange(length) - radius - 1
+        window = np.take(summed, upper, axis=axis)
+        window[(slice(None),) * axis + (lower >= 0,)] -= np.take(summed, lower[lower >= 0], axis=axis)
+        counts = (upper - np.maximum(lower, -1)).astype(np.float64)
+        counts = counts.reshape((-1,) + (1,) * (result.ndim - axis - 1))
+        result = (window / counts).astype(np.float32)
+    return result
+
+
+def _band_width(unknown):
+    """Rough width of the uncertain band in pixels: its area divided by its length (half its outline)."""
+    area = np.count_nonzero(unknown)
+    outline = np.count_nonzero(unknown[1:] != unknown[:-1]) + np.count_nonzero(unknown[:, 1:] != unknown[:, :-1])
+    return max(1, int(np.ceil(2 * area / max(1, outline))))
+
+
+def _downsample(values, size):
+    """Area-averaged float32 copy of a 2D array (or each channel of a 3D one) at size (width, height)."""
+    if values.ndim == 3:
+        return np.dstack([_downsample(values[..., c], size) for c in range(values.shape[2])])
+    return np.asarray(Image.fromarray(values.astype(np.float32), 'F').resize(size, Image.BOX))
+
+
+def _upsample(values, size, rows, columns):
+    """Bilinear float32 upscale of a 2D or 3D array to size (width, height), evaluated only at (rows, columns)."""
+    if values.ndim == 3:
+        return np.stack([_upsample(values[..., c], size, rows, columns) for c in range(values.shape[2])], axis=-1)
+    return np.asarray(Image.fromarray(values, 'F').resize(size, Image.BILINEAR))[rows, columns]
+
+
+def _nearest_known_colors(guide, known, band):
+    """
+    Mean color of the closest known pixels around every band pixel: the window starts at one
+    pixel and doubles, every pixel keeps the mean of the smallest window that contains known
+    pixels. Nearby samples matter on gradients, where distant ones have a different color.
+    Args:
+        guide (np.ndarray): float32 (H, W, 3) colors.
+        known (np.ndarray): float32 (H, W) share of each pixel that is known (0..1).
+        band (np.ndarray): bool (H, W), the pixels that need a color.
+    Returns:
+        tuple: (float32 (H, W, 3) mean colors, bool (H, W) where one was found).
+    """
+    height, width = known.shape
+    mean = np.zeros(guide.shape, dtype=np.float32)
+    found = np.zeros(known.shape, dtype=bool)
+    weighted = guide * known[..., None]
+    radius = 1
+    while True:
+        weight = _box_mean(known, radius)
+        new = (weight > 1e-4) & ~found # Smaller values are rounding residue of the cumulative sums
+        if new.any():
+            mean[new] = _box_mean(weighted, radius)[new] / weight[new][:, None]
+            found |= new
+        if found[band].all() or radius >= max(height, width):
+            return mean, found
+        radius *= 2
+
+
+def _guided_coefficients(guide, source, radius, epsilon):
+    """
+    Color guided filter (He et al.): the coefficients of the linear model source ~ a * guide + b,
+    fitted in every window and averaged over the windows that cover a pixel. The filtered output
+    is (a * guide).sum(axis=2) + b, so edges of the guide colors carry over into the result.
+    Args:
+        guide (np.ndarray): float32 (H, W, 3) image in 0..1.
+        source (np.ndarray): float32 (H, W) values to filter (the coarse alpha).
+        radius (int): Window radius in pixels.
+        epsilon (float): Regularization, keeps the fit flat in windows without color contrast.
+    Returns:
+        tuple: (a as float32 (H, W, 3), b as float32 (H, W)).
+    """
+    mean_guide = _box_mean(guide, radius)
+    mean_source = _box_mean(source, radius)
+    covariance = _box_mean(guide * source[..., None], radius) - mean_guide * mean_source[..., None]
+    # Upper triangle of the per-pixel 3x3 color covariance, regularized on the diagonal
+    var = {}
+    for i, j in ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)):
+        var[i, j] = _box_mean(guide[..., i] * guide[..., j], radius) - mean_guide[..., i] * mean_guide[..., j]
+        if i == j:
+            var[i, j] += epsilon
+    # Inverse of the symmetric matrix through its cofactors, elementwise for all pixels at once
+    c00 = var[1, 1] * var[2, 2] - var[1, 2] * var[1, 2]
+    c01 = var[0, 2] * var[1, 2] - var[0, 1] * var[2, 2]
+    c02 = var[0, 1] * var[1, 2] - var[0, 2] * var[1, 1]
+    c11 = var[0, 0] * var[2, 2] - var[0, 2] * var[0, 2]
+    c12 = var[0, 1] * var[0, 2] - var[0, 0] * var[1, 2]
+    c22 = var[0, 0] * var[1, 1] - var[0, 1] * var[0, 1]
+    determinant = var[0, 0] * c00 + var[0, 1] * c01 + var[0, 2] * c02
+    cov_r, cov_g, cov_b = covariance[..., 0], covariance[..., 1], covariance[..., 2]
+    a = np.stack([
+        c00 * cov_r + c01 * cov_g + c02 * cov_b,
+        c01 * cov_r + c11 * cov_g + c12 * cov_b,
+        c02 * cov_r + c12 * cov_g + c22 * cov_b,
+    ], axis=-1) / determinant[..., None]
+    b = mean_source - (a * mean_guide).sum(axis=2)
+    return _box_mean(a, radius), _box_mean(b, radius)
+
+
+def refine_alpha(image, mask, foreground_threshold, background_threshold, erode_size):
+    """
+    Fast replacement for rembg's closed-form alpha matting.
+
+    Builds the same trimap as rembg (mask above foreground_threshold is foreground, below
+    background_threshold background, both eroded by erode_size) and only computes alpha for
+    the uncertain band between them:
+    1. Every band pixel is projected onto the line between the mean foreground and the mean
+       background color around it; where the two are too similar, the model's mask is kept.
+    2. The estimate is smoothed with a guided filter, so it follows the color edges of the image.
+    Both steps work on a copy downscaled by SUBSAMPLE (fast guided filter), only the final
+    per-pixel evaluation runs at full resolution, and only for band pixels. Known pixels get
+    alpha 0 or 255.
+    Args:
+        image (PIL.Image.Image): The image the mask was predicted for.
+        mask (PIL.Image.Image): The model's soft segmentation mask, same size as image.
+        foreground_threshold (int): Mask values above this are certain foreground (0-255).
+        background_threshold (int): Mask values below this are certain background (0-255).
+        erode_size (int): Erosion of the certain regions, widens the uncertain band.
+    Returns:
+        PIL.Image.Image: The alpha channel ('L').
+    """
+    mask_array = np.asarray(mask.convert('L') if mask.mode != 'L' else mask)
+    foreground = _erode(mask_array > foreground_threshold, erode_size, 0)
+    background = _erode(mask_array < background_threshold, erode_size, 1)
+    alpha = np.where(foreground, 255, np.where(background, 0, mask_array)).astype(np.uint8)
+    unknown = ~(foreground | background)
+    rows, columns = np.nonzero(unknown.any(axis=1))[0], np.nonzero(unknown.any(axis=0))[0]
+    if not len(rows):
+        return Image.fromarray(alpha, 'L')
+
+    # Guided filter window: about one pixel of the model's mask
+    radius = max(MIN_RADIUS, round(max(image.size) / MODEL_RESOLUTION))
+    band_width = _band_width(unknown)
+    reach = 2 * radius + SAMPLE_REACH * band_width # Known colors are gathered from around the band
+    top, bottom = max(0, rows[0] - reach), min(alpha.shape[0], rows[-1] + reach + 1)
+    left, right = max(0, columns[0] - reach), min(alpha.shape[1], columns[-1] + reach + 1)
+    size = (right - left, bottom - top)
+    scale = max(1, min(SUBSAMPLE, radius))
+    small_size = (max(1, size[0] // scale), max(1, size[1] // scale))
+
+    rgb = image.convert('RGB') if image.mode != 'RGB' else image
+    crop = rgb.crop((left, top, right, bottom))
+    guide = np.asarray(crop.resize(small_size, Image.BOX), dtype=np.float32) / 255
+    coarse = _downsample(alpha[top:bottom, left:right], small_size) / 255
+    # Fraction of each downscaled pixel that is known foreground/background
+    small_foreground = _downsample(foreground[top:bottom, left:right], small_size)
+    small_background = _downsample(background[top:bottom, left:right], small_size)
+    small_band = _downsample(unknown[top:bottom, left:right], small_size) > 0
+    foreground_mean, foreground_found = _nearest_known_colors(guide, small_foreground, small_band)
+    background_mean, background_found = _nearest_known_colors(guide, small_background, small_band)
+    found = foreground_found & background_found
+    difference = foreground_mean - background_mean
+    contrast = (difference * difference).sum(axis=2)
+    projected = np.clip(((guide - background_mean) * difference).sum(axis=2) / np.maximum(contrast, 1e-6), 0, 1)
+    # Confidence of the projection: near 1 for distinct colors, 0 for similar ones or a missing side
+    confidence = found * contrast / (contrast + COLOR_CONTRAST)
+    estimate = confidence * projected + (1 - confidence) * coarse
+    a, b = _guided_coefficients(guide, estimate.astype(np.float32), max(1, radius // scale), EPSILON)
+
+    band_rows, band_columns = np.nonzero(unknown[top:bottom, left:right])
+    band_colors = np.asarray(crop, dtype=np.float32)[band_rows, band_columns] / 255
+    refined = (_upsample(a, size, band_rows, band_columns) * band_colors).sum(axis=1) + _upsample(b, size, band_rows, band_columns)
+    alpha[band_rows + top, band_columns + left] = np.clip(refined * 255 + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(alpha, 'L')
+
+
+def guided_cutout(image, mask, foreground_threshold, background_threshold, erode_size):
+    """
+    Cuts out image with refine_alpha(). The colors are kept as they are: unlike rembg's
+    cutout, the foreground color is not re-estimated in the soft edge.
+    Returns:
+        PIL.Image.Image: RGBA cutout.
+    """
+    cutout = image.convert('RGBA')
+    cutout.putalpha(refine_alpha(image, mask, foreground_threshold, background_threshold, erode_size))
+    return cutout
@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Tracing large images takes minutes, so the buckets reach further than the client's defaults
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    'vectorizer_stage_seconds', 'Time spent per pipeline stage.',
+    ['stage', 'mode', 'remove_bg'], buckets=STAGE_BUCKETS)
+JOBS = Counter('vectorizer_jobs', 'Finished vectorization jobs.', ['kind', 'status'])
+TOOL_FAILURES = Counter('vectorizer_tool_failures', 'potrace/vtracer runs that failed or were missing.', ['tool'])
+REMBG_FALLBACKS = Counter('vectorizer_rembg_fallbacks', 'Jobs that continued without background removal because rembg failed.')
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of the pipeline stages of one job.
+    Runs inside the job worker; the durations travel back with the job result and are
+    observed in the web process, where /metrics is served. Also notes events of the job
+    that change its output, e.g. 'tracer_fallback' when bindings failed and the CLI traced.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.notes = set()
+
+    def note(self, event):
+        self.notes.add(event)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def observe_stages(stages, mode, remove_bg):
+    """Records the stage durations of a job in the latency histograms."""
+    remove_bg = 'true' if remove_bg else 'false'
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.labels(stage, mode, remove_bg).observe(seconds)
+
+
+class StatsCollector:
+    """
+    Exposes counters the caches, job queue and janitor already keep, read at scrape time
+    instead of being mirrored into separate metric objects.
+    """
+
+    def __init__(self, caches, job_queue, janitor):
+        """
+        Args:
+            caches (dict): Name -> object with stats() returning hits/misses/evictions.
+            job_queue (JobQueue): Source of the queue depth gauges.
+            janitor (Janitor): Source of the storage metrics.
+        """
+        self.caches = caches
+        self.job_queue = job_queue
+        self.janitor = janitor
+
+    def collect(self):
+        lookups = CounterMetricFamily('vectorizer_cache_lookups', 'Cache lookups by cache and result.', labels=['cache', 'result'])
+        evictions = CounterMetricFamily('vectorizer_cache_evictions', 'Cache entries evicted.', labels=['cache'])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            lookups.add_metric([name, 'hit'], stats["hits"])
+            lookups.add_metric([name, 'miss'], stats["misses"])
+            evictions.add_metric([name], stats["evictions"])
+        yield lookups
+        yield evictions
+
+        jobs = self.job_queue.stats()
+        yield GaugeMetricFamily('vectorizer_jobs_outstanding', 'Jobs queued or running.', value=jobs["outstanding"])
+        yield GaugeMetricFamily('vectorizer_jobs_queued', 'Jobs waiting for a free worker.', value=jobs["queued"])
+        yield GaugeMetricFamily('vectorizer_job_workers', 'Size of the job worker pool.', value=jobs["max_workers"])
+        yield CounterMetricFamily('vectorizer_jobs_superseded', 'Jobs cancelled by a newer request for the same input.', value=jobs["superseded"])
+
+        storage = self.janitor.stats()
+        yield GaugeMetricFamily('vectorizer_storage_bytes', 'Bytes used by SVGs and temp files (uploads are in the upload store, see /cache/stats).', value=storage["tracked_bytes"])
+        yield GaugeMetricFamily('vectorizer_storage_files', 'Files in the output and temp folders.', value=storage["tracked_files"])
+        yield CounterMetricFamily('vectorizer_storage_removed_files', 'Files removed by the janitor.', value=storage["files_removed"])
+        yield CounterMetricFamily('vectorizer_janitor_sweeps', 'Full directory sweeps of the janitor.', value=storage["sweeps"])
@@ -0,0 +1,250 @@
+import numpy as np
+
+THRESHOLD_METHODS = ('fixed', 'otsu', 'adaptive')
+ROWS_PER_BAND = 16 # Rows processed per step; small bands keep the scratch buffers in CPU cache
+ADAPTIVE_BLOCK_SIZE = 31 # Neighbourhood (pixels) for the local mean of adaptive thresholding
+ADAPTIVE_OFFSET = 10 # A pixel is foreground if it is this much darker than its local mean
+LUMA_WEIGHTS = (19595, 38470, 7471) # ITU-R 601-2 luma in Pillow's 16-bit fixed point
+QUANTIZE_SAMPLE_PIXELS = 65536 # Pixels the palette is fitted on, every pixel is then assigned to it
+QUANTIZE_ITERATIONS = 8 # k-means refinement steps after the median cut
+OPAQUE_ALPHA = 128 # Pixels with less alpha are transparent and belong to no color layer
+
+
+def _luma_bands(image):
+    """
+    Composites the image over white and computes its luma, one band of rows at a time.
+
+    Uses the same integer arithmetic as Pillow (paste with alpha mask, then convert('L')),
+    so thresholds produce exactly the bitmaps the previous PIL-based pipeline produced.
+    Pillow offers no zero-copy NumPy view, so only one band is copied out of the image at
+    a time and all arithmetic runs in place on preallocated scratch buffers.
+
+    Yields:
+        tuple: (first row, row count, uint32 array of 65536 * luma without rounding).
+            The array is a scratch buffer that is overwritten by the next band.
+    """
+    if image.mode not in ('RGBA', 'RGB', 'L'):
+        image = image.convert('RGBA')
+    width, height = image.size
+    size = ROWS_PER_BAND * width
+    luma_sum = np.empty(size, dtype=np.uint32)
+    channel = np.empty(size, dtype=np.uint32)
+    if image.mode == 'RGBA':
+        white = np.empty(size, dtype=np.uint16)
+        blended = np.empty(size, dtype=np.uint16)
+
+    for y in range(0, height, ROWS_PER_BAND):
+        band = np.asarray(image.crop((0, y, width, min(height, y + ROWS_PER_BAND))))
+        rows = band.shape[0]
+        n = rows * width
+        acc = luma_sum[:n]
+        if image.mode == 'L':
+            np.left_shift(band.reshape(n), 16, out=acc, dtype=np.uint32)
+            yield y, rows, acc
+            continue
+
+        pixels = band.reshape(n, band.shape[2])
+        ch = channel[:n]
+        acc.fill(0)
+        if image.mode == 'RGBA':
+            alpha = pixels[:, 3]
+            inv = white[:n]
+            bl = blended[:n]
+            # White contribution 255 * (255 - a) plus the +128 rounding term of Pillow's DIV255
+            np.subtract(255, alpha, out=inv, dtype=np.uint16)
+            np.multiply(inv, 255, out=inv)
+            np.add(inv, 128, out=inv)
+        for c, weight in enumerate(LUMA_WEIGHTS):
+            if image.mode == 'RGBA':
+                # DIV255(c * a + 255 * (255 - a)), max 65153 so uint16 holds it
+                np.multiply(pixels[:, c], alpha, out=bl, dtype=np.uint16)
+                np.add(bl, inv, out=bl)
+                np.right_shift(bl, 8, out=ch, dtype=np.uint32)
+                np.add(ch, bl, out=ch)
+                np.right_shift(ch, 8, out=ch)
+            else:
+                np.copyto(ch, pixels[:, c])
+            np.multiply(ch, weight, out=ch)
+            np.add(acc, ch, out=acc)
+        yield y, rows, acc
+
+
+def gray_on_white(image):
+    """
+    Args:
+        image (PIL.Image.Image): RGBA, RGB or L image.
+    Returns:
+        numpy.ndarray: (H, W) uint8 grayscale of the image composited over white.
+    """
+    width, height = image.size
+    gray = np.empty((height, width), dtype=np.uint8)
+    for y, rows, acc in _luma_bands(image):
+        np.right_shift(acc + 0x8000, 16, out=gray[y:y + rows].reshape(-1), casting='unsafe')
+    return gray
+
+
+def otsu_threshold(gray):
+    """Returns the Otsu threshold (0-255) maximizing the between-class variance of gray."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_bg = np.cumsum(histogram)
+    weight_fg = weight_bg[-1] - weight_bg
+    cumulative_mean = np.cumsum(histogram * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = cumulative_mean / weight_bg
+        mean_fg = (cumulative_mean[-1] - cumulative_mean) / weight_fg
+        between_variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(np.nan_to_num(between_variance)))
+
+
+def adaptive_foreground(gray, block_size=ADAPTIVE_BLOCK_SIZE, offset=ADAPTIVE_OFFSET):
+    """
+    Local-mean thresholding, for unevenly lit scans and photos.
+    Returns:
+        numpy.ndarray: (H, W) bool, True where the pixel is darker than its neighbourhood mean minus offset.
+    """
+    height, width = gray.shape
+    radius = block_size // 2
+    # Integral image with a zero row/column in front, so box sums are four lookups.
+    # uint32 may wrap on huge images, but box sums are small and wrap-around cancels out.
+    integral = np.zeros((height + 1, width + 1), dtype=np.uint32)
+    np.cumsum(gray, axis=0, dtype=np.uint32, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, dtype=np.uint32, out=integral[1:, 1:])
+    x0 = np.clip(np.arange(width) - radius, 0, width)
+    x1 = np.clip(np.arange(width) + radius + 1, 0, width)
+    foreground = np.empty((height, width), dtype=bool)
+    for y in range(0, height, ROWS_PER_BAND):
+        rows = np.arange(y, min(y + ROWS_PER_BAND, height))
+        y0 = np.clip(rows - radius, 0, height)[:, None]
+        y1 = np.clip(rows + radius + 1, 0, height)[:, None]
+        box_sum = (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]).astype(np.int64)
+        box_area = (y1 - y0) * (x1 - x0)
+        foreground[y:y + len(rows)] = gray[y:y + len(rows)] * box_area < box_sum - offset * box_area
+    return foreground
+
+
+def bw_bitmap(image, threshold_value, method='fixed'):
+    """
+    Builds the potrace input for black & white mode: alpha-over-white composite,
+    grayscale conversion and thresholding in a single pass over the pixels.
+    Args:
+        image (PIL.Image.Image): RGBA, RGB or L image.
+        threshold_value (int): 0-255, pixels above it become white ('fixed' method only).
+        method (str): 'fixed', 'otsu' or 'adaptive'.
+    Returns:
+        tuple: (numpy.ndarray (H, W) bool foreground mask (True = black), threshold used or None for 'adaptive')
+    """
+    if method == 'otsu':
+        gray = gray_on_white(image)
+        threshold_value = otsu_threshold(gray)
+        return gray <= threshold_value, threshold_value
+    if method == 'adaptive':
+        return adaptive_foreground(gray_on_white(image)), None
+
+    width, height = image.size
+    foreground = np.empty((height, width), dtype=bool)
+    # luma <= threshold  <=>  luma_sum + 0x8000 < (threshold + 1) << 16, no rounding pass needed
+    limit = ((threshold_value + 1) << 16) - 0x8000
+    for y, rows, acc in _luma_bands(image):
+        # Pixels > threshold_value become white, others black (potrace's foreground)
+        np.less(acc, limit, out=foreground[y:y + rows].reshape(-1))
+    return foreground, threshold_value
+
+
+def to_pbm(foreground):
+    """Encodes a bool foreground mask as raw PBM (P4) bytes, potrace's native input format."""
+    height, width = foreground.shape
+    return f"P4\n{width} {height}\n".encode() + np.packbits(foreground, axis=1).tobytes()
+
+
+def _median_cut(pixels, colors):
+    """Initial palette: repeatedly splits the box with the largest (channel range * pixel count) at its median."""
+    boxes = [pixels]
+    while len(boxes) < colors:
+        scores = [np.ptp(box, axis=0).max() * len(box) if len(box) > 1 else 0 for box in boxes]
+        index = int(np.argmax(scores))
+        if scores[index] == 0:
+            break # Fewer distinct colors than requested
+        box = boxes[index]
+        values = box[:, int(np.argmax(np.ptp(box, axis=0)))]
+        # Split on the median value, not the median position, so one color never ends up in both halves
+        median = np.median(values)
+        lower = values < median if (values < median).any() else values <= median
+        boxes[index:index + 1] = [box[lower], box[~lower]]
+    return np.array([box.mean(axis=0) for box in boxes], dtype=np.float32)
+
+
+def _nearest(pixels, palette):
+    # argmin of |p - c|^2 = |p|^2 - 2 p.c + |c|^2, where |p|^2 is the same for every center
+    scores = pixels @ (-2.0 * palette.T)
+    scores += (palette * palette).sum(axis=1)
+    return np.argmin(scores, axis=1)
+
+
+def _rgba_bands(image):
+    """Yields (first row, (rows * width, 4) uint8 RGBA pixels) one band of rows at a time."""
+    width, height = image.size
+    for y in range(0, height, ROWS_PER_BAND):
+        band = np.asarray(image.crop((0, y, width, min(height, y + ROWS_PER_BAND))))
+        yield y, band.reshape(-1, 4)
+
+
+def color_layers(image, colors, seed=0):
+    """
+    Quantizes an image for stacked per-color tracing: median cut on a sample of the opaque
+    pixels, refined with a few k-means steps, then every pixel is assigned its nearest color.
+    Args:
+        image (PIL.Image.Image): Image to quantize, converted to RGBA if needed.
+        colors (int): Maximum palette size (at most 127).
+        seed (int): Seed for the pixel sample, so the same image always gets the same palette.
+    Returns:
+        tuple: (palette, ranks). palette is a (k, 3) uint8 array ordered by pixel count, most
+            frequent color first. ranks is an (H, W) int8 array with the palette index of each
+            pixel, -1 for transparent pixels. Layer i of the stack is ranks >= i: painted in
+            order, each layer covers the colors after it, so there are no gaps between regions.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    width, height = image.size
+    rgba = np.asarray(image).reshape(-1, 4)
+    opaque = rgba[rgba[:, 3] >= OPAQUE_ALPHA, :3]
+    ranks = np.full((height, width), -1, dtype=np.int8)
+    if len(opaque) == 0:
+        return np.zeros((0, 3), dtype=np.uint8), ranks
+    if len(opaque) > QUANTIZE_SAMPLE_PIXELS:
+        opaque = opaque[np.random.default_rng(seed).choice(len(opaque), QUANTIZE_SAMPLE_PIXELS, replace=False)]
+    sample = opaque.astype(np.float32)
+    del rgba, opaque
+
+    palette = _median_cut(sample, max(1, min(127, colors)))
+    for _ in range(QUANTIZE_ITERATIONS):
+        labels = _nearest(sample, palette)
+        counts = np.bincount(labels, minlength=len(palette))
+        used = counts > 0
+        if not used.all():
+            # Move empty clusters onto the pixels worst represented by their center
+            errors = ((sample - palette[labels]) ** 2).sum(axis=1)
+            worst = np.argsort(-errors)[:np.count_nonzero(~used)]
+            palette[~used] = sample[worst]
+            labels = _nearest(sample, palette)
+            counts = np.bincount(labels, minlength=len(palette))
+            used = counts > 0
+        for channel in range(3):
+            sums = np.bincount(labels, weights=sample[:, channel], minlength=len(palette))
+            palette[used, channel] = sums[used] / counts[used]
+    palette = np.clip(np.rint(palette), 0, 255)
+
+    # Assign every opaque pixel, one band of rows at a time to bound the distance matrix
+    labels = ranks.reshape(-1)
+    for y, pixels in _rgba_bands(image):
+        band = labels[y * width:y * width + len(pixels)]
+        visible = pixels[:, 3] >= OPAQUE_ALPHA
+        band[visible] = _nearest(pixels[visible, :3].astype(np.float32), palette)
+
+    # Reorder by pixel count and drop colors no pixel ended up with
+    counts = np.bincount(labels[labels >= 0], minlength=len(palette))
+    order = [index for index in np.argsort(-counts, kind='stable') if counts[index] > 0]
+    remap = np.full(len(palette) + 1, -1, dtype=np.int8) # Last entry maps -1 (transparent) to itself
+    remap[order] = np.arange(len(order))
+    np.copyto(labels, remap[labels])
+    return palette[order].astype(np.uint8), ranks
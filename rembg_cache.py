@@ -0,0 +1,173 @@
+import logging
+import os
+import json
+import time
+import hashlib
+import threading
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class RembgCache:
+    """
+    Content-addressed on-disk cache for rembg background-removal results.
+
+    Entries are keyed on the SHA-256 of the original upload plus the rembg parameters,
+    so a reprocess that only changes vectorizer settings (colors, detail, BW threshold)
+    can reuse the RGBA matte instead of running the neural net again.
+
+    Entries are written by the job workers, expiry and size eviction run in the web process
+    (evict() as a janitor collector), so the eviction counters end up in /cache/stats. The web
+    process learns the size of new entries from the job results (record_put()) and asks the
+    janitor for an early eviction once they push the cache over its limit.
+    """
+
+    def __init__(self, cache_dir, max_age_seconds, max_bytes):
+        """
+        Args:
+            cache_dir (str): Directory in which the cached RGBA PNGs are stored.
+            max_age_seconds (int): Entries older than this are evicted (tied to CLEANUP_AGE_SECONDS).
+            max_bytes (int): Upper bound for the total size of all cached entries.
+        """
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None # Measured by evict(), then advanced by record_put() until the next scan
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, file_hash, rembg_params):
+        """
+        Builds the cache key for an input file and a set of rembg parameters.
+        Args:
+            file_hash (str): SHA-256 hex digest of the original upload (the prefix of its name).
+            rembg_params (dict): Keyword arguments passed to rembg.remove().
+        Returns:
+            str: Hex digest identifying the (content, parameters) pair.
+        """
+        params_json = json.dumps(rembg_params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{file_hash}:{params_json}".encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key):
+        """Returns the cached RGBA image for key, or None on a miss."""
+        entry_path = self._entry_path(key)
+        try:
+            if (time.time() - os.path.getmtime(entry_path)) > self.max_age_seconds:
+                raise FileNotFoundError(entry_path) # Expired, treat as miss
+            with Image.open(entry_path) as cached:
+                image = cached.convert('RGBA') if cached.mode != 'RGBA' else cached.copy()
+            os.utime(entry_path, None) # Touch so size-based eviction is least-recently-used
+        except (FileNotFoundError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def put(self, key, image):
+        """
+        Stores an RGBA image under key. Eviction is left to the web process (see evict()).
+        Returns:
+            int: Size of the written entry in bytes, 0 if it could not be written.
+        """
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Fast, low compression: the cache lives on local disk and is read back often
+            image.save(tmp_path, 'PNG', compress_level=1)
+            os.replace(tmp_path, entry_path) # Atomic, concurrent writers of the same key are harmless
+        except OSError as e:
+            logger.warning(f"Could not write rembg cache entry {entry_path}: {e}")
+            if os.path.exists(tmp_path):
+                try: os.remove(tmp_path)
+                except OSError: pass
+            return 0
+        try:
+            return os.path.getsize(entry_path)
+        except OSError:
+            return 0 # Evicted in the meantime
+
+    def record_put(self, size):
+        """
+        Adds the size of an entry written by a job (in any process) to the tracked total.
+        Returns:
+            bool: True if the cache is now over max_bytes and evict() should run.
+        """
+        with self._lock:
+            if self._total_bytes is None:
+                return False # Not measured yet, the janitor's first sweep does that
+            self._total_bytes += size
+            return self._total_bytes > self.max_bytes
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the size limit holds.
+        Scans the whole cache directory, run by the janitor in the web process, not per request.
+        """
+        now = time.time()
+        entries = []
+        total_bytes = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith('.png'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if (now - stat.st_mtime) > self.max_age_seconds:
+                        self._remove(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_bytes += stat.st_size
+        except OSError as e:
+            logger.warning(f"Could not scan rembg cache {self.cache_dir}: {e}")
+            return
+
+        if total_bytes > self.max_bytes:
+            entries.sort() # Oldest access first
+            for _, size, path in entries:
+                if total_bytes <= self.max_bytes:
+                    break
+                self._remove(path)
+                total_bytes -= size
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            with self._lock:
+                self.evictions += 1
+        except FileNotFoundError:
+            pass # Evicted concurrently by another worker
+        except OSError as e:
+            logger.warning(f"Could not evict rembg cache entry {path}: {e}")
+
+    def record_lookup(self, hit):
+        """Counts a lookup that happened in another process (e.g. a job pool worker)."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,106 @@
+import logging
+import time
+import threading
+import onnxruntime as ort
+from PIL import Image
+from rembg import new_session
+
+logger = logging.getLogger(__name__)
+
+
+class RembgSessionManager:
+    """
+    Owns the single rembg/onnxruntime session shared by all requests.
+
+    The ONNX model is loaded once (at startup) instead of lazily inside the first
+    rembg.remove() call, optionally followed by a warm-up inference so the first real
+    request does not pay for onnxruntime's graph optimization and memory arena setup.
+    """
+
+    def __init__(self, model_name="u2net", intra_op_threads=0, inter_op_threads=0, providers=None, warmup=True):
+        """
+        Args:
+            model_name (str): rembg model to load (e.g. 'u2net').
+            intra_op_threads (int): onnxruntime intra-op thread count, 0 lets onnxruntime decide.
+            inter_op_threads (int): onnxruntime inter-op thread count, 0 lets onnxruntime decide.
+            providers (list): onnxruntime execution providers in priority order, None for rembg's default.
+            warmup (bool): Run one inference on a blank image right after loading.
+        """
+        self.model_name = model_name
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.providers = providers
+        self.warmup = warmup
+        self.session = None
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+
+    def _session_options(self):
+        sess_opts = ort.SessionOptions()
+        if self.intra_op_threads:
+            sess_opts.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            sess_opts.inter_op_num_threads = self.inter_op_threads
+        return sess_opts
+
+    def load(self):
+        """Loads (and optionally warms up) the model. Safe to call more than once."""
+        with self._lock:
+            if self.session is not None:
+                return self.session
+            start = time.time()
+            logger.info(f"Loading rembg model '{self.model_name}' (providers={self.providers or 'default'}, intra_op={self.intra_op_threads}, inter_op={self.inter_op_threads})...")
+            try:
+                kwargs = {"sess_opts": self._session_options()}
+                if self.providers:
+                    kwargs["providers"] = list(self.providers)
+                session = new_session(self.model_name, **kwargs)
+                if self.warmup:
+                    logger.info("Running rembg warm-up inference...")
+                    session.predict(Image.new("RGB", (320, 320), "WHITE"))
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Error loading rembg model '{self.model_name}': {e}")
+                raise
+            self.session = session
+            self.error = None
+            self.load_seconds = time.time() - start
+            self._loaded.set()
+            logger.info(f"rembg model '{self.model_name}' ready after {self.load_seconds:.2f}s.")
+            return session
+
+    def load_in_background(self):
+        """Starts load() in a daemon thread and returns the thread."""
+        def _load():
+            try:
+                self.load()
+            except Exception:
+                pass # Error is kept in self.error and reported by status()
+        thread = threading.Thread(target=_load, name="rembg-session-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def get(self):
+        """Returns the loaded session, loading it first if necessary."""
+        if self.session is not None:
+            return self.session
+        return self.load()
+
+    @property
+    def ready(self):
+        return self._loaded.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        return self._loaded.wait(timeout)
+
+    def status(self):
+        """Returns a dict describing the session state for the readiness endpoint."""
+        return {
+            "model": self.model_name,
+            "ready": self.ready,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "providers": self.session.inner_session.get_providers() if self.session is not None else self.providers,
+        }
@@ -0,0 +1,163 @@
+import re
+from PIL import Image
+
+SVG_TAG_RE = re.compile(r'<svg\b[^>]*>', re.S)
+SVG_LENGTH_RE = re.compile(r'(?<![\w-])(width|height)="([0-9.]+)([a-z%]*)"')
+
+
+def fit_pixels(size, max_pixels):
+    """
+    Args:
+        size (tuple): (width, height) of the image.
+        max_pixels (int): Pixel budget, 0 or None for no limit.
+    Returns:
+        tuple: (width, height) scaled down uniformly so that width * height <= max_pixels,
+            or size itself if it already fits.
+    """
+    width, height = size
+    if not max_pixels or width * height <= max_pixels:
+        return size
+    scale = (max_pixels / float(width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def downscale(image, max_pixels):
+    """
+    Downscales an image to at most max_pixels, keeping the aspect ratio.
+    Args:
+        image (PIL.Image.Image): Decoded image.
+        max_pixels (int): Pixel budget, 0 or None for no limit.
+    Returns:
+        PIL.Image.Image: The resized image, or image itself if it already fits.
+    """
+    return resize(image, fit_pixels(image.size, max_pixels))
+
+
+def resize(image, target_size):
+    """
+    Resizes an image to exactly target_size with a high-quality filter.
+    Args:
+        image (PIL.Image.Image): Decoded image.
+        target_size (tuple): (width, height) to resize to.
+    Returns:
+        PIL.Image.Image: The resized image, or image itself if it already has that size.
+    """
+    if target_size == image.size:
+        return image
+    if image.mode not in ('RGBA', 'RGB', 'LA', 'L'):
+        image = image.convert('RGBA') # Palette/bilevel images would otherwise be resized with NEAREST
+    # reducing_gap first shrinks by an integer factor with a box filter, then finishes with Lanczos
+    return image.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def apply_scaled_alpha(image, matte):
+    """
+    Transfers the alpha channel of a (smaller) matte onto image.
+    Args:
+        image (PIL.Image.Image): Full-size image.
+        matte (PIL.Image.Image): RGBA result of background removal on a downscaled copy of image.
+    Returns:
+        PIL.Image.Image: RGBA copy of image with the matte's alpha upscaled to its size.
+    """
+    alpha = matte.getchannel('A')
+    if alpha.size != image.size:
+        alpha = alpha.resize(image.size, Image.BICUBIC)
+    result = image.convert('RGBA') if image.mode != 'RGBA' else image.copy()
+    result.putalpha(alpha)
+    return result
+
+
+def tile_boxes(size, tile_size, overlap=0):
+    """
+    Splits an image into a grid of tiles.
+    Args:
+        size (tuple): (width, height) of the image.
+        tile_size (int): Edge length of a tile in pixels.
+        overlap (int): Pixels each tile extends into its right and bottom neighbours, hides seams.
+    Returns:
+        list: (left, top, right, bottom) crop boxes, row by row.
+    """
+    width, height = size
+    boxes = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            boxes.append((left, top, min(width, left + tile_size + overlap), min(height, top + tile_size + overlap)))
+    return boxes
+
+
+def _svg_body(svg_text):
+    """Returns the markup between the opening <svg> tag and </svg>."""
+    match = SVG_TAG_RE.search(svg_text)
+    if match is None:
+        raise ValueError("No <svg> element found in tracer output.")
+    end = svg_text.rfind('</svg>')
+    return svg_text[match.end():end if end != -1 else len(svg_text)]
+
+
+def merge_svg_tiles(tiles, size):
+    """
+    Merges the SVGs of individually traced tiles into one document.
+    Args:
+        tiles (list): (box, svg_text) pairs as produced by tile_boxes() and the tracer.
+        size (tuple): (width, height) of the full image.
+    Returns:
+        str: SVG document with each tile's paths translated to its position.
+    """
+    width, height = size
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n',
+    ]
+    for (left, top, _, _), svg_text in tiles:
+        parts.append(f'<g transform="translate({left},{top})">{_svg_body(svg_text)}</g>\n')
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+
+def merge_svg_layers(layers, size):
+    """
+    Stacks the SVGs of individually traced color layers into one document.
+    Args:
+        layers (list): (fill color, svg_text) pairs, bottom layer first. Each SVG is a potrace
+            trace (black fill) with a viewBox of the full image size.
+        size (tuple): (width, height) of the image.
+    Returns:
+        str: SVG document with each layer's paths filled with its color.
+    """
+    width, height = size
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n',
+    ]
+    for color, svg_text in layers:
+        # potrace fills with black (CLI and tracing.potrace_svg alike), recolor the layer's fill
+        parts.append(_svg_body(svg_text).replace('fill="#000000"', f'fill="{color}"').strip() + '\n')
+    parts.append('</svg>\n')
+    return ''.join(parts)
+
+
+def rescale_svg(svg_path, size):
+    """
+    Sets the display size of an SVG traced at a reduced working resolution back to the original
+    image size. The coordinates are left alone, a viewBox maps them onto the new size.
+    Args:
+        svg_path (str): SVG file, rewritten in place.
+        size (tuple): (width, height) of the original upload.
+    """
+    with open(svg_path, 'r', encoding='utf-8') as f:
+        svg_text = f.read()
+    match = SVG_TAG_RE.search(svg_text)
+    if match is None:
+        return
+    tag = match.group(0)
+    lengths = {name: (value, unit) for name, value, unit in SVG_LENGTH_RE.findall(tag)}
+    if 'width' not in lengths or 'height' not in lengths:
+        return
+    new_tag = tag
+    if 'viewBox' not in tag:
+        # vtracer writes plain pixel sizes without a viewBox, potrace already has one
+        new_tag = new_tag[:-1].rstrip('/') + f' viewBox="0 0 {lengths["width"][0]} {lengths["height"][0]}">'
+    new_size = dict(zip(('width', 'height'), size))
+    new_tag = SVG_LENGTH_RE.sub(lambda m: f'{m.group(1)}="{new_size[m.group(1)]}{m.group(3)}"', new_tag)
+    with open(svg_path, 'w', encoding='utf-8') as f:
+        f.write(svg_text[:match.start()] + new_tag + svg_text[match.end():])
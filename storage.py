@@ -0,0 +1,354 @@
+import errno
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError: # Optional, only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ('local', 's3')
+REFS_PREFIX = 'refs/'
+# <sha256 of the content>-<upload id>.<extension>, the name clients get back for an upload
+UPLOAD_NAME_RE = re.compile(r'^([0-9a-f]{64})-([0-9a-f]{32})\.([a-z0-9]{1,8})$')
+
+
+def shard_path(root, name):
+    """
+    Path of name in a two-level sharded layout below root (ab/cd/abcd...), so no directory
+    grows past 65536 entries per level and listings and cleanup stay fast.
+    """
+    return os.path.join(root, name[:2], name[2:4], name)
+
+
+def walk_files(root):
+    """Yields os.DirEntry objects for all files below root, recursively. Missing directories yield nothing."""
+    try:
+        with os.scandir(root) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+        except FileNotFoundError:
+            continue # Removed while walking
+
+
+def _replace_file(source_path, path):
+    """Moves source_path to path atomically, copying first when they are on different filesystems."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.replace(source_path, path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        os.remove(source_path)
+
+
+class LocalBackend:
+    """Stores objects as files below root; the key ('ab/cd/name') is the relative path."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key):
+        """Path of the object on this machine, the files can be used directly."""
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def put(self, key, source_path):
+        """Moves the file at source_path into the store under key."""
+        _replace_file(source_path, self.local_path(key))
+
+    def create(self, key):
+        """Creates an empty object (a marker) under key, or renews its modification time."""
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab'):
+            pass
+        os.utime(path, None)
+
+    def touch(self, key):
+        os.utime(self.local_path(key), None)
+
+    def delete(self, key):
+        path = self.local_path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        try:
+            os.rmdir(os.path.dirname(path)) # Per-upload reference directories are removed once empty
+        except OSError:
+            pass # Not empty
+
+    def list(self, prefix=''):
+        """Yields (key, mtime, size) for every object whose key starts with prefix."""
+        base = self.local_path(prefix.rstrip('/')) if prefix else self.root
+        for entry in walk_files(base):
+            if entry.name.endswith('.tmp'):
+                continue # Being written
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            key = os.path.relpath(entry.path, self.root).replace(os.sep, '/')
+            yield key, stat.st_mtime, stat.st_size
+
+
+class S3Backend:
+    """
+    Stores objects in an S3 bucket (or an S3-compatible server such as MinIO, via endpoint_url),
+    so several app replicas can share uploads. Only uploads: SVG outputs and the rembg cache stay
+    on each replica's disk, so another replica misses them. Credentials come from the usual AWS
+    environment variables or config files. The job workers need local files, see ContentStore.path().
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package.")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def local_path(self, key):
+        return None # Objects have to be fetched first
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put(self, key, source_path):
+        self.client.upload_file(source_path, self.bucket, self.prefix + key)
+        os.remove(source_path)
+
+    def create(self, key):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=b'')
+
+    def touch(self, key):
+        # Copying an object onto itself with new metadata is S3's way to renew LastModified
+        self.client.copy_object(Bucket=self.bucket, Key=self.prefix + key, MetadataDirective='REPLACE',
+                                CopySource={'Bucket': self.bucket, 'Key': self.prefix + key})
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['LastModified'].timestamp(), item['Size']
+
+    def fetch(self, key, path):
+        """Downloads the object to path (atomically, concurrent fetches of the same object are harmless)."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.client.download_file(self.bucket, self.prefix + key, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def make_backend(name, local_root, s3_bucket=None, s3_prefix='', s3_endpoint_url=None):
+    """Creates the backend selected by STORAGE_BACKEND ('local' or 's3')."""
+    if name == 's3':
+        if not s3_bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires STORAGE_S3_BUCKET.")
+        return S3Backend(s3_bucket, s3_prefix, s3_endpoint_url)
+    return LocalBackend(local_root)
+
+
+class ContentStore:
+    """
+    Content-addressed storage for uploads with reference-counted blobs.
+
+    An upload is stored once per content, as <sha256>.<ext> in a sharded layout. Every upload
+    of it gets its own reference, an empty marker object refs/ab/cd/<sha256>/<upload id>, and
+    its own name <sha256>-<upload id>.<ext>: jobs stay per upload (superseding a reprocess only
+    cancels that user's jobs), while the blob and everything derived from its content (the
+    stored segmentation mask, the rembg and SVG cache entries) are shared by identical uploads.
+    The reference count of a blob is the number of its markers, so replicas sharing a backend
+    never have to update a counter. References expire after max_age_seconds, collect() then
+    removes the blobs nobody references anymore, together with their derived files.
+    """
+
+    def __init__(self, backend, local_dir, max_age_seconds, min_age_seconds=60):
+        """
+        Args:
+            backend (LocalBackend or S3Backend): Where blobs and references live.
+            local_dir (str): Local files of the store: the blobs themselves for the local backend,
+                fetched copies for a remote one, plus derived files next to them.
+            max_age_seconds (int): References older than this expire (tied to CLEANUP_AGE_SECONDS).
+            min_age_seconds (int): Unreferenced blobs younger than this are kept, an upload in
+                progress writes its blob before its reference.
+        """
+        self.backend = backend
+        self.local_dir = local_dir
+        self.max_age_seconds = max_age_seconds
+        self.min_age_seconds = min_age_seconds
+        self._lock = threading.Lock()
+        self.metrics = {
+            "uploads": 0,
+            "deduplicated": 0,
+            "references": None, # Counted by collect()
+            "stored_files": None, # Blobs and their derived files
+            "stored_bytes": None,
+            "expired_references": 0,
+            "removed_blobs": 0,
+        }
+        os.makedirs(local_dir, exist_ok=True)
+
+    @staticmethod
+    def blob_key(digest, extension):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+    @staticmethod
+    def ref_key(digest, upload_id=''):
+        return f"{REFS_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}/{upload_id}"
+
+    @staticmethod
+    def parse(input_filename):
+        """
+        Splits an upload name into (sha256, upload id, extension).
+        Raises:
+            ValueError: If the name was not issued by add() (which also rules out paths).
+        """
+        match = UPLOAD_NAME_RE.match(input_filename or '')
+        if match is None:
+            raise ValueError(f"Invalid upload name: {input_filename!r}")
+        return match.groups()
+
+    def digest(self, input_filename):
+        """SHA-256 hex digest of an upload's content, taken from its name without reading the file."""
+        return self.parse(input_filename)[0]
+
+    def add(self, source_path, digest, extension):
+        """
+        Adds an uploaded file (validated and hashed by the caller) to the store. If the content
+        is stored already, source_path is discarded and the existing blob is used.
+        Args:
+            source_path (str): The upload in a temporary location, moved or removed.
+            digest (str): SHA-256 hex digest of its content.
+            extension (str): File extension (lowercase, without the dot).
+        Returns:
+            str: The upload name, see parse().
+        """
+        upload_id = uuid.uuid4().hex
+        blob_key = self.blob_key(digest, extension)
+        # Reference first: from here on collect() keeps the blob
+        self.backend.create(self.ref_key(digest, upload_id))
+        deduplicated = self.backend.exists(blob_key)
+        if deduplicated:
+            self.backend.touch(blob_key)
+            os.remove(source_path)
+        else:
+            self.backend.put(blob_key, source_path)
+        with self._lock:
+            self.metrics["uploads"] += 1
+            if deduplicated:
+                self.metrics["deduplicated"] += 1
+        return f"{digest}-{upload_id}.{extension}"
+
+    def path(self, input_filename):
+        """
+        Local path of an upload's blob, fetched from a remote backend on first use.
+        Derived files (e.g. the segmentation mask) may be stored next to it with the blob's
+        name as prefix; collect() removes them with the blob.
+        Raises:
+            ValueError: Invalid name.
+            FileNotFoundError: Unknown or expired upload.
+        """
+        digest, upload_id, extension = self.parse(input_filename)
+        if not self.backend.exists(self.ref_key(digest, upload_id)):
+            raise FileNotFoundError(input_filename)
+        blob_key = self.blob_key(digest, extension)
+        path = self.backend.local_path(blob_key)
+        if path is None:
+            path = os.path.join(self.local_dir, *blob_key.split('/'))
+            if not os.path.isfile(path):
+                self.backend.fetch(blob_key, path)
+        return path
+
+    def collect(self):
+        """
+        Expires old references, then removes the blobs without references and their derived
+        files. Safe to run on several replicas at once.
+        """
+        now = time.time()
+        references = {} # sha256 -> reference count
+        expired = 0
+        for key, mtime, _ in self.backend.list(REFS_PREFIX):
+            digest = key.split('/')[3]
+            if (now - mtime) > self.max_age_seconds:
+                self.backend.delete(key)
+                expired += 1
+            else:
+                references[digest] = references.get(digest, 0) + 1
+
+        removed = stored_files = stored_bytes = 0
+        for key, mtime, size in list(self.backend.list()):
+            if key.startswith(REFS_PREFIX):
+                continue
+            digest = key.rsplit('/', 1)[-1].split('.', 1)[0]
+            if digest in references or (now - mtime) <= self.min_age_seconds:
+                stored_files += 1
+                stored_bytes += size
+                continue
+            if next(iter(self.backend.list(self.ref_key(digest))), None) is not None:
+                references[digest] = 1 # Uploaded again since the references were listed
+                continue
+            self.backend.delete(key)
+            removed += 1
+
+        if self.backend.local_path('') is None:
+            # Remote backend: fetched copies and derived files live only in local_dir
+            for entry in walk_files(self.local_dir):
+                digest = entry.name.split('.', 1)[0]
+                if digest in references:
+                    continue
+                try:
+                    if (now - entry.stat().st_mtime) > self.min_age_seconds:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        with self._lock:
+            self.metrics["references"] = sum(references.values())
+            self.metrics["stored_files"] = stored_files
+            self.metrics["stored_bytes"] = stored_bytes
+            self.metrics["expired_references"] += expired
+            self.metrics["removed_blobs"] += removed
+        if expired or removed:
+            logger.info(f"Upload store: {expired} references expired, {removed} unreferenced files removed.")
+
+    def stats(self):
+        """Returns the upload/deduplication counters and the reference and file counts of the last collect()."""
+        with self._lock:
+            stats = dict(self.metrics)
+        stats["dedup_ratio"] = (stats["deduplicated"] / stats["uploads"]) if stats["uploads"] else 0.0
+        return stats
@@ -0,0 +1,215 @@
+import logging
+import os
+import json
+import time
+import re
+import hashlib
+import threading
+from storage import shard_path, walk_files
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME_RE = re.compile(r'^[0-9a-f]{64}\.svg$')
+
+
+class SvgCache:
+    """
+    Deterministic names for generated SVGs, so identical requests reuse earlier results.
+
+    An SVG is stored in the output folder as <key>.svg (in a sharded layout, see path()),
+    where the key is derived from the SHA-256 of the original upload and the normalized
+    vectorization parameters. Moving a slider back to a previous value therefore finds the
+    existing file and skips rembg and the tracer. A hit touches the file, so both the
+    age-based cleanup of the output folder and the size-based eviction here drop the least
+    recently used SVGs first. Precompressed variants (<key>.svg.gz, ...) are touched, counted
+    and evicted together with their SVG.
+
+    SVGs are written by the job workers, size eviction runs in the web process (evict() as a
+    janitor collector). The web process adds the size of each new SVG from the job results
+    (record_put()) and asks the janitor for an early eviction once the limit is crossed.
+    """
+
+    def __init__(self, output_dir, max_age_seconds, max_bytes, variant_suffixes=(), min_age_seconds=60):
+        """
+        Args:
+            output_dir (str): Folder the SVGs are served from (OUTPUT_FOLDER).
+            max_age_seconds (int): Entries older than this count as expired (tied to CLEANUP_AGE_SECONDS).
+            max_bytes (int): Upper bound for the total size of the SVGs in output_dir.
+            variant_suffixes (tuple): Suffixes appended to an SVG's filename for its variants, e.g. ('.gz',).
+            min_age_seconds (int): SVGs younger than this are never evicted, so a fresh result
+                is still there when the client fetches it.
+        """
+        self.output_dir = output_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.variant_suffixes = tuple(variant_suffixes)
+        self.min_age_seconds = min_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None # Measured by evict(), then advanced by record_put() until the next scan
+        os.makedirs(output_dir, exist_ok=True)
+
+    def make_key(self, file_hash, params):
+        """
+        Args:
+            file_hash (str): SHA-256 hex digest of the original upload.
+            params (dict): Normalized parameters that influence the SVG.
+        Returns:
+            str: Hex digest identifying the (content, parameters) pair.
+        """
+        params_json = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{file_hash}:{params_json}".encode()).hexdigest()
+
+    def filename(self, key):
+        return f"{key}.svg"
+
+    def is_cached(self, filename):
+        """True if filename (an SVG or one of its variants) is named after a cache key, not a one-off output."""
+        for suffix in self.variant_suffixes:
+            if filename.endswith('.svg' + suffix):
+                filename = filename[:-len(suffix)]
+                break
+        return bool(CACHE_NAME_RE.match(filename))
+
+    def path(self, filename):
+        """
+        Path of an output file: below output_dir in the sharded layout (ab/cd/<name>), so the
+        folder stays fast to list and clean up. Every file in the output folder is placed this way.
+        """
+        return shard_path(self.output_dir, filename)
+
+    def get(self, key, record=True):
+        """
+        Returns the SVG filename for key if it exists and is not expired, otherwise None.
+        With record=False the lookup is not counted (e.g. the worker re-checking a miss).
+        """
+        svg_path = self.path(self.filename(key))
+        try:
+            if (time.time() - os.path.getmtime(svg_path)) > self.max_age_seconds:
+                raise FileNotFoundError(svg_path) # About to be removed by cleanup, treat as miss
+            os.utime(svg_path, None) # Touch: keeps it from cleanup and makes eviction least-recently-used
+            for suffix in self.variant_suffixes:
+                try:
+                    os.utime(svg_path + suffix, None)
+                except FileNotFoundError:
+                    pass # Not written (e.g. brotli missing), the plain SVG is served instead
+        except OSError:
+            if record:
+                self.record_lookup(False)
+            return None
+        if record:
+            self.record_lookup(True)
+        return self.filename(key)
+
+    def put(self, key, svg_filename):
+        """
+        Moves a freshly generated SVG from the output folder to its deterministic name.
+        Eviction is left to the web process (see evict()).
+        Args:
+            key (str): Key from make_key().
+            svg_filename (str): Name of the generated SVG in output_dir.
+        Returns:
+            str: The filename the SVG is now served under.
+        """
+        cached_filename = self.filename(key)
+        # Atomic, a concurrent job producing the same key simply replaces an identical file
+        cached_path = self.path(cached_filename)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        os.replace(self.path(svg_filename), cached_path)
+        return cached_filename
+
+    def size(self, svg_filename):
+        """Returns the size in bytes of an SVG in the output folder plus its variants (missing files count 0)."""
+        svg_path = self.path(svg_filename)
+        total = 0
+        for path in [svg_path] + [svg_path + suffix for suffix in self.variant_suffixes]:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def record_put(self, size):
+        """
+        Adds the size of an SVG (with its variants) a job stored, in any process, to the tracked total.
+        Returns:
+            bool: True if this put pushed the cache over max_bytes and evict() should run.
+        """
+        with self._lock:
+            if self._total_bytes is None:
+                return False # Not measured yet, the janitor's first sweep does that
+            previous = self._total_bytes
+            self._total_bytes += size
+            return previous <= self.max_bytes < self._total_bytes
+
+    def evict(self):
+        """
+        Removes the least recently used SVGs and their variants until the size limit holds, never
+        ones younger than min_age_seconds. Walks the whole output tree, so it is run by the
+        janitor in the web process, not per request.
+        """
+        now = time.time()
+        entries = {} # SVG name -> [mtime, total size of the SVG and its variants, paths]
+        total_bytes = 0
+        try:
+            for entry in walk_files(self.output_dir):
+                name = entry.name
+                for suffix in self.variant_suffixes:
+                    if name.endswith('.svg' + suffix):
+                        name = name[:-len(suffix)]
+                        break
+                if not name.endswith('.svg'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                group = entries.setdefault(name, [0.0, 0, []])
+                if name == entry.name:
+                    group[0] = stat.st_mtime # The SVG's access time orders the whole group
+                group[1] += stat.st_size
+                group[2].append(entry.path)
+                total_bytes += stat.st_size
+        except OSError as e:
+            logger.warning(f"Could not scan SVG cache {self.output_dir}: {e}")
+            return
+
+        if total_bytes > self.max_bytes:
+            for name, (mtime, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]): # Oldest access first
+                if total_bytes <= self.max_bytes or (now - mtime) < self.min_age_seconds:
+                    break # Sorted by access time: every remaining SVG is younger
+                try:
+                    for path in paths:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass # Removed concurrently by cleanup or another worker
+                    with self._lock:
+                        self.evictions += 1
+                except OSError as e:
+                    logger.warning(f"Could not evict SVG {name}: {e}")
+                    continue
+                total_bytes -= size
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def record_lookup(self, hit):
+        """Counts a lookup, also used for lookups that happened in another process."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,306 @@
+import os
+import re
+import gzip
+import logging
+import xml.etree.ElementTree as ET
+
+try:
+    import brotli
+except ImportError: # Optional, only the gzip variant is written without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+ET.register_namespace('', SVG_NS) # Serialize as <svg xmlns="...">, not <ns0:svg>
+
+PATH_TOKEN_RE = re.compile(r'[A-Za-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+TRANSLATE_RE = re.compile(r'^\s*translate\(\s*([-+\d.eE]+)(?:[\s,]+([-+\d.eE]+))?\s*\)\s*$')
+HEX_COLOR_RE = re.compile(r'^#([0-9a-fA-F]{6})$')
+
+# Coordinates per segment for the path commands that are rewritten (arcs are left alone)
+COMMAND_ARITY = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'Z': 0}
+
+# Attributes whose value is the SVG default (or that renderers ignore), dropped wherever they appear
+DEFAULT_ATTRIBUTES = {
+    'version': None, # Any value
+    'stroke': 'none',
+    'fill-rule': 'nonzero',
+    'fill-opacity': '1',
+    'opacity': '1',
+    'preserveAspectRatio': 'xMidYMid meet',
+}
+DROPPED_ELEMENTS = {'metadata'}
+
+# Content-Encoding -> suffix of the precompressed variant (<name>.svg.gz), in order of preference
+CONTENT_CODINGS = {'br': '.br', 'gzip': '.gz'}
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9 # 11 is only marginally smaller for SVG and several times slower
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else None
+
+
+def _format_number(value, precision):
+    text = f"{value:.{precision}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        return '0'
+    if text.startswith('0.'):
+        return text[1:]
+    if text.startswith('-0.'):
+        return '-' + text[2:]
+    return text
+
+
+class _PathWriter:
+    """Collects path commands and writes them with the fewest separators the grammar allows."""
+
+    def __init__(self, precision):
+        self.precision = precision
+        self.parts = []
+        self.command = None # Last command letter written
+        self.number = None # Last number written since that letter
+
+    def write(self, letter, values):
+        # A repeated command letter may be omitted, except after a moveto where pairs mean lineto
+        if letter != self.command or letter in ('m', 'M', 'z'):
+            self.parts.append(letter)
+            self.command = letter
+            self.number = None
+        for value in values:
+            number = _format_number(value / 10 ** self.precision, self.precision)
+            # '-' and a second '.' already end the previous number
+            if self.number is not None and not (number[0] == '-' or (number[0] == '.' and '.' in self.number)):
+                self.parts.append(' ')
+            self.parts.append(number)
+            self.number = number
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def optimize_path_data(d, precision, offset=(0.0, 0.0)):
+    """
+    Rewrites path data with coordinates rounded to precision decimals.
+
+    Every segment after the first moveto is written in relative form, with the deltas taken
+    between already rounded absolute points, so rounding errors do not add up along the path.
+    Repeated command letters are omitted and lines that have zero length after rounding dropped.
+    Args:
+        d (str): The path's d attribute.
+        precision (int): Decimals to keep.
+        offset (tuple): (x, y) translation to bake into the coordinates.
+    Returns:
+        str: The new path data, starting with an absolute M, or None if the path cannot be
+            rewritten (arcs or malformed data) and should be kept as it is.
+    """
+    tokens = PATH_TOKEN_RE.findall(d)
+    scale = 10 ** precision
+    writer = _PathWriter(precision)
+    # Current point and subpath start, exact and rounded (in units of 10^-precision)
+    x, y = offset
+    rx, ry = round(x * scale), round(y * scale)
+    start = (x, y, rx, ry)
+    command = None
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command.upper() not in COMMAND_ARITY:
+                return None
+            if command.upper() == 'Z':
+                x, y, rx, ry = start
+                writer.write('z', ())
+                continue
+        elif command is None or command.upper() == 'Z':
+            return None # Numbers without a command
+        upper = command.upper()
+        arity = COMMAND_ARITY[upper]
+        values = tokens[i:i + arity]
+        if len(values) < arity or any(v.isalpha() for v in values):
+            return None
+        i += arity
+        values = [float(v) for v in values]
+
+        # Absolute (offset applied) coordinates of the points of this segment
+        base_x, base_y = (x, y) if command.islower() else offset
+        if upper == 'H':
+            points = [(base_x + values[0], y)]
+        elif upper == 'V':
+            points = [(x, base_y + values[0])]
+        else:
+            points = [(base_x + values[k], base_y + values[k + 1]) for k in range(0, arity, 2)]
+        snapped = [(round(px * scale), round(py * scale)) for px, py in points]
+        end_rx, end_ry = snapped[-1]
+
+        if upper == 'M':
+            if writer.parts:
+                writer.write('m', (end_rx - rx, end_ry - ry))
+            else:
+                writer.write('M', (end_rx, end_ry))
+            start = (points[0][0], points[0][1], end_rx, end_ry)
+            command = 'l' if command == 'm' else 'L' # Further pairs are implicit linetos
+        elif upper in ('L', 'H', 'V'):
+            if (end_rx, end_ry) == (rx, ry) and writer.command not in ('c', 's', 'q', 't'):
+                # Zero length after rounding. Kept after curves, where it stops S/T from reflecting the control point.
+                x, y = points[-1]
+                continue
+            if end_ry == ry:
+                writer.write('h', (end_rx - rx,))
+            elif end_rx == rx:
+                writer.write('v', (end_ry - ry,))
+            else:
+                writer.write('l', (end_rx - rx, end_ry - ry))
+        else:
+            deltas = []
+            for sx, sy in snapped:
+                deltas += [sx - rx, sy - ry]
+            writer.write(upper.lower(), deltas)
+        x, y = points[-1]
+        rx, ry = end_rx, end_ry
+
+    if not writer.parts or writer.parts[0] != 'M':
+        return None
+    return writer.getvalue()
+
+
+def _short_color(value):
+    match = HEX_COLOR_RE.match(value)
+    if match is None:
+        return value
+    digits = match.group(1).lower()
+    if digits[0::2] == digits[1::2]:
+        return '#' + digits[0::2]
+    return '#' + digits
+
+
+def _clean_element(element, precision):
+    for name in list(element.attrib):
+        value = element.attrib[name].strip()
+        if name in DEFAULT_ATTRIBUTES and DEFAULT_ATTRIBUTES[name] in (None, value):
+            del element.attrib[name]
+        elif name in ('fill', 'stroke'):
+            element.attrib[name] = _short_color(value)
+
+    if _local_name(element.tag) == 'path' and 'd' in element.attrib:
+        offset = (0.0, 0.0)
+        transform = element.attrib.get('transform')
+        if transform is not None:
+            match = TRANSLATE_RE.match(transform)
+            if match is None:
+                return # Other transforms would have to be applied before rounding, leave the path alone
+            offset = (float(match.group(1)), float(match.group(2) or 0))
+        data = optimize_path_data(element.attrib['d'], precision, offset)
+        if data is not None:
+            element.attrib['d'] = data
+            element.attrib.pop('transform', None) # Baked into the coordinates
+
+
+def _mergeable(element):
+    # Rewritten paths only (they start with an absolute M), without children or a transform;
+    # with even-odd filling, overlapping shapes would punch holes into each other once merged
+    return (_local_name(element.tag) == 'path' and len(element) == 0
+            and element.attrib.get('d', '').startswith('M')
+            and 'transform' not in element.attrib and element.attrib.get('fill-rule') != 'evenodd')
+
+
+def _merge_paths(parent):
+    """Joins consecutive sibling paths with identical attributes (except d) into one path."""
+    previous = None
+    for child in list(parent):
+        if not _mergeable(child):
+            previous = None
+            continue
+        attributes = {name: value for name, value in child.attrib.items() if name != 'd'}
+        if previous is not None and attributes == previous[1]:
+            # Only direct neighbours, so the painting order stays the same
+            previous[0].attrib['d'] += child.attrib['d']
+            parent.remove(child)
+        else:
+            previous = (child, attributes)
+
+
+def optimize_svg(svg_text, precision):
+    """
+    Shrinks a traced SVG without changing what it shows (beyond rounding).
+
+    Translations on paths are baked into the coordinates, coordinates are rounded to
+    precision decimals, consecutive paths with the same fill are merged, default attributes,
+    metadata, comments, the XML declaration and whitespace between elements are removed.
+    Args:
+        svg_text (str): The SVG document.
+        precision (int): Decimals to keep for path coordinates.
+    Returns:
+        str: The optimized document.
+    """
+    root = ET.fromstring(svg_text) # Comments and the doctype are not kept by the parser
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if _local_name(child.tag) in DROPPED_ELEMENTS:
+                parent.remove(child)
+    for element in root.iter():
+        _clean_element(element, precision)
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    for element in root.iter():
+        _merge_paths(element)
+    # ElementTree writes empty elements as <path ... />, the space is not needed
+    return ET.tostring(root, encoding='unicode').replace(' />', '/>')
+
+
+def optimize_file(svg_path, precision):
+    """
+    Optimizes an SVG file in place, see optimize_svg().
+    Returns:
+        tuple: (bytes before, bytes after). Both are the old size if the file could not be
+            parsed, it is then left unchanged.
+    """
+    with open(svg_path, 'r', encoding='utf-8') as f:
+        svg_text = f.read()
+    size_before = len(svg_text.encode('utf-8'))
+    try:
+        optimized = optimize_svg(svg_text, precision)
+    except ET.ParseError as e:
+        logger.warning(f"Could not parse {svg_path} for optimization, keeping it unchanged: {e}")
+        return size_before, size_before
+    data = optimized.encode('utf-8')
+    with open(svg_path, 'wb') as f:
+        f.write(data)
+    return size_before, len(data)
+
+
+def variant_paths(svg_path):
+    """Returns the paths of the precompressed variants of an SVG as {content_coding: path}."""
+    return {coding: svg_path + suffix for coding, suffix in CONTENT_CODINGS.items()}
+
+
+def precompress(svg_path):
+    """
+    Writes <svg_path>.gz and, if the brotli module is installed, <svg_path>.br, so they can be
+    served with a Content-Encoding instead of being compressed on every request. Each file is
+    written under a temporary name and renamed, concurrent jobs for the same SVG cannot leave a
+    truncated variant behind.
+    Returns:
+        list: Paths of the variants written.
+    """
+    with open(svg_path, 'rb') as f:
+        data = f.read()
+    encoders = {'gzip': lambda raw: gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encoders['br'] = lambda raw: brotli.compress(raw, quality=BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+    written = []
+    for coding, path in variant_paths(svg_path).items():
+        if coding not in encoders:
+            continue
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(encoders[coding](data))
+        os.replace(temp_path, path)
+        written.append(path)
+    return written
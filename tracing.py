@@ -0,0 +1,197 @@
+import io
+import os
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('auto', 'python', 'cli')
+
+
+class Tracer:
+    """
+    The backend chosen at startup for one tracing tool (potrace or vtracer).
+
+    'python' traces in the calling process through the tool's Python bindings, which avoids
+    the fork/exec and the temp file round trip that dominate for small images. 'cli' runs the
+    executable as before. The executable is resolved once here instead of on every request,
+    and stays the fallback when the bindings fail.
+    """
+
+    def __init__(self, tool, backend, executable, binding=None):
+        """
+        Args:
+            tool (str): 'potrace' or 'vtracer'.
+            backend (str): 'python' or 'cli'.
+            executable (str): Path of the CLI, None if it is not installed.
+            binding (module): The imported bindings for the 'python' backend, otherwise None.
+        """
+        self.tool = tool
+        self.backend = backend
+        self.executable = executable
+        self.binding = binding
+        self._executable_id = _file_id(executable)
+
+    @property
+    def available(self):
+        return self.binding is not None or self.executable is not None
+
+    def fingerprint(self):
+        """
+        What decides this backend's output, for cache keys: the backend, the bindings' name and
+        version, and the CLI's path, size and mtime (potrace and vtracer share no version flag,
+        an upgraded executable changes at least its mtime).
+        """
+        return {
+            "backend": self.backend if self.available else None,
+            "binding": _binding_name(self.binding),
+            "executable": self._executable_id,
+        }
+
+    def to_dict(self):
+        return {
+            "backend": self.backend if self.available else None,
+            "executable": self.executable,
+            "binding": _binding_name(self.binding),
+        }
+
+
+def _file_id(path):
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _binding_name(binding):
+    if binding is None:
+        return None
+    version = getattr(binding, '__version__', None)
+    name = 'potracer' if binding.__name__ == 'potrace' and _potrace_is_pure_python(binding) else binding.__name__
+    return f"{name} {version}" if version else name
+
+
+def _potrace_is_pure_python(binding):
+    # pypotrace is a C extension (potrace._potrace); potracer is a pure Python port with the same API
+    return binding.Bitmap.__module__ == 'potrace.potrace'
+
+
+def _import_binding(tool):
+    try:
+        if tool == 'vtracer':
+            import vtracer
+            return vtracer
+        import potrace
+        return potrace
+    except ImportError:
+        return None
+
+
+def select_tracer(tool, preference='auto'):
+    """
+    Chooses the backend for a tool.
+    Args:
+        tool (str): 'potrace' or 'vtracer'.
+        preference (str): 'auto' uses the bindings when they are installed (for potrace only the
+            compiled pypotrace, the pure Python potracer is slower than the CLI on large bitmaps),
+            'python' always uses installed bindings, 'cli' never does.
+    Returns:
+        Tracer: The selected backend.
+    """
+    executable = shutil.which(tool)
+    binding = _import_binding(tool) if preference != 'cli' else None
+    if binding is not None and tool == 'potrace' and preference == 'auto' and _potrace_is_pure_python(binding):
+        binding = None
+    if binding is None and preference == 'python':
+        logger.warning(f"Python bindings for {tool} are not installed, using the CLI.")
+    return Tracer(tool, 'python' if binding is not None else 'cli', executable, binding)
+
+
+# The binding's keyword arguments -> the CLI's option names, which differ for two of them.
+# max_iterations has no CLI option.
+VTRACER_CLI_OPTIONS = {
+    'colormode': 'colormode',
+    'hierarchical': 'hierarchical',
+    'mode': 'mode',
+    'filter_speckle': 'filter_speckle',
+    'color_precision': 'color_precision',
+    'layer_difference': 'gradient_step',
+    'corner_threshold': 'corner_threshold',
+    'length_threshold': 'segment_length',
+    'splice_threshold': 'splice_threshold',
+    'path_precision': 'path_precision',
+}
+
+
+def vtracer_cli_args(params):
+    """
+    Turns vtracer keyword parameters (the binding's names) into CLI options,
+    e.g. {'mode': 'spline', 'layer_difference': 24} -> ['--mode', 'spline', '--gradient_step', '24'].
+    Raises:
+        ValueError: For a parameter the CLI has no option for.
+    """
+    args = []
+    for name, value in params.items():
+        if name not in VTRACER_CLI_OPTIONS:
+            raise ValueError(f"vtracer CLI has no option for '{name}'")
+        args += [f'--{VTRACER_CLI_OPTIONS[name]}', str(value)]
+    return args
+
+
+def vtracer_svg(binding, image, params):
+    """
+    Traces an RGBA image with the vtracer bindings.
+    Args:
+        binding (module): The vtracer module.
+        image (PIL.Image.Image): RGBA image.
+        params (dict): vtracer keyword parameters (colormode, color_precision, ...), see VTRACER_CLI_OPTIONS for the CLI names.
+    Returns:
+        str: The SVG document.
+    """
+    # Handed over as an in-memory PNG; compress_level=1 is cheap to encode and to decode
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return binding.convert_raw_image_to_svg(buffer.getvalue(), img_format='png', **params)
+
+
+def _xy(point):
+    # pypotrace returns tuples, potracer point objects
+    return (point.x, point.y) if hasattr(point, 'x') else (point[0], point[1])
+
+
+def potrace_svg(binding, foreground, turdsize=2):
+    """
+    Traces a binary bitmap with the potrace bindings, using the same defaults as the CLI
+    (turdsize 2, alphamax 1.0, curve optimization on).
+    Args:
+        binding (module): The potrace module (pypotrace or potracer).
+        foreground (numpy.ndarray): 2D bool array, True where potrace should fill (black).
+        turdsize (int): Speckles up to this many pixels are dropped (the CLI's -t).
+    Returns:
+        str: The SVG document, one black even-odd filled path.
+    """
+    # potracer fills the False pixels, pypotrace the True ones
+    bitmap = binding.Bitmap(~foreground if _potrace_is_pure_python(binding) else foreground)
+    height, width = foreground.shape
+    commands = []
+    for curve in bitmap.trace(turdsize=turdsize):
+        x, y = _xy(curve.start_point)
+        commands.append(f"M{x:.2f},{y:.2f}")
+        for segment in curve:
+            end_x, end_y = _xy(segment.end_point)
+            if segment.is_corner:
+                corner_x, corner_y = _xy(segment.c)
+                commands.append(f"L{corner_x:.2f},{corner_y:.2f}L{end_x:.2f},{end_y:.2f}")
+            else:
+                (x1, y1), (x2, y2) = _xy(segment.c1), _xy(segment.c2)
+                commands.append(f"C{x1:.2f},{y1:.2f} {x2:.2f},{y2:.2f} {end_x:.2f},{end_y:.2f}")
+        commands.append("Z")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n'
+        f'<path fill="#000000" fill-rule="evenodd" d="{"".join(commands)}"/>\n'
+        '</svg>\n'
+    )
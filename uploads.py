@@ -0,0 +1,110 @@
+import os
+import warnings
+from PIL import Image
+
+COPY_CHUNK_BYTES = 1024 * 1024
+SNIFF_BYTES = 12 # Enough for the PNG, JPEG and WebP signatures
+
+# Pillow format name per sniffed format
+PILLOW_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+class UploadRejected(Exception):
+    """An upload was refused before it was decoded; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class FileTooLargeError(UploadRejected):
+    """Raised by copy_limited() when the input exceeds the per-file size limit."""
+
+    def __init__(self, message):
+        super().__init__(message, status=413)
+
+
+def sniff_format(header):
+    """
+    Identifies an image by its magic bytes instead of trusting the file extension.
+    Args:
+        header (bytes): The first SNIFF_BYTES bytes of the file.
+    Returns:
+        str: 'png', 'jpeg' or 'webp', or None for anything else.
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def copy_limited(stream, path, max_bytes, prefix=b'', hasher=None):
+    """
+    Copies a file-like object to path, aborting once it exceeds max_bytes.
+    Args:
+        prefix (bytes): Data already read from stream (e.g. for sniffing), written first.
+        hasher: hashlib object updated with everything written, so the content is hashed
+            without reading the file a second time.
+    Raises:
+        FileTooLargeError: If the input is larger than max_bytes (the partial file is removed).
+    """
+    written = 0
+    try:
+        with open(path, 'wb') as f:
+            chunk = prefix or stream.read(COPY_CHUNK_BYTES)
+            while chunk:
+                written += len(chunk)
+                if max_bytes and written > max_bytes:
+                    raise FileTooLargeError(f"File exceeds the limit of {max_bytes} bytes.")
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                chunk = stream.read(COPY_CHUNK_BYTES)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return written
+
+
+def store_upload(stream, path, max_bytes, max_pixels, hasher=None):
+    """
+    Streams an uploaded image to path and validates it without decoding the pixels:
+    the magic bytes are checked before anything is written, the dimensions are read
+    from the image header afterwards.
+    Args:
+        stream: File-like object with the upload.
+        path (str): Destination file.
+        max_bytes (int): Size limit of the file, 0 for none.
+        max_pixels (int): Limit for width * height, 0 for none.
+        hasher: Optional hashlib object that receives the file content, see copy_limited().
+    Returns:
+        tuple: (width, height) of the image.
+    Raises:
+        UploadRejected: Unsupported or corrupt file (400), too many bytes or pixels (413).
+            Nothing is left at path in that case.
+    """
+    header = stream.read(SNIFF_BYTES)
+    image_format = sniff_format(header)
+    if image_format is None:
+        raise UploadRejected("File is not a PNG, JPEG or WebP image.")
+    copy_limited(stream, path, max_bytes, prefix=header, hasher=hasher)
+    try:
+        # Image.open() only parses the header, the pixel data is decoded later by the job
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning) # Checked against max_pixels below
+            with Image.open(path, formats=[PILLOW_FORMATS[image_format]]) as image:
+                size = image.size
+    except Image.DecompressionBombError as e:
+        os.remove(path)
+        raise UploadRejected(f"Image has too many pixels: {e}", status=413) from e
+    except Exception as e:
+        os.remove(path)
+        raise UploadRejected(f"Invalid {image_format.upper()} image.") from e
+    if max_pixels and size[0] * size[1] > max_pixels:
+        os.remove(path)
+        raise UploadRejected(f"Image is {size[0]}x{size[1]} pixels, the limit is {max_pixels} pixels.", status=413)
+    return size